@@ -0,0 +1,127 @@
+"""
+Carga sobre as rotas com leitura coalescida (/produtos/get_by_id e /variacoes/get_by_produto):
+clientes simultâneos pedem produtos escolhidos com distribuição de Zipf, como em um catálogo
+com poucos itens muito acessados. Cada leitura no banco recebe uma latência fixa, que simula
+um Mongo na rede. Mede as leituras que chegam ao banco com e sem coalescência, com o cache
+HTTP ligado e desligado.
+
+    python -m benchmarks.coalescencia [--requisicoes 4000] [--concorrencia 200] [--latencia-ms 5]
+
+Usa o mongomock-motor (o mesmo dos testes) no lugar do banco.
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import Any, Callable, Dict, List
+import httpx
+import mongomock_motor
+from fastapi import FastAPI
+import cache_http
+import routes.produtos as rotas_produtos
+import routes.variacao_produto as rotas_variacoes
+
+PRODUTOS = 200
+VARIACOES_POR_PRODUTO = 3
+EXPOENTE_ZIPF = 1.1
+
+
+class ColecaoComLatencia:
+    """Coleção que atrasa e conta cada ida ao banco (find_one e find(...).to_list)."""
+
+    def __init__(self, colecao, latencia: float):
+        self._colecao = colecao
+        self._latencia = latencia
+        self.leituras = 0
+
+    async def _ida_ao_banco(self, leitura: Callable[[], Any]) -> Any:
+        self.leituras += 1
+        await asyncio.sleep(self._latencia)
+        return await leitura()
+
+    async def find_one(self, *args, **kwargs):
+        return await self._ida_ao_banco(lambda: self._colecao.find_one(*args, **kwargs))
+
+    def find(self, *args, **kwargs):
+        colecao = self
+
+        class Cursor:
+            async def to_list(self, length=None):
+                return await colecao._ida_ao_banco(lambda: colecao._colecao.find(*args, **kwargs).to_list(length))
+
+        return Cursor()
+
+
+async def _popular(db) -> List[str]:
+    produtos = await db.produtos.insert_many([
+        {"nome": f"Produto {i}", "descricao": "", "preco_base": 10.0, "categoria": "Decoração"}
+        for i in range(PRODUTOS)
+    ])
+    await db.variacoes_produto.insert_many([
+        {"produto_id": produto_id, "sku": f"SKU-{i}-{j}", "atributos": {}, "preco_adicional": 0.0, "estoque": 1, "urls_imagens": []}
+        for i, produto_id in enumerate(produtos.inserted_ids)
+        for j in range(VARIACOES_POR_PRODUTO)
+    ])
+    return [str(produto_id) for produto_id in produtos.inserted_ids]
+
+
+async def _rodada(app: FastAPI, rota: str, ids: List[str], amostra: List[int], concorrencia: int) -> float:
+    limite = asyncio.Semaphore(concorrencia)
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://benchmark") as cliente:
+        async def requisitar(indice: int) -> None:
+            async with limite:
+                resposta = await cliente.get(f"{rota}/{ids[indice]}")
+                resposta.raise_for_status()
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(requisitar(indice) for indice in amostra))
+        return time.perf_counter() - inicio
+
+
+async def executar(requisicoes: int, concorrencia: int, latencia: float) -> None:
+    db = mongomock_motor.AsyncMongoMockClient()["benchmark_coalescencia"]
+    ids = await _popular(db)
+    produtos = ColecaoComLatencia(db.produtos, latencia)
+    variacoes = ColecaoComLatencia(db.variacoes_produto, latencia)
+    rotas_produtos.produtos_collection = produtos
+    rotas_variacoes.variacao_collection = variacoes
+
+    app = FastAPI()
+    app.include_router(rotas_produtos.router)
+    app.include_router(rotas_variacoes.router)
+
+    aleatorio = random.Random(1)
+    pesos = [1 / posicao ** EXPOENTE_ZIPF for posicao in range(1, PRODUTOS + 1)]
+    amostra = aleatorio.choices(range(PRODUTOS), weights=pesos, k=requisicoes)
+
+    cenarios: Dict[str, Any] = {
+        "/produtos/get_by_id": (rotas_produtos.leituras_produto, produtos),
+        "/variacoes/get_by_produto": (rotas_variacoes.leituras_variacoes, variacoes),
+    }
+    print(f"{requisicoes} requisições, {concorrencia} simultâneas, {latencia * 1000:.0f} ms por leitura")
+    print(f"{'rota':28} {'cache':6} {'coalescência':13} {'leituras':>8} {'tempo':>7}")
+    for rota, (grupo, colecao) in cenarios.items():
+        for com_cache in (False, True):
+            for coalescer in (False, True):
+                # Sem entradas no LRU nada fica guardado: equivale ao cache desligado
+                cache_http.cache = cache_http.CacheMemoria(max_entradas=cache_http.CACHE_MAX_ENTRADAS if com_cache else 0)
+                if coalescer:
+                    grupo.__dict__.pop("executar", None)
+                else:
+                    async def direto(chave, funcao):
+                        return await funcao()
+                    grupo.executar = direto
+                colecao.leituras = 0
+                duracao = await _rodada(app, rota, ids, amostra, concorrencia)
+                print(f"{rota:28} {'sim' if com_cache else 'não':6} {'sim' if coalescer else 'não':13} {colecao.leituras:8} {duracao:6.2f}s")
+        grupo.__dict__.pop("executar", None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requisicoes", type=int, default=4000)
+    parser.add_argument("--concorrencia", type=int, default=200)
+    parser.add_argument("--latencia-ms", type=float, default=5.0)
+    argumentos = parser.parse_args()
+    asyncio.run(executar(argumentos.requisicoes, argumentos.concorrencia, argumentos.latencia_ms / 1000))
@@ -0,0 +1,97 @@
+"""
+Checkouts simultâneos disputando um SKU com pouco estoque, contra um servidor Mongo real
+(o mongomock executa uma operação por vez e não reproduz a disputa). Compara o fluxo antigo
+de criar_pedido, que lê o estoque de cada item, confere e só depois abate com `$inc`
+incondicional, com a reserva de `services.estoque` (`$inc` condicional em um bulk_write,
+confirmação em outro). Mede pedidos aceitos, unidades vendidas além do estoque e o tempo.
+
+    MONGO_URL_BENCHMARK=mongodb://localhost:27017 python -m benchmarks.estoque [--pedidos 2000] [--concorrencia 200] [--estoque 500]
+
+Usa um banco descartável, removido ao final.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from typing import Awaitable, Callable, Dict
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from services.estoque import EstoqueInsuficiente, confirmar_reserva, reservar_estoque
+
+MONGO_URL_BENCHMARK = os.getenv("MONGO_URL_BENCHMARK")
+
+
+async def checkout_sequencial(colecao: AsyncIOMotorCollection, quantidades: Dict[str, int]) -> bool:
+    # Fluxo anterior: confere o estoque lido de cada item e abate depois, sem condição
+    for sku, quantidade in quantidades.items():
+        variacao = await colecao.find_one({"sku": sku})
+        if variacao.get("estoque", 0) < quantidade:
+            return False
+    for sku, quantidade in quantidades.items():
+        await colecao.update_one({"sku": sku}, {"$inc": {"estoque": -quantidade}})
+    return True
+
+
+async def checkout_com_reserva(colecao: AsyncIOMotorCollection, quantidades: Dict[str, int]) -> bool:
+    reserva_id = ObjectId()
+    try:
+        await reservar_estoque(colecao, reserva_id, quantidades)
+    except EstoqueInsuficiente:
+        return False
+    await confirmar_reserva(colecao, reserva_id, quantidades)
+    return True
+
+
+async def _rodada(
+    colecao: AsyncIOMotorCollection,
+    checkout: Callable[[AsyncIOMotorCollection, Dict[str, int]], Awaitable[bool]],
+    pedidos: int,
+    concorrencia: int,
+    estoque: int
+) -> None:
+    await colecao.delete_many({})
+    await colecao.insert_many([{"sku": "QUENTE", "estoque": estoque}, {"sku": "OUTRO", "estoque": 10 ** 9}])
+    limite = asyncio.Semaphore(concorrencia)
+
+    async def comprar(indice: int) -> int:
+        unidades = 1 + indice % 3
+        async with limite:
+            return unidades if await checkout(colecao, {"QUENTE": unidades, "OUTRO": 1}) else 0
+
+    inicio = time.perf_counter()
+    vendidas = await asyncio.gather(*(comprar(indice) for indice in range(pedidos)))
+    duracao = time.perf_counter() - inicio
+    final = (await colecao.find_one({"sku": "QUENTE"}))["estoque"]
+    aceitos = sum(1 for unidades in vendidas if unidades)
+    print(
+        f"{checkout.__name__:22} {aceitos:8} {sum(vendidas):9} {max(0, sum(vendidas) - estoque):10} "
+        f"{final:13} {pedidos / duracao:10.0f}"
+    )
+
+
+async def executar(pedidos: int, concorrencia: int, estoque: int) -> None:
+    cliente = AsyncIOMotorClient(MONGO_URL_BENCHMARK, maxPoolSize=concorrencia)
+    nome = f"benchmark_estoque_{uuid.uuid4().hex[:8]}"
+    colecao = cliente[nome].variacoes_produto
+    await colecao.create_index("sku", unique=True)
+    print(f"{pedidos} pedidos de 1 a 3 unidades, {concorrencia} simultâneos, estoque inicial {estoque}")
+    print(f"{'fluxo':22} {'aceitos':>8} {'vendidas':>9} {'excedente':>10} {'estoque final':>13} {'pedidos/s':>10}")
+    try:
+        for checkout in (checkout_sequencial, checkout_com_reserva):
+            await _rodada(colecao, checkout, pedidos, concorrencia, estoque)
+    finally:
+        await cliente.drop_database(nome)
+        cliente.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pedidos", type=int, default=2000)
+    parser.add_argument("--concorrencia", type=int, default=200)
+    parser.add_argument("--estoque", type=int, default=500)
+    argumentos = parser.parse_args()
+    if not MONGO_URL_BENCHMARK:
+        sys.exit("Defina MONGO_URL_BENCHMARK com a URL de um servidor Mongo.")
+    asyncio.run(executar(argumentos.pedidos, argumentos.concorrencia, argumentos.estoque))
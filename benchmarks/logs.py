@@ -0,0 +1,119 @@
+"""
+Travamento do event loop causado pelos logs em arquivo: requisições simuladas registram
+algumas linhas cada, a uma taxa fixa, enquanto uma tarefa de batimento mede o atraso do loop
+(quanto cada `sleep` de 1 ms acorda depois do previsto). Compara o FileHandler síncrono usado
+antes (uma escrita e um flush por registro, na thread do loop) com `logger.get_logger`
+(fila + escritor em segundo plano).
+
+    python -m benchmarks.logs [--taxa 5000] [--duracao 3] [--linhas-por-requisicao 3] [--atraso-flush-ms 0]
+
+Os arquivos são gravados em um diretório temporário, descartado ao final. `--atraso-flush-ms`
+acrescenta uma espera a cada flush dos handlers, simulando um disco lento ou de rede.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List
+import logger as modulo_logger
+
+BATIMENTO = 0.001
+
+
+def _logger_sincrono(nome: str, caminho: str) -> logging.Logger:
+    # Mesmo handler do logger.get_logger original
+    logger = logging.getLogger(nome)
+    logger.setLevel(logging.INFO)
+    logger.handlers.clear()
+    handler = logging.FileHandler(caminho, mode="a", encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y/%m/%d %H:%M:%S"))
+    logger.addHandler(handler)
+    return logger
+
+
+async def _medir(logger: logging.Logger, taxa: int, duracao: float, linhas: int) -> Dict[str, float]:
+    atrasos: List[float] = []
+    tempo_em_log = 0.0
+    registros = 0
+    fim = time.perf_counter() + duracao
+
+    async def batimento():
+        while time.perf_counter() < fim:
+            previsto = time.perf_counter() + BATIMENTO
+            await asyncio.sleep(BATIMENTO)
+            atrasos.append(max(0.0, time.perf_counter() - previsto))
+
+    async def requisicao(numero: int):
+        nonlocal tempo_em_log, registros
+        for linha in range(linhas):
+            inicio = time.perf_counter()
+            logger.info("Requisição %s: etapa %s concluída para o produto %s.", numero, linha, "665f1c2e9b1e8a3d4c5b6a79")
+            tempo_em_log += time.perf_counter() - inicio
+            registros += 1
+            await asyncio.sleep(0)
+
+    async def gerar_carga():
+        numero = 0
+        inicio = time.perf_counter()
+        tarefas = []
+        while time.perf_counter() < fim:
+            devidas = int((time.perf_counter() - inicio) * taxa)
+            while numero < devidas:
+                tarefas.append(asyncio.create_task(requisicao(numero)))
+                numero += 1
+            await asyncio.sleep(BATIMENTO)
+        await asyncio.gather(*tarefas)
+        return numero
+
+    _, requisicoes = await asyncio.gather(batimento(), gerar_carga())
+    atrasos.sort()
+    return {
+        "requisicoes": requisicoes,
+        "custo_por_registro_us": tempo_em_log / max(registros, 1) * 1e6,
+        "atraso_p50_ms": statistics.median(atrasos) * 1000,
+        "atraso_p99_ms": atrasos[int(len(atrasos) * 0.99) - 1] * 1000,
+        "atraso_max_ms": atrasos[-1] * 1000,
+    }
+
+
+def _atrasar_flush(atraso: float) -> None:
+    flush_original = logging.StreamHandler.flush
+
+    def flush_lento(self):
+        time.sleep(atraso)
+        flush_original(self)
+
+    logging.StreamHandler.flush = flush_lento
+
+
+def executar(taxa: int, duracao: float, linhas: int, atraso_flush: float) -> None:
+    if atraso_flush:
+        _atrasar_flush(atraso_flush)
+    with tempfile.TemporaryDirectory() as diretorio:
+        backends: Dict[str, Callable[[], logging.Logger]] = {
+            "FileHandler síncrono": lambda: _logger_sincrono("benchmark_sincrono", os.path.join(diretorio, "sincrono.log")),
+            "fila + escritor": lambda: modulo_logger.get_logger("benchmark_fila", os.path.join(diretorio, "fila.log")),
+        }
+        print(f"{taxa} requisições/s por {duracao:g} s, {linhas} registros por requisição, flush +{atraso_flush * 1000:g} ms")
+        print(f"{'backend':22} {'req':>6} {'µs/registro':>12} {'atraso p50':>11} {'p99':>8} {'máx':>8}")
+        for nome, criar in backends.items():
+            resultado = asyncio.run(_medir(criar(), taxa, duracao, linhas))
+            print(
+                f"{nome:22} {resultado['requisicoes']:6} {resultado['custo_por_registro_us']:12.1f} "
+                f"{resultado['atraso_p50_ms']:9.2f}ms {resultado['atraso_p99_ms']:6.2f}ms {resultado['atraso_max_ms']:6.2f}ms"
+            )
+        # Esvazia a fila antes de apagar o diretório
+        modulo_logger._obter_escritor().parar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--taxa", type=int, default=5000)
+    parser.add_argument("--duracao", type=float, default=3.0)
+    parser.add_argument("--linhas-por-requisicao", type=int, default=3)
+    parser.add_argument("--atraso-flush-ms", type=float, default=0.0)
+    argumentos = parser.parse_args()
+    executar(argumentos.taxa, argumentos.duracao, argumentos.linhas_por_requisicao, argumentos.atraso_flush_ms / 1000)
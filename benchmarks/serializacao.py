@@ -0,0 +1,91 @@
+"""
+Tempo para servir uma página de listagem pelo caminho padrão (modelos instanciados e
+revalidados pelo response_model) e pelo caminho rápido de `serializacao` (SERIALIZACAO_RAPIDA=1).
+A rota é uma rota FastAPI comum, chamada pelo ASGI sem rede nem banco:
+o tempo medido é o do endpoint mais a serialização da resposta.
+
+    python -m benchmarks.serializacao [--itens-por-pagina 100] [--repeticoes 200]
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+import httpx
+from bson import ObjectId
+from fastapi import Depends, FastAPI
+from models.pedido_model import PedidoOut
+from pagination import PaginatedResponse, PaginationParams
+import serializacao
+
+ITENS_POR_PEDIDO = 5
+
+
+def _pedidos(quantidade: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "_id": ObjectId(),
+            "id_usuario": ObjectId(),
+            "data_pedido": datetime.now(),
+            "valor_total": 500.0,
+            "status": "Pendente",
+            "forma_pagamento": "Pix",
+            "itens": [
+                {
+                    "id_produto": ObjectId(),
+                    "nome_produto": f"Produto {j}",
+                    "sku_selecionado": f"SKU-{j}",
+                    "atributos_selecionados": {"cor": "azul", "tamanho": "M"},
+                    "quantidade": 2,
+                    "preco_unitario": 50.0
+                }
+                for j in range(ITENS_POR_PEDIDO)
+            ]
+        }
+        for _ in range(quantidade)
+    ]
+
+
+def _app(docs: List[Dict[str, Any]]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/pedidos", response_model=PaginatedResponse[PedidoOut])
+    async def listar(pagination: PaginationParams = Depends()):
+        return serializacao.resposta_paginada(PedidoOut, docs, len(docs), pagination)
+
+    return app
+
+
+async def _medir(app: FastAPI, por_pagina: int, repeticoes: int):
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://benchmark") as cliente:
+        url = f"/pedidos?per_page={por_pagina}"
+        corpo = (await cliente.get(url)).json()
+        inicio = time.perf_counter()
+        for _ in range(repeticoes):
+            (await cliente.get(url)).raise_for_status()
+        return (time.perf_counter() - inicio) / repeticoes * 1000, corpo
+
+
+async def executar(por_pagina: int, repeticoes: int) -> None:
+    app = _app(_pedidos(por_pagina))
+    print(f"Página com {por_pagina} pedidos de {ITENS_POR_PEDIDO} itens, {repeticoes} requisições por caminho")
+    corpos = []
+    try:
+        for nome, rapida in (("padrão", False), ("rápido", True)):
+            serializacao.SERIALIZACAO_RAPIDA = rapida
+            duracao, corpo = await _medir(app, por_pagina, repeticoes)
+            corpos.append(corpo)
+            print(f"{nome:8} {duracao:7.2f} ms por requisição")
+    finally:
+        serializacao.SERIALIZACAO_RAPIDA = False
+    print("Corpos idênticos:", all(json.dumps(corpo, sort_keys=True) == json.dumps(corpos[0], sort_keys=True) for corpo in corpos))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--itens-por-pagina", type=int, default=100)
+    parser.add_argument("--repeticoes", type=int, default=200)
+    argumentos = parser.parse_args()
+    asyncio.run(executar(argumentos.itens_por_pagina, argumentos.repeticoes))
@@ -0,0 +1,266 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Set
+from urllib.parse import urlencode
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from logger import get_logger
+
+try:
+    import redis.asyncio as redis_asyncio
+    from redis.exceptions import WatchError
+except ImportError:  # o backend Redis é opcional
+    redis_asyncio = None
+
+    class WatchError(Exception):
+        pass
+
+logger = get_logger("cache_logger", "log/cache.log")
+
+# "memoria" (padrão, por processo) ou "redis" (compartilhado entre processos; requer o pacote redis)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memoria")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "1024"))
+
+
+class RespostaEmCache:
+    def __init__(self, corpo: bytes, tipo: str, etag: str):
+        self.corpo = corpo
+        self.tipo = tipo
+        self.etag = etag
+
+
+class CacheMemoria:
+    """
+    LRU em memória com expiração por entrada, índice de chaves por tag e um contador de
+    geração por tag, incrementado a cada invalidação.
+    """
+
+    def __init__(self, max_entradas: int = CACHE_MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self._entradas: "OrderedDict[str, tuple]" = OrderedDict()
+        self._tags: Dict[str, Set[str]] = {}
+        self._geracoes: Dict[str, int] = {}
+
+    async def geracoes(self, tags: List[str]) -> List[int]:
+        return [self._geracoes.get(tag, 0) for tag in tags]
+
+    async def obter(self, chave: str) -> Optional[RespostaEmCache]:
+        registro = self._entradas.get(chave)
+        if registro is None:
+            return None
+        expira_em, resposta, _ = registro
+        if time.monotonic() >= expira_em:
+            self._remover(chave)
+            return None
+        self._entradas.move_to_end(chave)
+        return resposta
+
+    async def guardar(self, chave: str, resposta: RespostaEmCache, tags: List[str], ttl: int, geracoes: List[int]) -> bool:
+        if await self.geracoes(tags) != geracoes:
+            return False
+        if chave in self._entradas:
+            self._remover(chave)
+        self._entradas[chave] = (time.monotonic() + ttl, resposta, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(chave)
+        while len(self._entradas) > self.max_entradas:
+            self._remover(next(iter(self._entradas)))
+        return True
+
+    async def invalidar(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            self._geracoes[tag] = self._geracoes.get(tag, 0) + 1
+            for chave in self._tags.pop(tag, set()):
+                self._remover(chave)
+
+    def _remover(self, chave: str) -> None:
+        registro = self._entradas.pop(chave, None)
+        if registro is None:
+            return
+        for tag in registro[2]:
+            chaves = self._tags.get(tag)
+            if chaves is not None:
+                chaves.discard(chave)
+                if not chaves:
+                    del self._tags[tag]
+
+
+class CacheRedis:
+    """
+    Backend compartilhado entre processos, para qualquer servidor que fale o protocolo do Redis.
+    Cada resposta é um hash com TTL; cada tag é um set com as chaves que dependem dela e um
+    contador de geração, incrementado a cada invalidação. Recebe o cliente pronto, o que permite usar um substituto local (ex.: fakeredis) em testes.
+    """
+
+    def __init__(self, cliente, prefixo: str = "cache_http:"):
+        self._cliente = cliente
+        self._prefixo = prefixo
+
+    def _chave(self, chave: str) -> str:
+        return f"{self._prefixo}resposta:{chave}"
+
+    def _tag(self, tag: str) -> str:
+        return f"{self._prefixo}tag:{tag}"
+
+    def _geracao(self, tag: str) -> str:
+        return f"{self._prefixo}geracao:{tag}"
+
+    async def geracoes(self, tags: List[str]) -> List[int]:
+        if not tags:
+            return []
+        valores = await self._cliente.mget([self._geracao(tag) for tag in tags])
+        return [int(valor or 0) for valor in valores]
+
+    async def obter(self, chave: str) -> Optional[RespostaEmCache]:
+        dados = await self._cliente.hgetall(self._chave(chave))
+        if not dados:
+            return None
+        return RespostaEmCache(dados[b"corpo"], dados[b"tipo"].decode(), dados[b"etag"].decode())
+
+    async def guardar(self, chave: str, resposta: RespostaEmCache, tags: List[str], ttl: int, geracoes: List[int]) -> bool:
+        chave_redis = self._chave(chave)
+        chaves_geracao = [self._geracao(tag) for tag in tags]
+        async with self._cliente.pipeline(transaction=True) as pipeline:
+            # WATCH nos contadores: uma invalidação entre a conferência e o EXEC descarta a gravação
+            if chaves_geracao:
+                await pipeline.watch(*chaves_geracao)
+                atuais = [int(valor or 0) for valor in await pipeline.mget(chaves_geracao)]
+                if atuais != geracoes:
+                    return False
+            pipeline.multi()
+            pipeline.hset(chave_redis, mapping={"corpo": resposta.corpo, "tipo": resposta.tipo, "etag": resposta.etag})
+            pipeline.expire(chave_redis, ttl)
+            for tag in tags:
+                pipeline.sadd(self._tag(tag), chave_redis)
+                pipeline.expire(self._tag(tag), ttl)
+            try:
+                await pipeline.execute()
+            except WatchError:
+                return False
+        return True
+
+    async def invalidar(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            await self._cliente.incr(self._geracao(tag))
+            chaves = await self._cliente.smembers(self._tag(tag))
+            await self._cliente.delete(self._tag(tag), *chaves)
+
+
+def _criar_backend():
+    if CACHE_BACKEND == "redis":
+        if redis_asyncio is None:
+            logger.error("CACHE_BACKEND=redis, mas o pacote 'redis' não está instalado; usando cache em memória.")
+        else:
+            return CacheRedis(redis_asyncio.from_url(CACHE_REDIS_URL))
+    return CacheMemoria()
+
+
+cache = _criar_backend()
+
+
+async def invalidar_cache(*tags: str) -> None:
+    """
+    Descarta as respostas associadas às tags. Chamado pelas rotas de escrita logo após
+    alterar o banco; falhas do backend são registradas sem interromper a escrita.
+    """
+    try:
+        await cache.invalidar(tags)
+    except Exception as erro:
+        logger.error("Falha ao invalidar o cache para as tags %s: %s", tags, erro)
+
+
+class ConfigCache:
+    def __init__(self, tags: List[str], ttl: int, max_age: int):
+        self.tags = tags
+        self.ttl = ttl
+        self.max_age = max_age
+
+
+def cache_resposta(tags: List[str], ttl: int = CACHE_TTL, max_age: int = 0) -> Callable:
+    """
+    Marca um endpoint GET para ter a resposta guardada em cache (em routers criados com
+    `route_class=RotaComCache`). As tags aceitam parâmetros de caminho, como "produto:{produto_id}".
+    `ttl` é a validade no servidor; `max_age` é o tempo que o cliente pode reutilizar a resposta
+    sem revalidar (0: o cliente sempre revalida com If-None-Match e recebe 304 se nada mudou).
+    """
+    def marcar(endpoint: Callable) -> Callable:
+        endpoint.config_cache = ConfigCache(tags, ttl, max_age)
+        return endpoint
+    return marcar
+
+
+def _etag(corpo: bytes) -> str:
+    return '"' + hashlib.sha256(corpo).hexdigest()[:32] + '"'
+
+
+def _etag_corresponde(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidatos = [valor.strip() for valor in if_none_match.split(",")]
+    return "*" in candidatos or any(valor.removeprefix("W/") == etag for valor in candidatos)
+
+
+def _chave_requisicao(request: Request) -> str:
+    consulta = urlencode(sorted(request.query_params.multi_items()))
+    return f"{request.url.path}?{consulta}"
+
+
+def _resposta(resposta: RespostaEmCache, max_age: int, request: Request, situacao: str) -> Response:
+    cabecalhos = {
+        "ETag": resposta.etag,
+        "Cache-Control": f"public, max-age={max_age}, must-revalidate",
+        "X-Cache": situacao,
+    }
+    if _etag_corresponde(request.headers.get("if-none-match"), resposta.etag):
+        return Response(status_code=304, headers=cabecalhos)
+    return Response(content=resposta.corpo, media_type=resposta.tipo, headers=cabecalhos)
+
+
+class RotaComCache(APIRoute):
+    """
+    Rota que serve do cache os endpoints marcados com `cache_resposta`. Só respostas 200 são
+    guardadas; falhas do backend fazem a requisição seguir direto para o endpoint.
+
+    A geração das tags é lida antes de executar o endpoint: se uma escrita invalidar alguma
+    delas enquanto o endpoint roda, a resposta (possivelmente calculada com dados antigos)
+    é devolvida ao cliente, mas não é guardada.
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        config: Optional[ConfigCache] = getattr(self.endpoint, "config_cache", None)
+        if config is None:
+            return handler
+
+        async def handler_com_cache(request: Request) -> Response:
+            if request.method != "GET":
+                return await handler(request)
+
+            chave = _chave_requisicao(request)
+            tags = [tag.format(**request.path_params) for tag in config.tags]
+            try:
+                em_cache = await cache.obter(chave)
+                geracoes = None if em_cache is not None else await cache.geracoes(tags)
+            except Exception as erro:
+                logger.error("Falha ao ler o cache (%s): %s", chave, erro)
+                return await handler(request)
+            if em_cache is not None:
+                return _resposta(em_cache, config.max_age, request, "HIT")
+
+            resposta = await handler(request)
+            if resposta.status_code != 200 or not hasattr(resposta, "body"):
+                return resposta
+
+            nova = RespostaEmCache(bytes(resposta.body), resposta.media_type or "application/json", _etag(resposta.body))
+            try:
+                if not await cache.guardar(chave, nova, tags, config.ttl, geracoes):
+                    logger.info("Resposta de %s não guardada: tags invalidadas durante a execução.", chave)
+            except Exception as erro:
+                logger.error("Falha ao gravar no cache (%s): %s", chave, erro)
+            return _resposta(nova, config.max_age, request, "MISS")
+
+        return handler_com_cache
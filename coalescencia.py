@@ -0,0 +1,112 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+# Por quanto tempo (s) o resultado de uma leitura coalescida continua valendo para novas
+# chamadas com a mesma chave. 0 (padrão): só chamadas simultâneas são agrupadas. As escritas
+# descartam o resultado só neste processo: nos demais workers ele vale até o fim do TTL.
+COALESCENCIA_TTL = float(os.getenv("COALESCENCIA_TTL", "0"))
+
+LIDER = "leader"
+COMPARTILHADA = "shared"
+MICRO_TTL = "ttl_hit"
+
+# Resultados recentes guardados por grupo antes de descartar os vencidos.
+_MAX_RECENTES = 1024
+
+# nome -> grupo, para as métricas
+grupos: Dict[str, "GrupoCoalescencia"] = {}
+
+
+class GrupoCoalescencia:
+    """
+    Agrupa leituras simultâneas com a mesma chave (single-flight): a primeira chamada executa
+    a função e as que chegam enquanto ela está em andamento aguardam o mesmo resultado (ou a
+    mesma exceção). A execução roda em uma task própria, de modo que o cancelamento de um
+    cliente não interrompe a leitura dos demais. Com `ttl` > 0 o resultado ainda é reaproveitado
+    por `ttl` segundos depois de concluído.
+
+    O resultado é o mesmo objeto para todas as chamadas e não deve ser alterado por elas.
+    """
+
+    def __init__(self, nome: str, ttl: float = COALESCENCIA_TTL):
+        self.nome = nome
+        self.ttl = ttl
+        self._em_andamento: Dict[Hashable, asyncio.Task] = {}
+        self._recentes: Dict[Hashable, Tuple[float, Any]] = {}
+        self.chamadas = {LIDER: 0, COMPARTILHADA: 0, MICRO_TTL: 0}
+        grupos[nome] = self
+
+    async def executar(self, chave: Hashable, funcao: Callable[[], Awaitable[Any]]) -> Any:
+        if self.ttl > 0:
+            recente = self._recentes.get(chave)
+            if recente is not None:
+                if time.monotonic() < recente[0]:
+                    self.chamadas[MICRO_TTL] += 1
+                    return recente[1]
+                del self._recentes[chave]
+
+        tarefa = self._em_andamento.get(chave)
+        if tarefa is None:
+            self.chamadas[LIDER] += 1
+            tarefa = self._em_andamento[chave] = asyncio.ensure_future(funcao())
+            tarefa.add_done_callback(lambda concluida: self._concluir(chave, concluida))
+        else:
+            self.chamadas[COMPARTILHADA] += 1
+        return await asyncio.shield(tarefa)
+
+    def descartar(self, *chaves: Hashable) -> None:
+        """
+        Esquece o resultado recente e a leitura em andamento das chaves: a próxima chamada vai
+        ao banco. As escritas chamam antes de invalidar o cache HTTP, para que a resposta
+        guardada depois da invalidação não venha de uma leitura anterior à escrita.
+        """
+        for chave in chaves:
+            self._recentes.pop(chave, None)
+            self._em_andamento.pop(chave, None)
+
+    def _concluir(self, chave: Hashable, tarefa: asyncio.Task) -> None:
+        # Leituras descartadas durante a execução ainda entregam o resultado a quem aguardava,
+        # mas não ficam guardadas
+        vigente = self._em_andamento.get(chave) is tarefa
+        if vigente:
+            del self._em_andamento[chave]
+        # exception() também marca a falha como tratada se nenhuma chamada restou aguardando
+        if tarefa.cancelled() or tarefa.exception() is not None:
+            return
+        if self.ttl > 0 and vigente:
+            self._recentes[chave] = (time.monotonic() + self.ttl, tarefa.result())
+            if len(self._recentes) > _MAX_RECENTES:
+                agora = time.monotonic()
+                for antiga in [antiga for antiga, (expira_em, _) in self._recentes.items() if expira_em <= agora]:
+                    del self._recentes[antiga]
+
+    def em_andamento(self) -> int:
+        return len(self._em_andamento)
+
+    def razao_coalescencia(self) -> float:
+        """Fração das chamadas atendidas sem ir ao banco."""
+        total = sum(self.chamadas.values())
+        return 1 - self.chamadas[LIDER] / total if total else 0.0
+
+
+def metricas_prometheus() -> List[str]:
+    linhas = [
+        "# HELP singleflight_calls_total Leituras coalescidas por grupo e resultado (leader: foi ao banco).",
+        "# TYPE singleflight_calls_total counter",
+    ]
+    for nome, grupo in sorted(grupos.items()):
+        linhas += [
+            f'singleflight_calls_total{{group="{nome}",result="{resultado}"}} {total}'
+            for resultado, total in grupo.chamadas.items()
+        ]
+    linhas += [
+        "# HELP singleflight_coalescing_ratio Fração das leituras atendidas sem ir ao banco.",
+        "# TYPE singleflight_coalescing_ratio gauge",
+        *[f'singleflight_coalescing_ratio{{group="{nome}"}} {grupo.razao_coalescencia():.6f}' for nome, grupo in sorted(grupos.items())],
+        "# HELP singleflight_inflight Leituras em andamento por grupo.",
+        "# TYPE singleflight_inflight gauge",
+        *[f'singleflight_inflight{{group="{nome}"}} {grupo.em_andamento()}' for nome, grupo in sorted(grupos.items())],
+    ]
+    return linhas
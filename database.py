@@ -1,15 +1,46 @@
-from databases import Database
-import motor.motor_asyncio
+import asyncio
 import os
 from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo.errors import PyMongoError
+from instrumentacao import monitor_comandos, monitor_pool
+from logger import get_logger
 
 load_dotenv()
 
+logger = get_logger("database_logger", "log/database.log")
+
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
 DB_NAME = "ecommerce"
 
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
-db = client[DB_NAME]  
+# Configuração do pool de conexões. Parâmetros repetidos na MONGO_URL têm precedência.
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0")) or None
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "0")) or None
+# Lista separada por vírgula, em ordem de preferência (ex.: "zstd,snappy,zlib"). Compressores
+# cujo pacote não está instalado (zstd, python-snappy) são descartados pelo driver com um aviso.
+MONGO_COMPRESSORES = os.getenv("MONGO_COMPRESSORES", "")
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+
+
+def criar_cliente(url: str = MONGO_URL) -> AsyncIOMotorClient:
+    """Cliente do Mongo com o pool configurado pelas variáveis de ambiente e a instrumentação registrada."""
+    opcoes = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "readPreference": MONGO_READ_PREFERENCE,
+        "event_listeners": [monitor_comandos, monitor_pool],
+    }
+    if MONGO_COMPRESSORES:
+        opcoes["compressors"] = MONGO_COMPRESSORES
+    return AsyncIOMotorClient(url, **opcoes)
+
+
+client = criar_cliente()
+db = client[DB_NAME]
 
 users_collection = db["usuarios"]
 produtos_collection = db["produtos"]
@@ -17,6 +48,29 @@ pedidos_collection = db["pedidos"]
 promocoes_collection = db["promocoes"]
 produto_promocao_collection = db["produto_promocao"]
 variacao_collection = db["variacoes_produto"]
+vendas_diarias_collection = db["vendas_diarias"]
+
+def get_db() -> AsyncIOMotorDatabase:
+    return db
+
+
+async def aquecer_pool() -> bool:
+    """
+    Verifica a conexão com um ping e abre MONGO_MIN_POOL_SIZE conexões antes da primeira
+    requisição, para que ela não pague o custo de handshake. Retorna False se o banco não responder.
+    """
+    try:
+        await client.admin.command("ping")
+        if MONGO_MIN_POOL_SIZE > 1:
+            await asyncio.gather(*(client.admin.command("ping") for _ in range(MONGO_MIN_POOL_SIZE)))
+    except PyMongoError as erro:
+        logger.error("Banco indisponível na inicialização: %s", erro)
+        return False
+    logger.info("Conexão com o banco verificada (pool mínimo: %s, máximo: %s).", MONGO_MIN_POOL_SIZE, MONGO_MAX_POOL_SIZE)
+    return True
+
 
-def get_db() -> Database:
-    return db
\ No newline at end of file
+def fechar_cliente() -> None:
+    """Fecha as conexões do pool no desligamento da aplicação."""
+    client.close()
+    logger.info("Conexões com o banco encerradas.")
@@ -0,0 +1,203 @@
+import asyncio
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+from bson.regex import Regex
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import ConnectionFailure, OperationFailure, PyMongoError
+from logger import get_logger
+
+logger = get_logger("indexes_logger", "log/indexes.log")
+
+# Índices declarados por coleção. Alterar a especificação de um índice existente exige
+# removê-lo antes, já que o Mongo não recria um índice com o mesmo nome e opções diferentes.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "variacoes_produto": [
+        IndexModel([("sku", ASCENDING)], name="sku_unico", unique=True),
+        IndexModel([("produto_id", ASCENDING)], name="produto_id"),
+    ],
+    "pedidos": [
+        IndexModel([("data_pedido", DESCENDING), ("_id", DESCENDING)], name="data_pedido"),
+        IndexModel([("status", ASCENDING), ("data_pedido", DESCENDING)], name="status_data_pedido"),
+        IndexModel([("id_usuario", ASCENDING), ("data_pedido", DESCENDING)], name="id_usuario_data_pedido"),
+        IndexModel([("itens.id_produto", ASCENDING), ("data_pedido", DESCENDING)], name="itens_id_produto_data_pedido"),
+        IndexModel([("itens.id_promocao", ASCENDING), ("data_pedido", DESCENDING)], name="itens_id_promocao_data_pedido"),
+        IndexModel([("itens.termos_nome", ASCENDING), ("data_pedido", DESCENDING)], name="itens_termos_nome_data_pedido"),
+        IndexModel(
+            [("regiao_entrega.estado", ASCENDING), ("regiao_entrega.cidade", ASCENDING), ("data_pedido", DESCENDING)],
+            name="regiao_entrega_estado_cidade_data_pedido"
+        ),
+        IndexModel(
+            [("regiao_entrega.cidade", ASCENDING), ("data_pedido", DESCENDING)],
+            name="regiao_entrega_cidade_data_pedido"
+        ),
+    ],
+    "promocoes": [
+        IndexModel(
+            [("produtos_aplicaveis", ASCENDING), ("data_inicio", ASCENDING), ("data_fim", ASCENDING)],
+            name="produtos_aplicaveis_vigencia"
+        ),
+        IndexModel([("data_fim", DESCENDING), ("_id", DESCENDING)], name="data_fim"),
+    ],
+    "produtos": [
+        IndexModel([("data_de_cadastro", DESCENDING), ("_id", DESCENDING)], name="data_de_cadastro"),
+        IndexModel([("categoria", ASCENDING), ("preco_base", ASCENDING)], name="categoria_preco_base"),
+        IndexModel([("termos_busca", ASCENDING)], name="termos_busca"),
+        IndexModel([("termos_nome", ASCENDING)], name="termos_nome"),
+        IndexModel(
+            [("nome", TEXT), ("descricao", TEXT), ("marca", TEXT)],
+            name="busca_texto",
+            weights={"nome": 10, "marca": 5, "descricao": 1},
+            default_language="portuguese"
+        ),
+    ],
+    "precos_efetivos": [
+        IndexModel([("sku", ASCENDING)], name="sku_unico", unique=True),
+        IndexModel([("produto_id", ASCENDING)], name="produto_id"),
+        IndexModel([("em_promocao", ASCENDING), ("valido_ate", ASCENDING)], name="em_promocao_valido_ate"),
+        IndexModel([("valido_ate", ASCENDING)], name="valido_ate"),
+    ],
+    "usuarios": [
+        IndexModel([("nome", ASCENDING), ("_id", ASCENDING)], name="nome"),
+    ],
+    "vendas_diarias": [
+        IndexModel(
+            [
+                ("dia", ASCENDING),
+                ("id_produto", ASCENDING),
+                ("categoria", ASCENDING),
+                ("estado", ASCENDING),
+                ("status", ASCENDING),
+            ],
+            name="chave_rollup",
+            unique=True
+        ),
+        IndexModel([("status", ASCENDING), ("dia", ASCENDING), ("categoria", ASCENDING)], name="status_dia_categoria"),
+    ],
+}
+
+_DATA = datetime(2000, 1, 1)
+
+# Consultas representativas de cada rota, verificadas com explain: (rota, coleção, filtro, ordenação)
+CONSULTAS_ROTAS: List[Tuple[str, str, Dict[str, Any], Optional[Dict[str, int]]]] = [
+    ("POST /pedidos/create/", "variacoes_produto", {"sku": {"$in": ["SKU"]}}, None),
+    ("POST /pedidos/create/", "precos_efetivos", {"sku": {"$in": ["SKU"]}}, None),
+    ("GET /relatorios/produtos-em-promocao", "precos_efetivos", {"em_promocao": True, "valido_ate": {"$gt": _DATA}}, None),
+    ("POST /variacoes/create", "variacoes_produto", {"sku": "SKU"}, None),
+    ("GET /variacoes/get_by_produto/{produto_id}", "variacoes_produto", {"produto_id": ObjectId()}, None),
+    ("GET /pedidos/get_all", "pedidos", {}, {"data_pedido": -1}),
+    ("GET /pedidos/filtro/", "pedidos", {"status": "Entregue"}, {"data_pedido": -1}),
+    ("GET /pedidos/filtro/?nome_produto", "pedidos", {"itens": {"$elemMatch": {"termos_nome": Regex("^vaso")}}}, {"data_pedido": -1}),
+    ("GET /pedidos/filtro/?id_usuario", "pedidos", {"id_usuario": ObjectId()}, {"data_pedido": -1}),
+    ("GET /relatorios/historico-usuario/{id_usuario}", "pedidos", {"id_usuario": ObjectId()}, {"data_pedido": -1}),
+    ("GET /relatorios/vendas-por-categoria", "pedidos", {"status": "Entregue", "data_pedido": {"$gte": _DATA}}, None),
+    ("GET /relatorios/gastos-usuarios-por-regiao?cidade&estado", "pedidos", {"regiao_entrega.cidade": "cidade", "regiao_entrega.estado": "uf", "data_pedido": {"$gte": _DATA}}, None),
+    ("GET /relatorios/gastos-usuarios-por-regiao?cidade", "pedidos", {"regiao_entrega.cidade": "cidade", "data_pedido": {"$gte": _DATA}}, None),
+    ("GET /relatorios/gastos-usuarios-por-regiao?estado", "pedidos", {"regiao_entrega.estado": "uf", "data_pedido": {"$gte": _DATA}}, None),
+    ("GET /relatorios/promocoes-vendas-por-categoria-detalhado", "pedidos", {"itens.id_promocao": {"$in": [ObjectId()]}, "data_pedido": {"$gte": _DATA}}, None),
+    ("GET /promocoes/filtro/?produto_id&status=ativas", "promocoes", {"produtos_aplicaveis": ObjectId(), "data_inicio": {"$lte": _DATA}, "data_fim": {"$gte": _DATA}}, None),
+    ("GET /promocoes/get_all", "promocoes", {}, {"data_fim": -1}),
+    ("GET /produtos/filtros/", "produtos", {}, {"data_de_cadastro": -1}),
+    ("GET /produtos/filtros/?nome", "produtos", {"termos_nome": Regex("^decor")}, None),
+    ("GET /produtos/autocomplete", "produtos", {"termos_busca": Regex("^decor")}, None),
+    ("GET /relatorios/ranking-produtos/best-sellers", "vendas_diarias", {"status": "Entregue"}, None),
+]
+
+
+async def aplicar_indexes(db: AsyncIOMotorDatabase) -> None:
+    """
+    Cria os índices declarados em INDEXES. A operação é idempotente: índices já existentes
+    com a mesma especificação são ignorados pelo servidor. Falhas em uma coleção (ex.: SKUs
+    duplicados impedindo o índice único) são registradas sem interromper as demais.
+    """
+    for colecao, modelos in INDEXES.items():
+        try:
+            nomes = await db[colecao].create_indexes(modelos)
+            logger.info("Índices garantidos em '%s': %s", colecao, ', '.join(nomes))
+        except ConnectionFailure as erro:
+            logger.error("Banco indisponível, índices não aplicados: %s", erro)
+            return
+        except PyMongoError as erro:
+            logger.error("Falha ao criar índices em '%s': %s", colecao, erro)
+
+
+def _estagios(plano: Dict[str, Any]) -> List[str]:
+    estagios = [plano.get("stage", "")]
+    for chave in ("inputStage", "queryPlan"):
+        if isinstance(plano.get(chave), dict):
+            estagios += _estagios(plano[chave])
+    for subplano in plano.get("inputStages", []):
+        estagios += _estagios(subplano)
+    return estagios
+
+
+async def estagios_consulta(
+    db: AsyncIOMotorDatabase,
+    colecao: str,
+    filtro: Dict[str, Any],
+    ordenacao: Optional[Dict[str, int]] = None
+) -> List[str]:
+    """Retorna os estágios do plano vencedor de uma consulta (ex.: ['FETCH', 'IXSCAN'])."""
+    comando: Dict[str, Any] = {"find": colecao, "filter": filtro}
+    if ordenacao:
+        comando["sort"] = ordenacao
+    explicacao = await db.command("explain", comando, verbosity="queryPlanner")
+    return _estagios(explicacao["queryPlanner"]["winningPlan"])
+
+
+async def relatorio_indexes(db: AsyncIOMotorDatabase) -> Dict[str, Any]:
+    """
+    Compara os índices do banco com o registro e verifica o plano de cada consulta de rota.
+
+    - faltando: índices declarados que não existem no banco;
+    - sem_uso: índices existentes sem nenhum acesso desde o último restart ($indexStats);
+    - consultas: rotas cujo plano vencedor não usa IXSCAN.
+    """
+    faltando: List[str] = []
+    sem_uso: List[str] = []
+    for colecao, modelos in INDEXES.items():
+        existentes = {indice["name"] async for indice in db[colecao].list_indexes()}
+        faltando += [f"{colecao}.{modelo.document['name']}" for modelo in modelos if modelo.document["name"] not in existentes]
+        try:
+            async for estatistica in db[colecao].aggregate([{"$indexStats": {}}]):
+                if estatistica["name"] != "_id_" and estatistica["accesses"]["ops"] == 0:
+                    sem_uso.append(f"{colecao}.{estatistica['name']}")
+        except OperationFailure as erro:
+            logger.warning("Não foi possível ler $indexStats de '%s': %s", colecao, erro)
+
+    consultas = []
+    for rota, colecao, filtro, ordenacao in CONSULTAS_ROTAS:
+        estagios = await estagios_consulta(db, colecao, filtro, ordenacao)
+        consultas.append({
+            "rota": rota,
+            "colecao": colecao,
+            "estagios": estagios,
+            "usa_indice": "IXSCAN" in estagios and "COLLSCAN" not in estagios
+        })
+
+    return {"faltando": faltando, "sem_uso": sem_uso, "consultas": consultas}
+
+
+async def _main(argumentos: List[str]) -> int:
+    from database import get_db
+
+    db = get_db()
+    if argumentos and argumentos[0] == "aplicar":
+        await aplicar_indexes(db)
+        return 0
+
+    relatorio = await relatorio_indexes(db)
+    print("Índices faltando:", ", ".join(relatorio["faltando"]) or "nenhum")
+    print("Índices sem uso:", ", ".join(relatorio["sem_uso"]) or "nenhum")
+    for consulta in relatorio["consultas"]:
+        situacao = "OK  " if consulta["usa_indice"] else "SCAN"
+        print(f"[{situacao}] {consulta['rota']} ({consulta['colecao']}): {' -> '.join(consulta['estagios'])}")
+    return 0 if not relatorio["faltando"] and all(c["usa_indice"] for c in relatorio["consultas"]) else 1
+
+
+if __name__ == "__main__":
+    # python -m indexes            -> relatório de índices faltando, sem uso e planos das rotas
+    # python -m indexes aplicar    -> cria os índices declarados
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
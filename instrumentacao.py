@@ -0,0 +1,268 @@
+import bisect
+import json
+import os
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from pymongo import monitoring
+
+# Quantas vezes a mesma forma de consulta pode se repetir numa requisição antes de ser
+# tratada como suspeita de N+1 (uma consulta por item de uma lista).
+LIMITE_REPETICOES = int(os.getenv("MONGO_LIMITE_REPETICOES", "10"))
+
+# Comandos de controle do driver, que não representam consultas da aplicação.
+_COMANDOS_IGNORADOS = {"hello", "ismaster", "isMaster", "ping", "endSessions", "buildInfo"}
+
+# Continuações de cursor: contam como ida ao banco, mas não como uma nova consulta.
+_COMANDOS_CURSOR = {"getMore", "killCursors"}
+
+# Campo do comando que contém o filtro, por nome de comando.
+_CAMPOS_FILTRO = {"find": "filter", "count": "query", "distinct": "query", "findAndModify": "query"}
+
+
+def limites_logaritmicos(inicio: float, quantidade: int) -> List[float]:
+    """
+    Limites de buckets em escala logarítmica (2 buckets por potência de 2), no estilo HDR:
+    a precisão relativa é a mesma em qualquer faixa de valores.
+    """
+    return [inicio * 2 ** (i / 2) for i in range(quantidade)]
+
+
+class HistogramaLatencia:
+    """Contagem de durações (em segundos) por bucket, com soma e total para o Prometheus."""
+
+    def __init__(self, limites: List[float]):
+        self.limites = limites
+        self.buckets = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def registrar(self, duracao: float) -> None:
+        self.buckets[bisect.bisect_left(self.limites, duracao)] += 1
+        self.soma += duracao
+        self.total += 1
+
+    def linhas_prometheus(self, metrica: str, rotulos: str) -> List[str]:
+        separador = "," if rotulos else ""
+        linhas = []
+        acumulado = 0
+        for limite, contagem in zip(self.limites, self.buckets):
+            acumulado += contagem
+            linhas.append(f'{metrica}_bucket{{{rotulos}{separador}le="{limite:.6g}"}} {acumulado}')
+        linhas.append(f'{metrica}_bucket{{{rotulos}{separador}le="+Inf"}} {self.total}')
+        linhas.append(f"{metrica}_sum{{{rotulos}}} {self.soma:.6f}")
+        linhas.append(f"{metrica}_count{{{rotulos}}} {self.total}")
+        return linhas
+
+
+def _forma(valor: Any) -> Any:
+    """Estrutura do valor sem os dados: {"_id": ObjectId(...)} -> {"_id": "?"}."""
+    if isinstance(valor, dict):
+        return {chave: _forma(item) for chave, item in sorted(valor.items())}
+    if isinstance(valor, list):
+        return [_forma(valor[0])] if valor else []
+    return "?"
+
+
+def forma_consulta(nome: str, comando: Dict[str, Any]) -> str:
+    """Identifica a consulta pela coleção, comando e formato do filtro, ignorando os valores."""
+    colecao = comando.get(nome)
+    if nome in _CAMPOS_FILTRO:
+        filtro = _forma(comando.get(_CAMPOS_FILTRO[nome]) or {})
+    elif nome == "aggregate":
+        filtro = [next(iter(estagio), "?") for estagio in comando.get("pipeline", [])]
+        if comando.get("pipeline") and "$match" in comando["pipeline"][0]:
+            filtro[0] = {"$match": _forma(comando["pipeline"][0]["$match"])}
+    elif nome in ("update", "delete"):
+        operacoes = comando.get("updates") or comando.get("deletes") or [{}]
+        filtro = _forma(operacoes[0].get("q", {}))
+    else:
+        filtro = None
+    return f"{colecao}.{nome} {json.dumps(filtro, sort_keys=True)}" if filtro is not None else f"{colecao}.{nome}"
+
+
+class FormaConsulta:
+    """Execuções e tempo acumulado de uma forma de consulta."""
+
+    def __init__(self):
+        self.execucoes = 0
+        self.duracao_ms = 0.0
+
+
+class EstatisticasRequisicao:
+    """Comandos enviados ao Mongo durante uma requisição, agrupados por forma de consulta."""
+
+    def __init__(self):
+        self.comandos = 0
+        self.duracao_ms = 0.0
+        self.falhas = 0
+        self.formas: Dict[str, FormaConsulta] = {}
+        self._pendentes: Dict[int, Optional[FormaConsulta]] = {}
+
+    def suspeitas_n_mais_um(self, limite: int = LIMITE_REPETICOES) -> Dict[str, int]:
+        """Formas de consulta executadas mais de `limite` vezes, com o número de execuções."""
+        return {forma: dados.execucoes for forma, dados in self.formas.items() if dados.execucoes > limite}
+
+    def mais_repetidas(self, quantidade: int = 5) -> List[Dict[str, Any]]:
+        """As formas de consulta com mais execuções, para o log da requisição."""
+        ordenadas = sorted(self.formas.items(), key=lambda item: item[1].execucoes, reverse=True)
+        return [
+            {"forma": forma, "execucoes": dados.execucoes, "duracao_ms": round(dados.duracao_ms, 3)}
+            for forma, dados in ordenadas[:quantidade]
+        ]
+
+    def resumo(self, limite: int = LIMITE_REPETICOES) -> Dict[str, Any]:
+        return {
+            "comandos": self.comandos,
+            "duracao_ms": round(self.duracao_ms, 3),
+            "falhas": self.falhas,
+            "n_mais_um": self.suspeitas_n_mais_um(limite),
+        }
+
+
+_estatisticas: ContextVar[Optional[EstatisticasRequisicao]] = ContextVar("estatisticas_requisicao", default=None)
+
+
+def iniciar_requisicao() -> EstatisticasRequisicao:
+    """
+    Associa um novo contador ao contexto atual. O Motor executa as operações em threads
+    que herdam uma cópia do contexto, então os comandos continuam atribuídos à requisição.
+    Também serve para verificar um trecho de código isolado:
+
+        estatisticas = iniciar_requisicao()
+        await historico_pedidos_usuario(...)
+        assert not estatisticas.suspeitas_n_mais_um()
+    """
+    estatisticas = EstatisticasRequisicao()
+    _estatisticas.set(estatisticas)
+    return estatisticas
+
+
+def estatisticas_atuais() -> Optional[EstatisticasRequisicao]:
+    return _estatisticas.get()
+
+
+class MonitorComandos(monitoring.CommandListener):
+    """
+    Listener registrado no cliente do Mongo (database.py). Atribui cada comando e sua
+    duração à requisição corrente; comandos fora de uma requisição são ignorados.
+    """
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        estatisticas = _estatisticas.get()
+        if estatisticas is None or event.command_name in _COMANDOS_IGNORADOS:
+            return
+        estatisticas.comandos += 1
+        if event.command_name in _COMANDOS_CURSOR:
+            estatisticas._pendentes[event.request_id] = None
+            return
+        forma = forma_consulta(event.command_name, event.command)
+        dados = estatisticas.formas.get(forma)
+        if dados is None:
+            dados = estatisticas.formas[forma] = FormaConsulta()
+        dados.execucoes += 1
+        estatisticas._pendentes[event.request_id] = dados
+
+    def _finalizar(self, event, falhou: bool) -> None:
+        estatisticas = _estatisticas.get()
+        if estatisticas is None:
+            return
+        if event.request_id not in estatisticas._pendentes:
+            return
+        dados = estatisticas._pendentes.pop(event.request_id)
+        duracao_ms = event.duration_micros / 1000
+        if dados is not None:
+            dados.duracao_ms += duracao_ms
+        estatisticas.duracao_ms += duracao_ms
+        if falhou:
+            estatisticas.falhas += 1
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finalizar(event, falhou=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finalizar(event, falhou=True)
+
+
+monitor_comandos = MonitorComandos()
+
+
+# Limites dos buckets de espera por uma conexão do pool, de 0,1 ms a ~6,5 s.
+LIMITES_ESPERA_POOL = limites_logaritmicos(0.0001, 33)
+
+
+class MonitorPool(monitoring.ConnectionPoolListener):
+    """
+    Listener do pool de conexões (database.py). Mede quanto tempo cada operação espera
+    para obter uma conexão: esperas altas indicam que maxPoolSize está pequeno para a carga.
+    Os eventos chegam das threads do driver, por isso o acesso aos contadores usa lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.espera = HistogramaLatencia(LIMITES_ESPERA_POOL)
+        self.falhas: Dict[str, int] = {}
+        self.em_uso = 0
+        self.abertas = 0
+
+    def connection_checked_out(self, event: monitoring.ConnectionCheckedOutEvent) -> None:
+        with self._lock:
+            self.espera.registrar(event.duration)
+            self.em_uso += 1
+
+    def connection_check_out_failed(self, event: monitoring.ConnectionCheckOutFailedEvent) -> None:
+        with self._lock:
+            self.espera.registrar(event.duration)
+            self.falhas[event.reason] = self.falhas.get(event.reason, 0) + 1
+
+    def connection_checked_in(self, event: monitoring.ConnectionCheckedInEvent) -> None:
+        with self._lock:
+            self.em_uso -= 1
+
+    def connection_created(self, event: monitoring.ConnectionCreatedEvent) -> None:
+        with self._lock:
+            self.abertas += 1
+
+    def connection_closed(self, event: monitoring.ConnectionClosedEvent) -> None:
+        with self._lock:
+            self.abertas -= 1
+
+    def connection_check_out_started(self, event) -> None:
+        pass
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def metricas_prometheus(self) -> List[str]:
+        with self._lock:
+            linhas = [
+                "# HELP mongo_pool_checkout_wait_seconds Espera por uma conexão do pool do Mongo.",
+                "# TYPE mongo_pool_checkout_wait_seconds histogram",
+                *self.espera.linhas_prometheus("mongo_pool_checkout_wait_seconds", ""),
+                "# HELP mongo_pool_checkout_failures_total Falhas ao obter conexão do pool, por motivo.",
+                "# TYPE mongo_pool_checkout_failures_total counter",
+                *[f'mongo_pool_checkout_failures_total{{reason="{motivo}"}} {total}' for motivo, total in sorted(self.falhas.items())],
+                "# HELP mongo_pool_connections_in_use Conexões do pool em uso.",
+                "# TYPE mongo_pool_connections_in_use gauge",
+                f"mongo_pool_connections_in_use {self.em_uso}",
+                "# HELP mongo_pool_connections_open Conexões abertas pelo pool.",
+                "# TYPE mongo_pool_connections_open gauge",
+                f"mongo_pool_connections_open {self.abertas}",
+            ]
+        return linhas
+
+
+monitor_pool = MonitorPool()
+
@@ -1,7 +1,138 @@
 import os
+import time
+import queue
+import atexit
 import logging
+import threading
+import logging.handlers
+from typing import Dict, Optional
 
-def get_logger(name: str, file_path: str) -> logging.Logger:
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ROTACAO_SEGUNDOS = float(os.getenv("LOG_ROTACAO_SEGUNDOS", "86400"))
+LOG_TAMANHO_LOTE = int(os.getenv("LOG_TAMANHO_LOTE", "256"))
+LOG_INTERVALO_FLUSH = float(os.getenv("LOG_INTERVALO_FLUSH", "1.0"))
+
+_PARAR = object()
+
+
+class _ArquivoRotativo(logging.handlers.RotatingFileHandler):
+    """
+    Arquivo de log com rotação por tamanho (LOG_MAX_BYTES) ou por idade (LOG_ROTACAO_SEGUNDOS).
+    Não faz flush a cada registro: quem decide o momento do flush é o escritor em segundo plano.
+    """
+
+    def __init__(self, file_path: str):
+        super().__init__(
+            file_path,
+            mode="a",
+            maxBytes=LOG_MAX_BYTES,
+            backupCount=LOG_BACKUP_COUNT,
+            encoding="utf-8",
+            delay=True
+        )
+        self._aberto_em = time.time()
+
+    def _deve_rotacionar(self, mensagem: str) -> bool:
+        # Recebe a mensagem já formatada: o shouldRollover da base formataria o registro de novo
+        if LOG_ROTACAO_SEGUNDOS and time.time() - self._aberto_em >= LOG_ROTACAO_SEGUNDOS:
+            return os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0
+        if self.maxBytes <= 0:
+            return False
+        if self.stream is None:
+            self.stream = self._open()
+        return self.stream.tell() + len(mensagem) >= self.maxBytes
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self._aberto_em = time.time()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            mensagem = self.format(record) + self.terminator
+            if self._deve_rotacionar(mensagem):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(mensagem)
+        except Exception:
+            self.handleError(record)
+
+
+class _HandlerFila(logging.handlers.QueueHandler):
+    """Enfileira o registro sem formatá-lo; a formatação acontece na thread do escritor."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _EscritorLogs(threading.Thread):
+    """
+    Thread única que consome a fila de logs e grava cada registro no arquivo do seu logger.
+    O flush é feito em lote: a cada LOG_TAMANHO_LOTE registros ou LOG_INTERVALO_FLUSH segundos.
+    """
+
+    def __init__(self):
+        super().__init__(name="escritor-logs", daemon=True)
+        self.fila: "queue.SimpleQueue" = queue.SimpleQueue()
+        self.arquivos: Dict[str, _ArquivoRotativo] = {}
+
+    def run(self) -> None:
+        pendentes = 0
+        ultimo_flush = time.monotonic()
+        while True:
+            try:
+                registro = self.fila.get(timeout=LOG_INTERVALO_FLUSH)
+            except queue.Empty:
+                registro = None
+
+            if registro is _PARAR:
+                break
+            if registro is not None:
+                arquivo = self.arquivos.get(registro.name)
+                if arquivo:
+                    arquivo.handle(registro)
+                    pendentes += 1
+
+            agora = time.monotonic()
+            if pendentes and (pendentes >= LOG_TAMANHO_LOTE or agora - ultimo_flush >= LOG_INTERVALO_FLUSH):
+                self._flush()
+                pendentes = 0
+                ultimo_flush = agora
+        self._flush()
+
+    def _flush(self) -> None:
+        for arquivo in list(self.arquivos.values()):
+            arquivo.flush()
+
+    def parar(self) -> None:
+        self.fila.put(_PARAR)
+        self.join(timeout=5)
+
+
+_escritor: Optional[_EscritorLogs] = None
+_escritor_lock = threading.Lock()
+
+
+def _obter_escritor() -> _EscritorLogs:
+    global _escritor
+    with _escritor_lock:
+        if _escritor is None:
+            _escritor = _EscritorLogs()
+            _escritor.start()
+            atexit.register(_escritor.parar)
+        return _escritor
+
+
+FORMATO_PADRAO = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+def get_logger(name: str, file_path: str, formato: str = FORMATO_PADRAO) -> logging.Logger:
+    """
+    Logger que grava em `file_path` sem bloquear o event loop: as chamadas apenas enfileiram
+    o registro, e uma thread em segundo plano formata, grava e rotaciona os arquivos.
+    Use formatação preguiçosa (`logger.info("Pedido %s criado", pedido_id)`).
+    """
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
     logger = logging.getLogger(name)
@@ -10,12 +141,15 @@ def get_logger(name: str, file_path: str) -> logging.Logger:
     if logger.hasHandlers():
         logger.handlers.clear()
 
-    file_handler = logging.FileHandler(file_path, mode="a", encoding="utf-8")
+    file_handler = _ArquivoRotativo(file_path)
     formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s',
+        formato,
         datefmt='%Y/%m/%d %H:%M:%S'
     )
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+
+    escritor = _obter_escritor()
+    escritor.arquivos[name] = file_handler
+    logger.addHandler(_HandlerFila(escritor.fila))
 
     return logger
@@ -0,0 +1,135 @@
+import json
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import coalescencia
+from instrumentacao import (
+    LIMITE_REPETICOES,
+    EstatisticasRequisicao,
+    HistogramaLatencia,
+    iniciar_requisicao,
+    limites_logaritmicos,
+    monitor_pool,
+)
+from logger import get_logger
+
+logger = get_logger("requisicoes_logger", "log/requisicoes.log", formato="%(message)s")
+logger_n_mais_um = get_logger("n_mais_um_logger", "log/n_mais_um.log")
+
+# Buckets de latência das requisições, de 1 ms a ~65 s.
+LIMITES_LATENCIA = limites_logaritmicos(0.001, 33)
+
+SEM_ROTA = "<sem_rota>"
+
+
+# (método, rota, status) -> histograma. Só é alterado pelo event loop, dispensando lock.
+histogramas: Dict[Tuple[str, str, int], HistogramaLatencia] = {}
+
+
+def _rota(scope: Scope) -> str:
+    # O roteador grava a rota encontrada no scope; usamos o template (ex.: /pedidos/{pedido_id})
+    # para não criar uma série por id.
+    rota = scope.get("route")
+    return getattr(rota, "path", None) or SEM_ROTA
+
+
+def _escapar(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def metricas_prometheus() -> str:
+    """
+    Histogramas de latência por rota, métricas do pool do Mongo e das leituras coalescidas no
+    formato texto do Prometheus.
+    """
+    linhas = [
+        "# HELP http_request_duration_seconds Duração das requisições HTTP por rota.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (metodo, rota, status), histograma in sorted(histogramas.items()):
+        rotulos = f'method="{metodo}",route="{_escapar(rota)}",status="{status}"'
+        linhas += histograma.linhas_prometheus("http_request_duration_seconds", rotulos)
+    linhas += monitor_pool.metricas_prometheus()
+    linhas += coalescencia.metricas_prometheus()
+    return "\n".join(linhas) + "\n"
+
+
+def _cabecalhos_mongo(estatisticas: EstatisticasRequisicao) -> List[Tuple[bytes, bytes]]:
+    # Respostas comuns já terminaram de consultar o banco quando os cabeçalhos saem; em
+    # respostas em streaming os valores refletem apenas o que foi feito até o início do envio.
+    cabecalhos = [
+        (b"x-mongo-comandos", str(estatisticas.comandos).encode()),
+        (b"server-timing", f"mongo;dur={estatisticas.duracao_ms:.3f}".encode()),
+    ]
+    suspeitas = estatisticas.suspeitas_n_mais_um()
+    if suspeitas:
+        cabecalhos.append((b"x-mongo-n-mais-um", str(max(suspeitas.values())).encode()))
+    return cabecalhos
+
+
+class LoggingMiddleware:
+    """
+    Middleware ASGI que grava uma linha JSON por requisição em log/requisicoes.log (rota,
+    status, duração, comandos enviados ao Mongo e bytes da resposta) e alimenta os
+    histogramas expostos em /metrics. A duração inclui o envio completo de respostas em
+    streaming.
+
+    Os comandos ao Mongo também vão nos cabeçalhos da resposta (X-Mongo-Comandos e
+    Server-Timing). Quando a mesma forma de consulta se repete mais de MONGO_LIMITE_REPETICOES
+    vezes, a resposta recebe X-Mongo-N-Mais-Um e as formas repetidas vão para log/n_mais_um.log.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        estatisticas = iniciar_requisicao()
+        inicio = time.perf_counter()
+        status = 500
+        bytes_enviados = 0
+
+        async def enviar(mensagem: Message) -> None:
+            nonlocal status, bytes_enviados
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+                mensagem["headers"] = list(mensagem.get("headers", [])) + _cabecalhos_mongo(estatisticas)
+            elif mensagem["type"] == "http.response.body":
+                bytes_enviados += len(mensagem.get("body", b""))
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracao = time.perf_counter() - inicio
+            metodo = scope["method"]
+            rota = _rota(scope)
+            histograma = histogramas.get((metodo, rota, status))
+            if histograma is None:
+                histograma = histogramas[(metodo, rota, status)] = HistogramaLatencia(LIMITES_LATENCIA)
+            histograma.registrar(duracao)
+
+            suspeitas = estatisticas.suspeitas_n_mais_um()
+            if suspeitas:
+                logger_n_mais_um.warning(
+                    "Possível N+1 em %s %s (limite %s): %s",
+                    metodo, rota, LIMITE_REPETICOES, json.dumps(estatisticas.mais_repetidas(), ensure_ascii=False)
+                )
+
+            logger.info("%s", json.dumps({
+                "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+                "metodo": metodo,
+                "rota": rota,
+                "caminho": scope["path"],
+                "status": status,
+                "duracao_ms": round(duracao * 1000, 3),
+                "comandos_mongo": estatisticas.comandos,
+                "duracao_mongo_ms": round(estatisticas.duracao_ms, 3),
+                "n_mais_um": suspeitas or None,
+                "bytes_enviados": bytes_enviados,
+                "cliente": scope["client"][0] if scope.get("client") else None,
+            }, ensure_ascii=False))
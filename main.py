@@ -1,11 +1,34 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from routes import consultasComplexas, usuarios, produtos, pedidos, promocoes, variacao_produto
+from database import aquecer_pool, fechar_cliente, get_db
+from indexes import aplicar_indexes
+from logging_middleware import LoggingMiddleware
+from services.precos_efetivos import manter_precos_atualizados
+from services.rollups import verificar_rollups
+from tarefas_relatorios import gerenciador_tarefas
+from routes import consultasComplexas, metricas, tarefas, usuarios, produtos, pedidos, promocoes, variacao_produto
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if await aquecer_pool():
+        await aplicar_indexes(get_db())
+        # Só avisa: a reconstrução é feita fora da aplicação (python -m services.rollups)
+        await verificar_rollups(get_db())
+    atualizador_precos = asyncio.create_task(manter_precos_atualizados(get_db()))
+    yield
+    atualizador_precos.cancel()
+    await gerenciador_tarefas.encerrar()
+    fechar_cliente()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(LoggingMiddleware)
 
 app.include_router(usuarios.router)
 app.include_router(produtos.router)
 app.include_router(variacao_produto.router)
 app.include_router(promocoes.router)
 app.include_router(pedidos.router)
-app.include_router(consultasComplexas.router)
\ No newline at end of file
+app.include_router(consultasComplexas.router)
+app.include_router(tarefas.router)
+app.include_router(metricas.router)
\ No newline at end of file
@@ -11,6 +11,9 @@ class PyObjectId(ObjectId):
 
     @classmethod
     def validate(cls, v):
+        # Documentos vindos do Mongo já trazem ObjectId; só textos precisam ser convertidos
+        if isinstance(v, ObjectId):
+            return v
         if not ObjectId.is_valid(v):
             raise ValueError("ID inválido")
         return ObjectId(v)
@@ -13,6 +13,10 @@ class ItemPedido(BaseModel):
     atributos_selecionados: Dict[str, str]
     quantidade: int
     preco_unitario: float
+    # Retrato do produto no momento da compra, usado pelos relatórios sem consultar `produtos`
+    categoria: Optional[str] = None
+    marca: Optional[str] = None
+    id_promocao: Optional[PyObjectId] = None
 
     class Config:
         json_encoders = {ObjectId: str}
@@ -24,6 +28,9 @@ class PedidoBase(BaseModel):
     status: StatusPedido
     forma_pagamento: FormaPagamento
     itens: List[ItemPedido] = Field(default_factory=list)
+    # Endereço de entrega do comprador no momento da compra
+    cidade_entrega: Optional[str] = None
+    estado_entrega: Optional[str] = None
 
 class PedidoOut(PedidoBase):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
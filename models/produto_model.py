@@ -17,6 +17,13 @@ class ProdutoBase(BaseModel):
 class ProdutoCreate(ProdutoBase):
     pass
 
+class ProdutoImportacao(ProdutoBase):
+    # Com _id a linha atualiza o produto (ou o cria com esse _id); sem _id cria um novo
+    id: Optional[PyObjectId] = Field(None, alias="_id")
+
+    class Config:
+        populate_by_name = True
+
 class ProdutoOut(ProdutoBase):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
 
@@ -1,22 +1,149 @@
-from typing import Generic, TypeVar, List
+import base64
+import binascii
+import os
+import time
+from typing import Any, Dict, Generic, List, Optional, Tuple, TypeVar
+from bson import json_util
+from motor.motor_asyncio import AsyncIOMotorCollection
 from pydantic import BaseModel, computed_field
-from fastapi import Query
+from fastapi import HTTPException, Query
 
-T = TypeVar('T') 
+T = TypeVar('T')
 
 class PaginationParams(BaseModel):
     page: int = Query(1, ge=1, description="Number of the page")
     per_page: int = Query(10, ge=1, le=100, description="Number of items per page")
+    mode: str = Query("offset", pattern="^(offset|cursor)$", description="'offset' (page/per_page) or 'cursor' (keyset, resumes from next_cursor)")
+    cursor: Optional[str] = Query(None, description="Opaque cursor returned in next_cursor; implies mode=cursor")
+    count: str = Query("exact", pattern="^(exact|estimated|none)$", description="How to compute total: 'exact' (default), 'estimated' (collection metadata or cached count, cheaper on large collections) or 'none'")
+
+    @property
+    def keyset(self) -> bool:
+        return self.mode == "cursor" or self.cursor is not None
 
 class PaginatedResponse(BaseModel, Generic[T]):
     items: List[T] # List of items in the current page
-    total: int # Total number of items across all pages
+    total: Optional[int] = None # Total number of items across all pages (None when count=none)
     page: int # Current page number
     per_page: int # Number of items per page
+    next_cursor: Optional[str] = None # Cursor for the next page in cursor mode (None on the last page)
 
     @computed_field
     @property
-    def total_pages(self) -> int:
+    def total_pages(self) -> Optional[int]:
+        if self.total is None:
+            return None
         if self.per_page == 0:
             return 0
-        return (self.total + self.per_page - 1) // self.per_page
\ No newline at end of file
+        return (self.total + self.per_page - 1) // self.per_page
+
+
+COUNT_CACHE_TTL = float(os.getenv("COUNT_CACHE_TTL", "30"))
+COUNT_CACHE_MAX_ENTRIES = 1024
+
+# (collection, normalized filter) -> (timestamp, total)
+_count_cache: Dict[Tuple[str, str], Tuple[float, int]] = {}
+
+def _count_cache_key(collection: AsyncIOMotorCollection, filtros: Dict[str, Any]) -> Tuple[str, str]:
+    return collection.full_name, json_util.dumps(filtros, sort_keys=True)
+
+def _store_count(key: Tuple[str, str], total: int, now: float) -> None:
+    if len(_count_cache) >= COUNT_CACHE_MAX_ENTRIES:
+        for expired in [k for k, (stored_at, _) in _count_cache.items() if now - stored_at >= COUNT_CACHE_TTL]:
+            del _count_cache[expired]
+    if len(_count_cache) >= COUNT_CACHE_MAX_ENTRIES:
+        del _count_cache[next(iter(_count_cache))]
+    _count_cache[key] = (now, total)
+
+async def count_total(
+    collection: AsyncIOMotorCollection,
+    filtros: Dict[str, Any],
+    mode: str = "exact"
+) -> Optional[int]:
+    """
+    Counts the documents matching `filtros` according to `mode`.
+
+    'exact' (the default) always runs count_documents. 'estimated' is opt-in: it reads
+    the collection metadata (estimated_document_count) when there is no filter, and
+    otherwise serves count_documents from a cache keyed by the normalized filter for
+    COUNT_CACHE_TTL seconds. 'none' skips counting.
+    """
+    if mode == "none":
+        return None
+    if mode == "exact":
+        return await collection.count_documents(filtros)
+    if not filtros:
+        return await collection.estimated_document_count()
+
+    key = _count_cache_key(collection, filtros)
+    now = time.monotonic()
+    cached = _count_cache.get(key)
+    if cached and now - cached[0] < COUNT_CACHE_TTL:
+        return cached[1]
+
+    total = await collection.count_documents(filtros)
+    _store_count(key, total, now)
+    return total
+
+def _get_path(doc: Dict[str, Any], path: str) -> Any:
+    value: Any = doc
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def encode_cursor(doc: Dict[str, Any], sort_field: str, sort_order: int) -> str:
+    payload = {"f": sort_field, "o": sort_order, "v": _get_path(doc, sort_field), "id": doc["_id"]}
+    return base64.urlsafe_b64encode(json_util.dumps(payload).encode()).decode()
+
+def decode_cursor(cursor: str, sort_field: str, sort_order: int) -> Tuple[Any, Any]:
+    try:
+        payload = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+        value, last_id = payload["v"], payload["id"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+    if payload.get("f") != sort_field or payload.get("o") != sort_order:
+        raise HTTPException(status_code=400, detail="Cursor gerado para outra ordenação.")
+    return value, last_id
+
+def keyset_filter(filtros: Dict[str, Any], cursor: str, sort_field: str, sort_order: int) -> Dict[str, Any]:
+    value, last_id = decode_cursor(cursor, sort_field, sort_order)
+    op = "$gt" if sort_order == 1 else "$lt"
+    if sort_field == "_id":
+        condition = {"_id": {op: last_id}}
+    else:
+        # Resumes right after the last (sort key, _id) pair, so ties on the sort key are not skipped
+        condition = {"$or": [{sort_field: {op: value}}, {sort_field: value, "_id": {op: last_id}}]}
+    return {"$and": [filtros, condition]} if filtros else condition
+
+async def fetch_page(
+    collection: AsyncIOMotorCollection,
+    filtros: Dict[str, Any],
+    pagination: PaginationParams,
+    sort_field: Optional[str] = None,
+    sort_order: int = 1
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Fetches one page of documents and, in cursor mode, the cursor for the next one.
+
+    Offset mode keeps the skip/limit behaviour. Cursor mode sorts by (sort_field, _id) and
+    resumes with a range query, so every page costs the same regardless of its depth.
+    """
+    if not pagination.keyset:
+        cursor = collection.find(filtros)
+        if sort_field:
+            cursor = cursor.sort(sort_field, sort_order)
+        cursor = cursor.skip((pagination.page - 1) * pagination.per_page).limit(pagination.per_page)
+        return await cursor.to_list(length=pagination.per_page), None
+
+    sort_field = sort_field or "_id"
+    sort = [(sort_field, sort_order)] if sort_field == "_id" else [(sort_field, sort_order), ("_id", sort_order)]
+    query = keyset_filter(filtros, pagination.cursor, sort_field, sort_order) if pagination.cursor else filtros
+
+    docs = await collection.find(query).sort(sort).limit(pagination.per_page + 1).to_list(length=pagination.per_page + 1)
+    next_cursor = None
+    if len(docs) > pagination.per_page:
+        docs = docs[:pagination.per_page]
+        next_cursor = encode_cursor(docs[-1], sort_field, sort_order)
+    return docs, next_cursor
@@ -1,484 +1,651 @@
+import asyncio
 from enum import Enum
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta
 from all_enum.status_enum import CategoriaProduto
 from models.pedido_model import PedidoCreate, PedidoOut
 from collections import defaultdict, Counter
+from cache_http import cache_resposta
 from database import get_db
 from database import pedidos_collection, produtos_collection, promocoes_collection, users_collection
+from pagination import PaginationParams, count_total, fetch_page
+from services.busca import normalizar
+from services.carregadores import Carregadores, get_carregadores
+from services.exportacao import TAMANHO_LOTE_CURSOR, resposta_exportacao
+from services.indice_promocoes import indice_promocoes
+from services.rollups import inicio_do_dia
+from tarefas_relatorios import TAREFAS_TTL, RotaRelatorio, executar_em_tarefa
 
 from bson import ObjectId
 
-router = APIRouter()
+router = APIRouter(route_class=RotaRelatorio)
 @router.get("/relatorios/vendas-por-categoria", tags=["Consultas complexas"])
+@executar_em_tarefa(ttl=TAREFAS_TTL)
 async def vendas_por_categoria(
     categoria: CategoriaProduto | None = Query(default=None, description="Filtrar por categoria"),
+    incluir_pedidos: bool = Query(default=True, description="Incluir o detalhamento paginado dos itens vendidos em cada categoria"),
+    pagination: PaginationParams = Depends(),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     '''
     Retorna um relatório de vendas por categoria (Vestuário, Decoração, Eletrônicos e Brinquedos.
 
-    Entidades acessadas: Pedido, Produto, Usuário
+    Os totais vêm dos rollups diários de vendas; o detalhamento em `pedidos` é
+    paginado por categoria com `page` e `per_page`. A categoria de cada item vem do
+    retrato gravado no pedido, sem consultar os produtos.
+
+    Entidades acessadas: Pedido, Usuário
     '''
     ultimo_mes = datetime.now() - timedelta(days=30)
 
-    cursor_pedidos = db.pedidos.find({
-        "data_pedido": {"$gte": ultimo_mes},
-        "status": "Entregue"
-    })
-
-    vendas_categoria = {}
-
-    async for pedido in cursor_pedidos:
-        id_usuario = pedido.get("id_usuario")
-        usuario = await db.usuarios.find_one({"_id": ObjectId(id_usuario)})
-        dados_usuario = {
-            "nome": usuario.get("nome", "Desconhecido"),
-            "email": usuario.get("email", "sem@email.com"),
-            "telefone": usuario.get("telefone", "Não informado")
-        } if usuario else {"nome": "Desconhecido", "email": "N/A", "telefone": "N/A"}
-
-        for item in pedido.get("itens", []):
-            # --- INÍCIO DA CORREÇÃO ---
-            # 1. Usamos .get() para buscar o id_produto de forma segura.
-            id_produto_obj = item.get("id_produto")
-
-            # 2. Se o id_produto não existir no item (dados antigos), pulamos para o próximo.
-            if not id_produto_obj:
-                continue
-            
-            # 3. Agora é seguro buscar o produto, pois sabemos que o ID existe.
-            produto = await db.produtos.find_one({"_id": id_produto_obj})
-            # --- FIM DA CORREÇÃO ---
-            
-            if not produto:
-                continue
-
-            cat_value = produto.get("categoria", "Indefinido")
-            # Se o parâmetro 'categoria' for um Enum, pegamos seu valor
-            categoria_value = categoria.value if categoria and hasattr(categoria, 'value') else categoria
-
-            if categoria_value and cat_value != categoria_value:
-                continue
-
-            if cat_value not in vendas_categoria:
-                vendas_categoria[cat_value] = {
-                    "quantidade": 0,
-                    "valor_total": 0.0,
-                    "pedidos": []
+    # Itens de pedidos entregues no último mês, com a categoria do produto na data da compra
+    match_pedidos: Dict[str, Any] = {"data_pedido": {"$gte": ultimo_mes}, "status": "Entregue"}
+    if categoria:
+        match_pedidos["itens.categoria"] = categoria.value
+    pipeline_itens: List[Dict[str, Any]] = [
+        {"$match": match_pedidos},
+        {"$unwind": "$itens"},
+        # Itens antigos podem não ter id_produto
+        {"$match": {"itens.id_produto": {"$nin": [None, ""]}}},
+        {"$addFields": {"categoria": {"$ifNull": ["$itens.categoria", "Indefinido"]}}},
+    ]
+    if categoria:
+        pipeline_itens.append({"$match": {"categoria": categoria.value}})
+
+    # Dias completos vêm dos rollups; o dia parcial do início da janela vem direto dos pedidos
+    inicio_rollups = inicio_do_dia(ultimo_mes) + timedelta(days=1)
+    filtro_rollups: Dict[str, Any] = {"status": "Entregue", "dia": {"$gte": inicio_rollups}}
+    if categoria:
+        filtro_rollups["categoria"] = categoria.value
+    pipeline_rollups = [
+        {"$match": filtro_rollups},
+        {
+            "$group": {
+                # Mesmo rótulo do dia parcial para itens sem categoria no retrato do pedido
+                "_id": {"$ifNull": ["$categoria", "Indefinido"]},
+                "quantidade_vendida": {"$sum": "$unidades"},
+                "valor_vendido": {"$sum": "$receita"},
+                "total_itens": {"$sum": "$itens"}
+            }
+        }
+    ]
+    pipeline_dia_parcial = pipeline_itens[:1] + [
+        {"$match": {"data_pedido": {"$lt": inicio_rollups}}}
+    ] + pipeline_itens[1:] + [
+        {
+            "$group": {
+                "_id": "$categoria",
+                "quantidade_vendida": {"$sum": {"$ifNull": ["$itens.quantidade", 0]}},
+                "valor_vendido": {
+                    "$sum": {
+                        "$multiply": [
+                            {"$ifNull": ["$itens.quantidade", 0]},
+                            {"$ifNull": ["$itens.preco_unitario", 0.0]}
+                        ]
+                    }
+                },
+                "total_itens": {"$sum": 1}
+            }
+        }
+    ]
+    parciais = await asyncio.gather(
+        db.vendas_diarias.aggregate(pipeline_rollups).to_list(length=None),
+        db.pedidos.aggregate(pipeline_dia_parcial).to_list(length=None)
+    )
+
+    totais: Dict[str, Dict[str, Any]] = {}
+    for parcial in parciais:
+        for dados in parcial:
+            acumulado = totais.setdefault(dados["_id"], {"_id": dados["_id"], "quantidade_vendida": 0, "valor_vendido": 0.0, "total_itens": 0})
+            for campo in ("quantidade_vendida", "valor_vendido", "total_itens"):
+                acumulado[campo] += dados[campo]
+    resumo = [totais[cat] for cat in sorted(totais) if totais[cat]["total_itens"] > 0]
+
+    async def detalhar(cat: str) -> List[Dict[str, Any]]:
+        pipeline_detalhe = pipeline_itens + [
+            {"$match": {"categoria": cat}},
+            {"$sort": {"data_pedido": 1, "_id": 1}},
+            {"$skip": (pagination.page - 1) * pagination.per_page},
+            {"$limit": pagination.per_page},
+            {
+                "$lookup": {
+                    "from": "usuarios",
+                    "localField": "id_usuario",
+                    "foreignField": "_id",
+                    "as": "usuario"
                 }
+            },
+            {"$addFields": {"usuario": {"$first": "$usuario"}}},
+            {
+                "$project": {
+                    "_id": 0,
+                    "nome_produto": "$itens.nome_produto",
+                    "sku": "$itens.sku_selecionado",
+                    "quantidade": {"$ifNull": ["$itens.quantidade", 0]},
+                    "preco_unitario": {"$ifNull": ["$itens.preco_unitario", 0.0]},
+                    "usuario": {
+                        "$cond": [
+                            {"$ifNull": ["$usuario", False]},
+                            {
+                                "nome": {"$ifNull": ["$usuario.nome", "Desconhecido"]},
+                                "email": {"$ifNull": ["$usuario.email", "sem@email.com"]},
+                                "telefone": {"$ifNull": ["$usuario.telefone", "Não informado"]}
+                            },
+                            {"nome": "Desconhecido", "email": "N/A", "telefone": "N/A"}
+                        ]
+                    }
+                }
+            }
+        ]
+        return await db.pedidos.aggregate(pipeline_detalhe).to_list(length=None)
 
-            quantidade_item = item.get("quantidade", 0)
-            preco_item = item.get("preco_unitario", 0.0)
-
-            vendas_categoria[cat_value]["quantidade"] += quantidade_item
-            vendas_categoria[cat_value]["valor_total"] += quantidade_item * preco_item
-
-            vendas_categoria[cat_value]["pedidos"].append({
-                "nome_produto": produto.get("nome"),
-                "sku": item.get("sku_selecionado"),
-                "quantidade": quantidade_item,
-                "preco_unitario": preco_item,
-                "usuario": dados_usuario
-            })
+    detalhes = []
+    if incluir_pedidos:
+        detalhes = await asyncio.gather(*(detalhar(dados["_id"]) for dados in resumo))
 
     resultado = []
-    for cat, dados in vendas_categoria.items():
-        resultado.append({
-            "categoria": cat,
-            "quantidade_vendida": dados["quantidade"],
-            "valor_vendido": round(dados["valor_total"], 2), # Arredondar o valor final é uma boa prática
-            "pedidos": dados["pedidos"]
-        })
+    for indice, dados in enumerate(resumo):
+        item_relatorio = {
+            "categoria": dados["_id"],
+            "quantidade_vendida": dados["quantidade_vendida"],
+            "valor_vendido": round(dados["valor_vendido"], 2), # Arredondar o valor final é uma boa prática
+        }
+        if incluir_pedidos:
+            item_relatorio["total_itens"] = dados["total_itens"]
+            item_relatorio["pedidos"] = detalhes[indice]
+        resultado.append(item_relatorio)
 
     return resultado
 
 
-@router.get("/relatorios/gastos-usuarios-por-regiao", tags=["Consultas complexas"])
-async def gastos_usuarios_por_regiao(
-    cidade: Optional[str] = Query(None, description="Cidade do usuário (opcional)"),
-    estado: Optional[str] = Query(None, description="Estado do usuário (opcional)"),
-    periodo_dias: Optional[int] = Query(365, description="Número de dias para trás para considerar os pedidos (padrão: 365)"),
-):
-    '''
-    Relatório de gastos dos usuários por região
-
-    Entidades acessadas: Usuário, Pedido e Produto
-    '''
-    data_limite = datetime.utcnow() - timedelta(days=periodo_dias)
-
-    match_usuarios: Dict[str, Any] = {}
+def _filtro_regiao(cidade: Optional[str], estado: Optional[str]) -> Dict[str, Any]:
+    """
+    Filtro de pedidos pela cidade/estado de entrega gravados no retrato do pedido, por igualdade
+    nos campos normalizados de `regiao_entrega` (índices regiao_entrega_*).
+    """
+    filtro: Dict[str, Any] = {}
     if cidade:
-        match_usuarios["endereco_de_entrega.cidade"] = {"$regex": f"^{cidade}$", "$options": "i"}
+        filtro["regiao_entrega.cidade"] = normalizar(cidade).strip()
     if estado:
-        match_usuarios["endereco_de_entrega.estado"] = {"$regex": f"^{estado}$", "$options": "i"}
+        filtro["regiao_entrega.estado"] = normalizar(estado).strip()
+    return filtro
+
+
+def _pipeline_gastos_por_regiao(
+    cidade: Optional[str],
+    estado: Optional[str],
+    periodo_dias: int,
+    limite_produtos: int
+) -> List[Dict[str, Any]]:
+    """
+    Gasto por usuário, do maior para o menor, com os `limite_produtos` produtos mais comprados.
+    Os pedidos são filtrados primeiro (período e região de entrega); os itens são somados por
+    (usuário, produto) e depois por usuário. O nome do produto vem do item do pedido mais
+    recente; os dados do usuário são buscados com $lookup só para as linhas que chegam ao fim
+    (a página, quando paginado).
+    """
+    data_limite = datetime.utcnow() - timedelta(days=periodo_dias)
+    match_pedidos: Dict[str, Any] = {"data_pedido": {"$gte": data_limite}, **_filtro_regiao(cidade, estado)}
 
-    pipeline: List[Dict[str, Any]] = [
+    return [
+        {"$match": match_pedidos},
+        # Ordem definida para o $first: o nome gravado na compra mais recente do produto
+        {"$sort": {"data_pedido": -1, "_id": -1}},
+        {"$unwind": "$itens"},
         {
-            "$match": {
-                "data_pedido": {"$gte": data_limite}
+            "$group": {
+                "_id": {"usuario": "$id_usuario", "produto": "$itens.id_produto"},
+                "nome": {"$first": "$itens.nome_produto"},
+                "quantidade_comprada": {"$sum": "$itens.quantidade"},
+                "total_gasto": {"$sum": {"$multiply": ["$itens.quantidade", "$itens.preco_unitario"]}}
             }
         },
         {
-            "$unwind": "$itens"
-        },
-        {
-            "$lookup": {
-                "from": "produtos",
-                "localField": "itens.id_produto",
-                "foreignField": "_id",
-                "as": "produtoInfo"
+            "$group": {
+                "_id": "$_id.usuario",
+                "total_gasto": {"$sum": "$total_gasto"},
+                "produtos": {
+                    "$topN": {
+                        "n": limite_produtos,
+                        "sortBy": {"quantidade_comprada": -1, "_id.produto": 1},
+                        "output": {
+                            "id": {"$toString": "$_id.produto"},
+                            "nome": "$nome",
+                            "quantidade_comprada": "$quantidade_comprada"
+                        }
+                    }
+                }
             }
         },
+        {"$sort": {"total_gasto": -1, "_id": 1}},
+    ]
+
+
+def _estagios_detalhes_gastos() -> List[Dict[str, Any]]:
+    """Nome, e-mail e região do usuário, para as linhas já agregadas."""
+    return [
+        {"$lookup": {"from": "usuarios", "localField": "_id", "foreignField": "_id", "as": "usuario"}},
+        {"$set": {"usuario": {"$arrayElemAt": ["$usuario", 0]}}},
         {
-            "$unwind": "$produtoInfo"
-        },
-        {
-            "$lookup": {
-                "from": "usuarios",
-                "localField": "id_usuario",
-                "foreignField": "_id",
-                "as": "usuarioInfo"
+            "$project": {
+                "_id": 0,
+                "usuario": {
+                    "id": {"$toString": "$_id"},
+                    "nome": "$usuario.nome",
+                    "email": "$usuario.email",
+                    "cidade": "$usuario.endereco_de_entrega.cidade",
+                    "estado": "$usuario.endereco_de_entrega.estado"
+                },
+                "total_gasto": "$total_gasto",
+                "produtos_mais_comprados": "$produtos"
             }
         },
-        {
-            "$unwind": "$usuarioInfo"
-        },
     ]
 
-    if match_usuarios:
-        pipeline.append({
-            "$match": {
-                "usuarioInfo." + k: v for k, v in match_usuarios.items()
-            }
-        })
 
-    pipeline.append({
-        "$group": {
-            "_id": "$usuarioInfo._id",
-            "nome_usuario": {"$first": "$usuarioInfo.nome"},
-            "email_usuario": {"$first": "$usuarioInfo.email"},
-            "cidade_usuario": {"$first": "$usuarioInfo.endereco_de_entrega.cidade"},
-            "estado_usuario": {"$first": "$usuarioInfo.endereco_de_entrega.estado"},
-            "total_gasto": {
-                "$sum": { "$multiply": ["$itens.quantidade", "$itens.preco_unitario"] }
-            },
-            "produtos_comprados": {
-                "$push": {
-                    "id": {"$toString": "$produtoInfo._id"}, 
-                    "nome": "$produtoInfo.nome",
-                    "quantidade_comprada": "$itens.quantidade"
-                }
+@router.get("/relatorios/gastos-usuarios-por-regiao", tags=["Consultas complexas"])
+@executar_em_tarefa(ttl=TAREFAS_TTL)
+async def gastos_usuarios_por_regiao(
+    cidade: Optional[str] = Query(None, description="Cidade do usuário (opcional, sem distinção de caixa e acentos)"),
+    estado: Optional[str] = Query(None, description="Estado do usuário (opcional, sem distinção de caixa e acentos)"),
+    periodo_dias: Optional[int] = Query(365, description="Número de dias para trás para considerar os pedidos (padrão: 365)"),
+    limite_produtos: int = Query(10, ge=1, le=100, description="Máximo de produtos (os mais comprados) listados por usuário"),
+    pagination: PaginationParams = Depends(),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    '''
+    Relatório de gastos dos usuários por região, do maior gasto para o menor, paginado com
+    `page` e `per_page`. `total_usuarios` é omitido com `count=none`. A região é a de
+    entrega gravada em cada pedido na data da compra.
+
+    Entidades acessadas: Usuário e Pedido
+    '''
+    pagina = [
+        {"$skip": (pagination.page - 1) * pagination.per_page},
+        {"$limit": pagination.per_page},
+        *_estagios_detalhes_gastos(),
+    ]
+    facetas: Dict[str, Any] = {"gastos": pagina}
+    if pagination.count != "none":
+        facetas["total"] = [{"$count": "usuarios"}]
+    pipeline = _pipeline_gastos_por_regiao(cidade, estado, periodo_dias, limite_produtos) + [{"$facet": facetas}]
+
+    resultado = (await db.pedidos.aggregate(pipeline, allowDiskUse=True).to_list(length=1))[0]
+    total = resultado["total"][0]["usuarios"] if resultado.get("total") else 0
+    if not resultado["gastos"] and pagination.page == 1:
+        raise HTTPException(status_code=404, detail="Nenhum gasto ou usuário encontrado com os critérios fornecidos.")
+
+    return {
+        "total_usuarios": total if pagination.count != "none" else None,
+        "page": pagination.page,
+        "per_page": pagination.per_page,
+        "gastos": resultado["gastos"]
+    }
+
+CAMPOS_CSV_GASTOS = ["usuario_id", "nome", "email", "cidade", "estado", "total_gasto", "produto_id", "produto_nome", "quantidade_comprada"]
+
+def _linhas_csv_gastos(gasto: Dict[str, Any]) -> List[Dict[str, Any]]:
+    usuario = gasto["usuario"]
+    dados_usuario = {
+        "usuario_id": usuario.get("id"),
+        "nome": usuario.get("nome"),
+        "email": usuario.get("email"),
+        "cidade": usuario.get("cidade"),
+        "estado": usuario.get("estado"),
+        "total_gasto": gasto.get("total_gasto"),
+    }
+    return [
+        {**dados_usuario, "produto_id": produto.get("id"), "produto_nome": produto.get("nome"), "quantidade_comprada": produto.get("quantidade_comprada")}
+        for produto in gasto.get("produtos_mais_comprados") or [{}]
+    ]
+
+@router.get("/relatorios/gastos-usuarios-por-regiao/export", tags=["Consultas complexas"])
+async def exportar_gastos_usuarios_por_regiao(
+    cidade: Optional[str] = Query(None, description="Cidade do usuário (opcional, sem distinção de caixa e acentos)"),
+    estado: Optional[str] = Query(None, description="Estado do usuário (opcional, sem distinção de caixa e acentos)"),
+    periodo_dias: int = Query(365, description="Número de dias para trás para considerar os pedidos (padrão: 365)"),
+    limite_produtos: int = Query(10, ge=1, le=100, description="Máximo de produtos (os mais comprados) listados por usuário"),
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$", description="'ndjson' (um usuário por linha) ou 'csv' (um produto por linha)"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    '''
+    Versão em streaming do relatório de gastos por região (todos os usuários, sem paginação),
+    lida direto do cursor da agregação.
+
+    Entidades acessadas: Usuário e Pedido
+    '''
+    pipeline = _pipeline_gastos_por_regiao(cidade, estado, periodo_dias, limite_produtos) + _estagios_detalhes_gastos()
+    cursor = db.pedidos.aggregate(pipeline, allowDiskUse=True, batchSize=TAMANHO_LOTE_CURSOR)
+    return resposta_exportacao(cursor, formato, "gastos-por-regiao", CAMPOS_CSV_GASTOS, _linhas_csv_gastos)
+
+def _pipeline_promocoes_por_categoria(
+    ids_promocoes: List[ObjectId],
+    desde: datetime,
+    limite_pedidos: int
+) -> List[Dict[str, Any]]:
+    """
+    Totais por (promoção, categoria) dos itens vendidos desde `desde`. Um item entra na
+    promoção gravada nele na compra (`itens.id_promocao`), não nos `produtos_aplicaveis`
+    atuais da promoção; itens sem categoria somam em "Indefinido", como em vendas por
+    categoria. Cada grupo traz os `limite_pedidos` pedidos mais recentes.
+    """
+    valor_item = {
+        "$multiply": [{"$ifNull": ["$itens.quantidade", 0]}, {"$ifNull": ["$itens.preco_unitario", 0.0]}]
+    }
+
+    return [
+        {"$match": {"data_pedido": {"$gte": desde}, "itens.id_promocao": {"$in": ids_promocoes}}},
+        {"$unwind": "$itens"},
+        {"$match": {"itens.id_promocao": {"$in": ids_promocoes}}},
+        {
+            "$addFields": {
+                "promocao_id": "$itens.id_promocao",
+                "categoria": {"$ifNull": ["$itens.categoria", "Indefinido"]}
             }
-        }
-    })
-
-    pipeline.append({
-        "$addFields": {
-            "produtos_comprados_consolidados": {
-                "$reduce": {
-                    "input": "$produtos_comprados",
-                    "initialValue": [],
-                    "in": {
-                        "$let": {
-                            "vars": {
-                                "foundIndex": {
-                                    "$indexOfArray": ["$$value.id", "$$this.id"]
-                                }
-                            },
-                            "in": {
-                                "$cond": [
-                                    { "$ne": ["$$foundIndex", -1] },
-                                    {
-                                        "$map": {
-                                            "input": "$$value",
-                                            "as": "el",
-                                            "in": {
-                                                "$cond": [
-                                                    { "$eq": ["$$el.id", "$$this.id"] },
-                                                    {
-                                                        "id": "$$el.id",
-                                                        "nome": "$$el.nome",
-                                                        "quantidade_comprada": { "$add": ["$$el.quantidade_comprada", "$$this.quantidade_comprada"] }
-                                                    },
-                                                    "$$el"
-                                                ]
-                                            }
-                                        }
-                                    },
-                                    { "$concatArrays": ["$$value", [{ "id": "$$this.id", "nome": "$$this.nome", "quantidade_comprada": "$$this.quantidade_comprada" }]] }
-                                ]
+        },
+        # Um documento por (promoção, categoria, pedido), com os itens do pedido que entram no grupo
+        {
+            "$group": {
+                "_id": {"promocao": "$promocao_id", "categoria": "$categoria", "pedido": "$_id"},
+                "id_usuario": {"$first": "$id_usuario"},
+                "data_pedido": {"$first": "$data_pedido"},
+                "valor_total_pedido": {"$first": {"$ifNull": ["$valor_total", 0]}},
+                "quantidade": {"$sum": {"$ifNull": ["$itens.quantidade", 0]}},
+                "valor": {"$sum": valor_item},
+                "itens": {
+                    "$push": {
+                        "nome_produto": "$itens.nome_produto",
+                        "sku": "$itens.sku_selecionado",
+                        "quantidade": "$itens.quantidade",
+                        "preco_unitario": "$itens.preco_unitario"
+                    }
+                },
+                # Objeto indexado pelo id do produto, para que o grupo seguinte una os produtos sem repetição
+                "produtos": {
+                    "$mergeObjects": {
+                        "$arrayToObject": [[{
+                            "k": {"$toString": "$itens.id_produto"},
+                            "v": {
+                                "id": {"$toString": "$itens.id_produto"},
+                                "nome": "$itens.nome_produto",
+                                "categoria": "$categoria"
                             }
+                        }]]
+                    }
+                }
+            }
+        },
+        {
+            "$group": {
+                "_id": {"promocao": "$_id.promocao", "categoria": "$_id.categoria"},
+                "total_vendido": {"$sum": "$quantidade"},
+                "valor_total": {"$sum": "$valor"},
+                "total_pedidos": {"$sum": 1},
+                "produtos": {"$mergeObjects": "$produtos"},
+                "pedidos": {
+                    "$topN": {
+                        "n": limite_pedidos,
+                        "sortBy": {"data_pedido": -1, "_id.pedido": -1},
+                        "output": {
+                            "id": {"$toString": "$_id.pedido"},
+                            "id_usuario": {"$toString": "$id_usuario"},
+                            "data_pedido": "$data_pedido",
+                            "itens": "$itens",
+                            "valor_total": "$valor_total_pedido"
                         }
                     }
                 }
             }
         }
-    })
-
-    pipeline.append({
-        "$sort": {
-            "total_gasto": -1
-        }
-    })
-
-    pipeline.append({
-        "$project": {
-            "_id": 0,
-            "usuario": {
-                "id": {"$toString": "$_id"},
-                "nome": "$nome_usuario",
-                "email": "$email_usuario",
-                "cidade": "$cidade_usuario",
-                "estado": "$estado_usuario"
-            },
-            "total_gasto": "$total_gasto",
-            "produtos_mais_comprados": "$produtos_comprados_consolidados"
-        }
-    })
-
-    result = await pedidos_collection.aggregate(pipeline).to_list(length=None)
-
-    if not result:
-        raise HTTPException(status_code=404, detail="Nenhum gasto ou usuário encontrado com os critérios fornecidos.")
-
-    return result
+    ]
 
 @router.get("/relatorios/promocoes-vendas-por-categoria-detalhado" , tags=["Consultas complexas"])
-async def promocoes_vendas_por_categoria_detalhado():
+@executar_em_tarefa(ttl=TAREFAS_TTL)
+async def promocoes_vendas_por_categoria_detalhado(
+    limite_pedidos: int = Query(50, ge=1, le=1000, description="Máximo de pedidos (os mais recentes) listados por promoção e categoria"),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    carregadores: Carregadores = Depends(get_carregadores)
+):
     '''
-    Gera um relatório de vendas de produtos em promoção.
+    Gera um relatório de vendas de produtos em promoção, agrupado por promoção e categoria.
 
-    Entidades acessadas: Produto, Variação, Promocao e pedido.
+    Uma única agregação percorre os pedidos do último mês, sem consultar outras coleções:
+    cada item traz a promoção aplicada na compra e a categoria do produto (retrato gravado
+    no pedido), e os totais são agrupados por (promoção, categoria). Cada grupo traz os
+    produtos vendidos e os `limite_pedidos` pedidos mais recentes, mantendo a memória
+    limitada qualquer que seja o volume de pedidos.
+
+    Entidades acessadas: Produto, Promocao e pedido.
     '''
     ultimo_mes = datetime.utcnow() - timedelta(days=30)
 
-    promocoes_cursor = promocoes_collection.find({
-        "data_inicio": {"$lte": datetime.utcnow()},
-        "data_fim": {"$gte": datetime.utcnow()}
-    })
-    promocoes_ativas = [promo async for promo in promocoes_cursor]
+    promocoes_ativas = await indice_promocoes.promocoes_ativas(datetime.utcnow())
+    promocoes_ativas = [promocao for promocao in promocoes_ativas if promocao.get("produtos_aplicaveis")]
 
     if not promocoes_ativas:
         raise HTTPException(status_code=404, detail="Nenhuma promoção ativa encontrada.")
 
-    resultado_final = []
+    ids_promocoes = [promocao["_id"] for promocao in promocoes_ativas]
+    pipeline = _pipeline_promocoes_por_categoria(ids_promocoes, ultimo_mes, limite_pedidos)
+    grupos = await db.pedidos.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
 
-    for promocao in promocoes_ativas:
-        promo_id = promocao["_id"]
-        produtos_ids = promocao.get("produtos_aplicaveis", [])
+    ordem_promocoes = {promocao["_id"]: posicao for posicao, promocao in enumerate(promocoes_ativas)}
+    promocoes_por_id = {promocao["_id"]: promocao for promocao in promocoes_ativas}
+    grupos.sort(key=lambda grupo: (ordem_promocoes[grupo["_id"]["promocao"]], str(grupo["_id"]["categoria"])))
 
-        if not produtos_ids:
-            continue
+    # O preço base atual não faz parte do retrato: os produtos de todos os grupos, pedidos
+    # juntos ao carregador, saem em uma consulta só (cada produto uma vez)
+    produtos_por_grupo = await asyncio.gather(
+        *(carregadores.produtos.carregar_varios(grupo["produtos"]) for grupo in grupos)
+    )
 
-        pedidos_cursor = pedidos_collection.find({
-            "data_pedido": {"$gte": ultimo_mes},
-            "itens.id_produto": {"$in": produtos_ids}
+    resultado_final = []
+    for grupo, produtos_atuais in zip(grupos, produtos_por_grupo):
+        promocao = promocoes_por_id[grupo["_id"]["promocao"]]
+        resultado_final.append({
+            "categoria": grupo["_id"]["categoria"],
+            "promocao": {
+                "id": str(promocao["_id"]),
+                "nome": promocao.get("nome"),
+                "tipo_desconto": promocao.get("tipo_desconto"),
+                "valor_desconto": promocao.get("valor_desconto"),
+                "data_inicio": promocao.get("data_inicio"),
+                "data_fim": promocao.get("data_fim")
+            },
+            "total_vendido": grupo["total_vendido"],
+            "valor_total": grupo["valor_total"],
+            "total_pedidos": grupo["total_pedidos"],
+            "produtos": [
+                {**produto, "preco_base": (atual or {}).get("preco_base", 0.0)}
+                for produto, atual in zip(grupo["produtos"].values(), produtos_atuais)
+            ],
+            "pedidos": grupo["pedidos"]
         })
 
-        total_vendido = 0
-        valor_total = 0.0
-        produtos_json = []
-        pedidos_json = []
-
-        for pedido in await pedidos_cursor.to_list(None):
-            pedido_info = {
-                "id": str(pedido["_id"]),
-                "id_usuario": str(pedido["id_usuario"]),
-                "data_pedido": pedido["data_pedido"],
-                "itens": [],
-                "valor_total": pedido.get("valor_total", 0)
-            }
-
-            for item in pedido.get("itens", []):
-                produto_id = item.get("id_produto")
-                if produto_id not in produtos_ids:
-                    continue
-
-                produto = await produtos_collection.find_one({"_id": produto_id})
-                if not produto:
-                    continue
-
-                total_vendido += item.get("quantidade", 0)
-                valor_total += item.get("quantidade", 0) * item.get("preco_unitario", 0.0)
-
-                produto_info = {
-                    "id": str(produto["_id"]),
-                    "nome": produto["nome"],
-                    "categoria": produto.get("categoria", "Indefinida"),
-                    "preco_base": produto.get("preco_base", 0.0)
-                }
-
-                item_info = {
-                    "nome_produto": produto["nome"],
-                    "sku": item.get("sku_selecionado"),
-                    "quantidade": item.get("quantidade"),
-                    "preco_unitario": item.get("preco_unitario")
-                }
-
-                produtos_json.append(produto_info)
-                pedido_info["itens"].append(item_info)
-
-            if pedido_info["itens"]:
-                pedidos_json.append(pedido_info)
-
-        if pedidos_json:
-            resultado_final.append({
-                "categoria": produto_info.get("categoria", "Indefinida"),
-                "promocao": {
-                    "id": str(promocao["_id"]),
-                    "nome": promocao.get("nome"),
-                    "tipo_desconto": promocao.get("tipo_desconto"),
-                    "valor_desconto": promocao.get("valor_desconto"),
-                    "data_inicio": promocao.get("data_inicio"),
-                    "data_fim": promocao.get("data_fim")
-                },
-                "total_vendido": total_vendido,
-                "valor_total": valor_total,
-                "produtos": produtos_json,
-                "pedidos": pedidos_json
-            })
-
     return resultado_final
 
 @router.get("/relatorios/produtos-em-promocao", tags=["Consultas complexas"])
+# O estoque muda a cada pedido sem invalidar o relatório; o TTL curto limita essa defasagem
+@cache_resposta(tags=["precos"], ttl=30)
 async def produtos_em_promocao(db: AsyncIOMotorDatabase = Depends(get_db)):
     """
     Gera uma lista de todos os produtos que estão atualmente em promoção,
     detalhando a promoção aplicada.
+
+    Os preços vêm do catálogo de preços efetivos (`precos_efetivos`), mantido pelas rotas
+    de escrita e pelo atualizador de fronteiras de promoção; o estoque vem das variações.
     
     Entidades acessadas: Produto, Promocao e Variacao.
     """
-    agora = datetime.now(timezone.utc)
+    pipeline = [
+        {"$match": {"em_promocao": True, "valido_ate": {"$gt": datetime.now()}}},
+        {"$sort": {"produto_id": 1, "sku": 1}},
+        {
+            "$lookup": {
+                "from": "variacoes_produto",
+                "localField": "sku",
+                "foreignField": "sku",
+                "as": "variacao"
+            }
+        },
+        {
+            "$group": {
+                "_id": "$produto_id",
+                "nome_produto": {"$first": "$nome_produto"},
+                "categoria": {"$first": "$categoria"},
+                "promocao": {"$first": "$promocao"},
+                "variacoes": {
+                    "$push": {
+                        "sku": "$sku",
+                        "atributos": "$atributos",
+                        "estoque": {"$arrayElemAt": ["$variacao.estoque", 0]},
+                        "preco_original": "$preco_original",
+                        "preco_com_desconto": "$preco_final"
+                    }
+                }
+            }
+        },
+        {"$sort": {"_id": 1}}
+    ]
+
     resultado_final = []
+    async for produto in db.precos_efetivos.aggregate(pipeline):
+        resultado_final.append({
+            "produto_id": str(produto["_id"]),
+            "nome_produto": produto.get("nome_produto"),
+            "categoria": produto.get("categoria"),
+            "promocao": produto["promocao"],
+            "variacoes": produto["variacoes"]
+        })
 
-    # 1. Encontrar todas as promoções ativas
-    cursor_promocoes_ativas = db.promocoes.find({
-        "data_inicio": {"$lte": agora},
-        "data_fim": {"$gte": agora}
-    })
+    return resultado_final
 
-    async for promocao in cursor_promocoes_ativas:
-        ids_produtos_na_promo = promocao.get("produtos_aplicaveis", [])
-        
-        for id_produto_obj in ids_produtos_na_promo:
-            # 2. Buscar os detalhes do produto
-            produto = await db.produtos.find_one({"_id": id_produto_obj})
-            if not produto:
-                continue
-
-            variacoes_com_desconto = []
-            # 3. Buscar todas as variações daquele produto
-            cursor_variacoes = db.variacoes_produto.find({"produto_id": produto["_id"]})
-            
-            async for variacao in cursor_variacoes:
-                preco_base = produto.get("preco_base", 0)
-                preco_adicional = variacao.get("preco_adicional", 0)
-                preco_original = preco_base + preco_adicional
-
-                # 4. Calcular o preço com desconto
-                tipo_desconto = promocao.get("tipo_desconto")
-                valor_desconto = promocao.get("valor_desconto", 0)
-                preco_final = preco_original
-
-                if tipo_desconto == "porcentagem":
-                    preco_final = preco_original * (1 - valor_desconto / 100)
-                elif tipo_desconto == "valor_fixo":
-                    preco_final = preco_original - valor_desconto
-
-                # Garantir que o preço não seja negativo
-                preco_final = max(0, round(preco_final, 2))
-
-                variacoes_com_desconto.append({
-                    "sku": variacao.get("sku"),
-                    "atributos": variacao.get("atributos"),
-                    "estoque": variacao.get("estoque"),
-                    "preco_original": round(preco_original, 2),
-                    "preco_com_desconto": preco_final
-                })
-            
-            # Adicionar o produto e suas variações promocionais ao resultado
-            if variacoes_com_desconto:
-                resultado_final.append({
-                    "produto_id": str(produto["_id"]),
-                    "nome_produto": produto.get("nome"),
-                    "categoria": produto.get("categoria"),
-                    "promocao": {
-                        "nome": promocao.get("nome"),
-                        "data_fim": promocao.get("data_fim"),
-                        "tipo_desconto": promocao.get("tipo_desconto"),
-                        "valor_desconto": promocao.get("valor_desconto")
-                    },
-                    "variacoes": variacoes_com_desconto
-                })
 
-    return resultado_final
+def _item_historico(item: Dict[str, Any]) -> Dict[str, Any]:
+    # Nome e marca do momento da compra (retrato gravado no pedido)
+    return {
+        "nome_produto": item.get("nome_produto") or "Produto não encontrado",
+        "marca": item.get("marca") or "N/A",
+        "sku_selecionado": item.get("sku_selecionado"),
+        "atributos_selecionados": item.get("atributos_selecionados", {}),
+        "quantidade_comprada": item.get("quantidade"),
+        "preco_unitario_pago": item.get("preco_unitario")
+    }
+
+
+def _pedido_historico(pedido: Dict[str, Any], itens_detalhados: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "pedido_id": str(pedido["_id"]),
+        "data_pedido": pedido.get("data_pedido"),
+        "status": pedido.get("status"),
+        "valor_total_pago": pedido.get("valor_total"),
+        "forma_pagamento": pedido.get("forma_pagamento"),
+        "itens": itens_detalhados
+    }
 
 
 @router.get("/relatorios/historico-usuario/{id_usuario}", tags=["Consultas complexas"])
-async def historico_pedidos_usuario(id_usuario: str, db: AsyncIOMotorDatabase = Depends(get_db)):
+@executar_em_tarefa()
+async def historico_pedidos_usuario(
+    id_usuario: str,
+    page: Optional[int] = Query(None, ge=1, description="Página de pedidos; sem page nem per_page o histórico vem completo"),
+    per_page: Optional[int] = Query(None, ge=1, le=100, description="Pedidos por página (10 quando só page é informado)"),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    carregadores: Carregadores = Depends(get_carregadores)
+):
     """
-    Recupera o histórico completo de pedidos para um usuário específico,
-    enriquecendo cada item do pedido com detalhes do produto e da variação.
+    Recupera o histórico de pedidos de um usuário específico, do mais recente para o mais
+    antigo. Com `page` ou `per_page` a resposta traz só uma página de pedidos, com os campos
+    `page` e `per_page`; `total_pedidos` continua contando todos os pedidos do usuário.
+
+    O nome e a marca do produto de cada item são os gravados no pedido na compra, não os
+    atuais do produto.
 
-    Entidades acessadas: Usuario, Produto e pedido
+    Entidades acessadas: Usuario e pedido
     """
     # 1. Validar o ObjectId e verificar se o usuário existe
     if not ObjectId.is_valid(id_usuario):
         raise HTTPException(status_code=400, detail="Formato do ID de usuário inválido.")
     
     user_id_obj = ObjectId(id_usuario)
-    usuario = await db.usuarios.find_one({"_id": user_id_obj})
+    usuario = await carregadores.usuarios.carregar(user_id_obj)
     if not usuario:
         raise HTTPException(status_code=404, detail=f"Usuário com ID '{id_usuario}' não encontrado.")
 
-    # 2. Buscar todos os pedidos do usuário
-    cursor_pedidos = db.pedidos.find({"id_usuario": user_id_obj})
-    
-    historico_pedidos = []
-    async for pedido in cursor_pedidos:
-        itens_detalhados = []
-        # 3. Iterar sobre os itens de cada pedido
-        for item in pedido.get("itens", []):
-            produto = None
-            
-            # 4. Buscar os detalhes do produto
-            if item.get("id_produto"):
-                produto = await db.produtos.find_one({"_id": item["id_produto"]})
-
-            item_enriquecido = {
-                "nome_produto": produto.get("nome") if produto else "Produto não encontrado",
-                "marca": produto.get("marca") if produto else "N/A",
-                "sku_selecionado": item.get("sku_selecionado"),
-                "atributos_selecionados": item.get("atributos_selecionados", {}),
-                "quantidade_comprada": item.get("quantidade"),
-                "preco_unitario_pago": item.get("preco_unitario")
-            }
-            itens_detalhados.append(item_enriquecido)
-        
-        # 6. Reconstruir a estrutura do pedido com os itens detalhados
-        pedido_completo = {
-            "pedido_id": str(pedido["_id"]),
-            "data_pedido": pedido.get("data_pedido"),
-            "status": pedido.get("status"),
-            "valor_total_pago": pedido.get("valor_total"),
-            "forma_pagamento": pedido.get("forma_pagamento"),
-            "itens": itens_detalhados
-        }
-        historico_pedidos.append(pedido_completo)
+    # 2. Buscar os pedidos do usuário (todos, ou a página pedida e o total)
+    filtro_pedidos = {"id_usuario": user_id_obj}
+    paginacao = None
+    if page is None and per_page is None:
+        pedidos = await db.pedidos.find(filtro_pedidos, sort=[("data_pedido", -1)]).to_list(length=None)
+        total_pedidos = len(pedidos)
+    else:
+        paginacao = PaginationParams(page=page or 1, per_page=per_page or 10)
+        total_pedidos, (pedidos, _) = await asyncio.gather(
+            count_total(db.pedidos, filtro_pedidos, "exact"),
+            fetch_page(db.pedidos, filtro_pedidos, paginacao, "data_pedido", -1)
+        )
+
+    # 3. Reconstruir a estrutura de cada pedido com os itens detalhados
+    historico_pedidos = [
+        _pedido_historico(pedido, [_item_historico(item) for item in pedido.get("itens", [])])
+        for pedido in pedidos
+    ]
 
-    return {
+    resposta: Dict[str, Any] = {
         "usuario": {
             "id": str(usuario["_id"]),
             "nome": usuario.get("nome"),
             "email": usuario.get("email"),
             "data_de_cadastro": usuario.get("data_de_cadastro")
         },
-        "total_pedidos": len(historico_pedidos),
+        "total_pedidos": total_pedidos,
         "historico": historico_pedidos
     }
+    if paginacao:
+        resposta["page"] = paginacao.page
+        resposta["per_page"] = paginacao.per_page
+    return resposta
+
+
+CAMPOS_CSV_HISTORICO = [
+    "pedido_id", "data_pedido", "status", "valor_total_pago", "forma_pagamento",
+    "nome_produto", "marca", "sku_selecionado", "atributos_selecionados", "quantidade_comprada", "preco_unitario_pago"
+]
+
+def _linhas_csv_historico(pedido: Dict[str, Any]) -> List[Dict[str, Any]]:
+    dados_pedido = {campo: valor for campo, valor in pedido.items() if campo != "itens"}
+    return [{**dados_pedido, **item} for item in pedido["itens"] or [{}]]
+
+async def _historico_em_fluxo(cursor) -> AsyncIterator[Dict[str, Any]]:
+    async for pedido in cursor:
+        yield _pedido_historico(pedido, [_item_historico(item) for item in pedido.get("itens", [])])
+
+@router.get("/relatorios/historico-usuario/{id_usuario}/export", tags=["Consultas complexas"])
+async def exportar_historico_pedidos_usuario(
+    id_usuario: str,
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$", description="'ndjson' (um pedido por linha) ou 'csv' (um item por linha)"),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    carregadores: Carregadores = Depends(get_carregadores)
+):
+    """
+    Versão em streaming do histórico de pedidos de um usuário, lida direto do cursor dos
+    pedidos (nome e marca dos produtos vêm do retrato gravado em cada item).
+
+    Entidades acessadas: Usuario e pedido
+    """
+    if not ObjectId.is_valid(id_usuario):
+        raise HTTPException(status_code=400, detail="Formato do ID de usuário inválido.")
+
+    user_id_obj = ObjectId(id_usuario)
+    if not await carregadores.usuarios.carregar(user_id_obj):
+        raise HTTPException(status_code=404, detail=f"Usuário com ID '{id_usuario}' não encontrado.")
+
+    cursor = db.pedidos.find({"id_usuario": user_id_obj}, sort=[("data_pedido", -1)], batch_size=TAMANHO_LOTE_CURSOR)
+    return resposta_exportacao(
+        _historico_em_fluxo(cursor), formato, f"historico-{id_usuario}", CAMPOS_CSV_HISTORICO, _linhas_csv_historico
+    )
 
 
 class OrdemRanking(str, Enum):
@@ -486,6 +653,7 @@ class OrdemRanking(str, Enum):
     unidades = "unidades"
 
 @router.get("/relatorios/ranking-produtos/best-sellers", tags=["Consultas complexas"])
+@executar_em_tarefa(ttl=TAREFAS_TTL)
 async def ranking_best_sellers(
     ordem: OrdemRanking = Query(default=OrdemRanking.receita, description="Critério para ordenar o ranking: 'receita' ou 'unidades'"),
     db: AsyncIOMotorDatabase = Depends(get_db)
@@ -493,22 +661,22 @@ async def ranking_best_sellers(
     """
     Cria uma lista ordenada dos produtos mais vendidos (best-sellers),
     calculando a receita total e o número de unidades vendidas para cada um.
+
+    Os totais são lidos dos rollups diários de vendas, sem reprocessar os pedidos.
     
     Entidades acessadas: Produtos, Variação, Pedido.
     """
     
     pipeline = [
         { "$match": { "status": "Entregue" } },
-        { "$unwind": "$itens" },
         {
             "$group": {
-                "_id": "$itens.id_produto",
-                "total_unidades_vendidas": { "$sum": "$itens.quantidade" },
-                "receita_gerada": { 
-                    "$sum": { "$multiply": ["$itens.quantidade", "$itens.preco_unitario"] } 
-                }
+                "_id": "$id_produto",
+                "total_unidades_vendidas": { "$sum": "$unidades" },
+                "receita_gerada": { "$sum": "$receita" }
             }
         },
+        { "$match": { "total_unidades_vendidas": { "$gt": 0 } } },
         {
             "$lookup": {
                 "from": "produtos",
@@ -540,7 +708,7 @@ async def ranking_best_sellers(
         }
     ]
 
-    cursor = db.pedidos.aggregate(pipeline)
+    cursor = db.vendas_diarias.aggregate(pipeline)
     ranking = await cursor.to_list(length=None)
     
     return ranking
\ No newline at end of file
@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from logging_middleware import metricas_prometheus
+
+router = APIRouter(tags=["Métricas"])
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metricas():
+    """Métricas do processo no formato texto do Prometheus."""
+    return PlainTextResponse(metricas_prometheus(), media_type="text/plain; version=0.0.4")
@@ -1,13 +1,21 @@
-import math
-import logging
+import asyncio
 from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from cache_http import invalidar_cache
 from logger import get_logger
-from database import get_db, pedidos_collection, users_collection, produtos_collection, variacao_collection
+from database import get_db, pedidos_collection, variacao_collection
 from models.pedido_model import PedidoCreate, PedidoOut, StatusPedido, FormaPagamento
-from pagination import PaginationParams, PaginatedResponse
+from pagination import PaginationParams, PaginatedResponse, count_total, fetch_page
+from routes.variacao_produto import leituras_variacoes
+from serializacao import resposta_paginada
+from services.busca import filtro_termos, regiao_usuario, termos_nome
+from services.carregadores import Carregadores, get_carregadores
+from services.estoque import EstoqueInsuficiente, cancelar_reserva, confirmar_reserva, quantidades_por_sku, reservar_estoque
+from services.exportacao import TAMANHO_LOTE_CURSOR, resposta_exportacao
+from services.precos_efetivos import carregar_contexto_precos
+from services.rollups import registrar_pedido, substituir_pedido
 from bson import ObjectId
 
 logger = get_logger("pedidos_logger", "log/pedidos.log")
@@ -16,97 +24,124 @@ router = APIRouter(prefix="/pedidos", tags=["Pedidos"])
 
 def validar_object_id(id_str: str, nome_campo: str = "ID") -> ObjectId:
     if not ObjectId.is_valid(id_str):
-        logger.warning(f"Tentativa de usar um {nome_campo} inválido: {id_str}")
+        logger.warning("Tentativa de usar um %s inválido: %s", nome_campo, id_str)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{nome_campo} inválido.")
     return ObjectId(id_str)
 
 @router.post("/create/", response_model=PedidoOut, status_code=status.HTTP_201_CREATED)
-async def criar_pedido(pedido_data: PedidoCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
+async def criar_pedido(
+    pedido_data: PedidoCreate,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    carregadores: Carregadores = Depends(get_carregadores)
+):
     """
     Cria um novo pedido, aplicando descontos de promoções ativas no momento da compra.
+
+    O pedido guarda um retrato do momento da compra: categoria, marca e promoção de cada
+    item e a cidade/estado de entrega, lidos pelos relatórios e rollups sem novas consultas.
     """
-    logger.info(f"Tentativa de criar pedido para o usuário ID: {pedido_data.id_usuario}")
+    logger.info("Tentativa de criar pedido para o usuário ID: %s", pedido_data.id_usuario)
 
     uid = validar_object_id(pedido_data.id_usuario, "ID do Usuário")
-    if not await users_collection.find_one({"_id": uid}):
+    # Usuário, variações e preços do carrinho em paralelo, uma consulta por coleção
+    usuario, contexto = await asyncio.gather(
+        carregadores.usuarios.carregar(uid),
+        carregar_contexto_precos(db, [item.sku_selecionado for item in pedido_data.itens], carregadores.variacoes_por_sku)
+    )
+    if not usuario:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Usuário com ID '{uid}' não encontrado.")
 
+    endereco = usuario.get("endereco_de_entrega") or {}
     pedido_para_salvar = {
         "id_usuario": uid,
         "data_pedido": datetime.now(),
         "status": pedido_data.status.value,
         "forma_pagamento": pedido_data.forma_pagamento.value,
         "itens": [],
-        "valor_total": 0.0
+        "valor_total": 0.0,
+        "cidade_entrega": endereco.get("cidade"),
+        "estado_entrega": endereco.get("estado"),
+        "regiao_entrega": regiao_usuario(endereco)
     }
     subtotal = 0.0
 
     for item_recebido in pedido_data.itens:
-        variacao = await variacao_collection.find_one({"sku": item_recebido.sku_selecionado})
+        variacao = contexto.variacao(item_recebido.sku_selecionado)
         
         if not variacao:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"SKU '{item_recebido.sku_selecionado}' não encontrado.")
         if variacao.get("estoque", 0) < item_recebido.quantidade:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Estoque insuficiente para o SKU '{item_recebido.sku_selecionado}'. Estoque atual: {variacao.get('estoque', 0)}.")
         
-        produto = await produtos_collection.find_one({"_id": variacao["produto_id"]})
+        produto = contexto.produto(variacao["produto_id"])
         if not produto:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Produto pai para o SKU '{item_recebido.sku_selecionado}' não encontrado.")
         
-   
-        preco_unitario, _ = await calcular_preco_final(db, produto, variacao)
+        preco_unitario, promocao = contexto.preco(produto, variacao)
         
         subtotal += item_recebido.quantidade * preco_unitario
         
         item_para_salvar_no_db = {
             "id_produto": variacao["produto_id"],
             "nome_produto": produto.get("nome", "Nome não disponível"),
+            "termos_nome": termos_nome(produto),
             "sku_selecionado": item_recebido.sku_selecionado,
             "atributos_selecionados": variacao.get("atributos", {}),
             "quantidade": item_recebido.quantidade,
-            "preco_unitario": round(preco_unitario, 2)
+            "preco_unitario": round(preco_unitario, 2),
+            "categoria": produto.get("categoria"),
+            "marca": produto.get("marca"),
+            "id_promocao": promocao["id_promocao"] if promocao else None
         }
         pedido_para_salvar["itens"].append(item_para_salvar_no_db)
 
     pedido_para_salvar["valor_total"] = round(subtotal, 2)
-    
-    result = await pedidos_collection.insert_one(pedido_para_salvar)
-    novo_pedido = await pedidos_collection.find_one({"_id": result.inserted_id})
-    logger.info(f"Pedido ID '{result.inserted_id}' criado com sucesso.")
-    
-    # Abate o estoque
-    for item in pedido_para_salvar["itens"]:
-        await variacao_collection.update_one(
-            {"sku": item["sku_selecionado"]},
-            {"$inc": {"estoque": -item["quantidade"]}}
-        )
 
-    return PedidoOut(**novo_pedido)
+    # Reserva o estoque de forma atômica antes de gravar o pedido
+    pedido_para_salvar["_id"] = ObjectId()
+    quantidades = quantidades_por_sku(pedido_data.itens)
+    try:
+        await reservar_estoque(variacao_collection, pedido_para_salvar["_id"], quantidades)
+    except EstoqueInsuficiente as erro:
+        logger.warning("Falha ao reservar estoque para os SKUs: %s", erro.skus)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Estoque insuficiente para o SKU '{erro.skus[0]}'.")
+
+    try:
+        result = await pedidos_collection.insert_one(pedido_para_salvar)
+    except Exception:
+        await cancelar_reserva(variacao_collection, pedido_para_salvar["_id"], quantidades)
+        raise
+    await confirmar_reserva(variacao_collection, result.inserted_id, quantidades)
+    produtos_do_pedido = {item["id_produto"] for item in pedido_para_salvar["itens"]}
+    leituras_variacoes.descartar(*[str(produto_id) for produto_id in produtos_do_pedido])
+    await invalidar_cache(*[f"variacoes:{produto_id}" for produto_id in produtos_do_pedido])
+    logger.info("Pedido ID '%s' criado com sucesso.", result.inserted_id)
+
+    await registrar_pedido(db, pedido_para_salvar)
+
+    return PedidoOut(**pedido_para_salvar)
 
 @router.get("/get_by_id/{pedido_id}", response_model=PedidoOut)
 async def obter_pedido(pedido_id: str):
     oid = validar_object_id(pedido_id, "ID do Pedido")
     pedido = await pedidos_collection.find_one({"_id": oid})
     if not pedido:
-        logger.warning(f"Pedido com ID '{pedido_id}' não encontrado.")
+        logger.warning("Pedido com ID '%s' não encontrado.", pedido_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pedido não encontrado.")
     return PedidoOut(**pedido)
 
 @router.get("/get_all", response_model=PaginatedResponse[PedidoOut])
 async def listar_todos_pedidos(pagination: PaginationParams = Depends()):
-    logger.info(f"Listando todos os pedidos - Página: {pagination.page}, Limite: {pagination.per_page}")
-    total_items = await pedidos_collection.count_documents({})
-    skip = (pagination.page - 1) * pagination.per_page
+    logger.info("Listando todos os pedidos - Página: %s, Limite: %s", pagination.page, pagination.per_page)
+    total_items = await count_total(pedidos_collection, {}, pagination.count)
 
-    cursor = pedidos_collection.find({}).sort("data_pedido", -1).skip(skip).limit(pagination.per_page)
-    pedidos = [PedidoOut(**doc) async for doc in cursor]
-    total_pages = math.ceil(total_items / pagination.per_page) if total_items > 0 else 0
+    docs, next_cursor = await fetch_page(pedidos_collection, {}, pagination, "data_pedido", -1)
+    return resposta_paginada(PedidoOut, docs, total_items, pagination, next_cursor)
 
-    return PaginatedResponse(items=pedidos, total=total_items, page=pagination.page, per_page=pagination.per_page, total_pages=total_pages)
 @router.put("/update/{pedido_id}", response_model=PedidoOut)
 async def atualizar_pedido(pedido_id: str, dados: PedidoCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
 
-    logger.info(f"Tentativa de atualizar pedido ID: {pedido_id}")
+    logger.info("Tentativa de atualizar pedido ID: %s", pedido_id)
     oid = validar_object_id(pedido_id, "ID do Pedido")
         
     update_data = dados.model_dump(exclude_unset=True)
@@ -119,25 +154,27 @@ async def atualizar_pedido(pedido_id: str, dados: PedidoCreate, db: AsyncIOMotor
             detail="Nenhum campo válido para atualização foi fornecido (ex: status, forma_pagamento)."
         )
 
-    resultado = await db.pedidos.update_one({"_id": oid}, {"$set": update_data})
+    pedido_anterior = await db.pedidos.find_one_and_update({"_id": oid}, {"$set": update_data})
     
-    if resultado.matched_count == 0:
-        logger.warning(f"Pedido com ID '{pedido_id}' não encontrado para atualizar.")
+    if not pedido_anterior:
+        logger.warning("Pedido com ID '%s' não encontrado para atualizar.", pedido_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pedido não encontrado.")
     
-    pedido_atualizado = await db.pedidos.find_one({"_id": oid})
-    logger.info(f"Pedido ID '{pedido_id}' atualizado com sucesso.")
+    pedido_atualizado = {**pedido_anterior, **update_data}
+    await substituir_pedido(db, pedido_anterior, pedido_atualizado)
+    logger.info("Pedido ID '%s' atualizado com sucesso.", pedido_id)
     return PedidoOut(**pedido_atualizado)
 
 @router.delete("/delete/{pedido_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def deletar_pedido(pedido_id: str):
-    logger.info(f"Tentativa de deletar pedido ID: {pedido_id}")
+async def deletar_pedido(pedido_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
+    logger.info("Tentativa de deletar pedido ID: %s", pedido_id)
     oid = validar_object_id(pedido_id, "ID do Pedido")
-    resultado = await pedidos_collection.delete_one({"_id": oid})
-    if resultado.deleted_count == 0:
-        logger.warning(f"Pedido com ID '{pedido_id}' não encontrado para deletar.")
+    pedido_removido = await pedidos_collection.find_one_and_delete({"_id": oid})
+    if not pedido_removido:
+        logger.warning("Pedido com ID '%s' não encontrado para deletar.", pedido_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pedido não encontrado.")
-    logger.info(f"Pedido ID '{pedido_id}' deletado com sucesso.")
+    await registrar_pedido(db, pedido_removido, sinal=-1)
+    logger.info("Pedido ID '%s' deletado com sucesso.", pedido_id)
     return
 
 @router.get("/filtro/", response_model=PaginatedResponse[PedidoOut])
@@ -153,7 +190,7 @@ async def pesquisar_pedidos(
     ordem: str = "desc"
 ):
     filtros = {}
-    logger.info(f"Pesquisando pedidos com filtros: id_usuario='{id_usuario}', status='{status}', nome_produto='{nome_produto}'")
+    logger.info("Pesquisando pedidos com filtros: id_usuario='%s', status='%s', nome_produto='%s'", id_usuario, status, nome_produto)
 
     if id_usuario:
         filtros["id_usuario"] = validar_object_id(id_usuario, "ID do Usuário")
@@ -161,8 +198,11 @@ async def pesquisar_pedidos(
         filtros["status"] = status.value
     if forma_pagamento:
         filtros["forma_pagamento"] = forma_pagamento.value
-    if nome_produto:
-        filtros["itens.nome_produto"] = {"$regex": nome_produto, "$options": "i"}
+    # Como em /produtos/filtros/, um nome sem nenhuma palavra não filtra
+    filtro_nome = filtro_termos(nome_produto, "termos_nome") if nome_produto else {}
+    if filtro_nome:
+        # Termos do nome gravados no item na compra: produtos renomeados ou removidos depois continuam encontrados
+        filtros["itens"] = {"$elemMatch": filtro_nome}
 
     filtro_data = {}
     if data_inicio:
@@ -173,56 +213,53 @@ async def pesquisar_pedidos(
     if filtro_data:
         filtros["data_pedido"] = filtro_data
 
-    total_items = await pedidos_collection.count_documents(filtros)
+    total_items = await count_total(pedidos_collection, filtros, pagination.count)
     sort_order = 1 if ordem.lower() == "asc" else -1
-    skip = (pagination.page - 1) * pagination.per_page
-
-    cursor = pedidos_collection.find(filtros).sort(ordenar_por, sort_order).skip(skip).limit(pagination.per_page)
-    pedidos = [PedidoOut(**doc) async for doc in cursor]
-    total_pages = math.ceil(total_items / pagination.per_page) if total_items > 0 else 0
-    
-    logger.info(f"Pesquisa encontrou {total_items} pedidos.")
-    return PaginatedResponse(items=pedidos, total=total_items, page=pagination.page, per_page=pagination.per_page, total_pages=total_pages)
-
 
-@router.get("/quantidade", response_model=int)
-async def contar_pedidos():
-    total = await pedidos_collection.count_documents({})
-    logger.info(f"Total de pedidos: {total}")
-    return total
-
-async def calcular_preco_final(
-    db: AsyncIOMotorDatabase, 
-    produto: Dict, 
-    variacao: Dict
-) -> Tuple[float, Optional[Dict]]:
-  
-    agora = datetime.now()
-    preco_original = produto.get("preco_base", 0) + variacao.get("preco_adicional", 0)
+    docs, next_cursor = await fetch_page(pedidos_collection, filtros, pagination, ordenar_por, sort_order)
     
-    promocao_ativa = await db.promocoes.find_one({
-        "data_inicio": {"$lte": agora},
-        "data_fim": {"$gte": agora},
-        "produtos_aplicaveis": produto["_id"] 
-    })
+    logger.info("Pesquisa encontrou %s pedidos.", total_items)
+    return resposta_paginada(PedidoOut, docs, total_items, pagination, next_cursor)
 
-    if not promocao_ativa:
-        return round(preco_original, 2), None
 
-    tipo_desconto = promocao_ativa.get("tipo_desconto")
-    valor_desconto = promocao_ativa.get("valor_desconto", 0)
-    preco_final = preco_original
+CAMPOS_CSV_PEDIDOS = [
+    "pedido_id", "id_usuario", "data_pedido", "status", "forma_pagamento", "valor_total",
+    "id_produto", "nome_produto", "sku_selecionado", "quantidade", "preco_unitario"
+]
 
-    if tipo_desconto == "porcentagem":
-        preco_final = preco_original * (1 - valor_desconto / 100)
-    elif tipo_desconto == "valor_fixo":
-        preco_final = preco_original - valor_desconto
-
-    preco_final_seguro = max(0, round(preco_final, 2))
-    
-    info_promocao = {
-        "id_promocao": promocao_ativa["_id"],
-        "nome_promocao": promocao_ativa.get("nome")
+def linhas_csv_pedido(pedido: Dict) -> List[Dict]:
+    """Uma linha por item do pedido, repetindo os dados do pedido."""
+    dados_pedido = {
+        "pedido_id": pedido["_id"],
+        "id_usuario": pedido.get("id_usuario"),
+        "data_pedido": pedido.get("data_pedido"),
+        "status": pedido.get("status"),
+        "forma_pagamento": pedido.get("forma_pagamento"),
+        "valor_total": pedido.get("valor_total"),
     }
+    itens = pedido.get("itens") or [{}]
+    return [{**dados_pedido, **{campo: item.get(campo) for campo in CAMPOS_CSV_PEDIDOS[6:]}} for item in itens]
 
-    return preco_final_seguro, info_promocao
\ No newline at end of file
+@router.get("/export")
+async def exportar_pedidos(
+    data_inicio: datetime,
+    data_fim: datetime,
+    formato: str = Query("ndjson", pattern="^(ndjson|csv)$", description="'ndjson' (um pedido por linha) ou 'csv' (um item por linha)")
+):
+    """
+    Exporta em streaming os pedidos de um intervalo de datas, para cargas do data warehouse.
+    """
+    logger.info("Exportando pedidos de %s a %s em %s", data_inicio, data_fim, formato)
+    data_fim_ajustada = data_fim.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    cursor = (
+        pedidos_collection.find({"data_pedido": {"$gte": data_inicio, "$lt": data_fim_ajustada}})
+        .sort([("data_pedido", 1), ("_id", 1)])
+        .batch_size(TAMANHO_LOTE_CURSOR)
+    )
+    return resposta_exportacao(cursor, formato, "pedidos", CAMPOS_CSV_PEDIDOS, linhas_csv_pedido)
+
+@router.get("/quantidade", response_model=int)
+async def contar_pedidos(count: str = Query("exact", pattern="^(exact|estimated)$", description="'exact' (padrão) ou 'estimated' (metadados da coleção, mais rápido)")):
+    total = await count_total(pedidos_collection, {}, count)
+    logger.info("Total de pedidos: %s", total)
+    return total
@@ -1,92 +1,169 @@
-import math
 from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import Optional
-from database import produtos_collection
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
+from typing import Any, Dict, List, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from database import get_db, produtos_collection
+from cache_http import RotaComCache, cache_resposta, invalidar_cache
+from coalescencia import GrupoCoalescencia
 from logger import get_logger
-from models.produto_model import ProdutoCreate, ProdutoOut, CategoriaProduto
-from pagination import PaginationParams, PaginatedResponse
+from models.produto_model import ProdutoCreate, ProdutoImportacao, ProdutoOut, CategoriaProduto
+from pagination import PaginationParams, PaginatedResponse, count_total, encode_cursor, fetch_page, keyset_filter
+from serializacao import resposta_paginada
+from services.busca import campos_busca, filtro_termos
+from services.importacao import ATUALIZADO, ERRO, LinhaValida, executar_bulk, importar_em_lotes, ler_linhas, resultado_linha, resultados_do_bulk
+from services.precos_efetivos import atualizar_precos
 from bson import ObjectId
+from pymongo import InsertOne, ReturnDocument, UpdateOne
 from pagination import PaginatedResponse
 
 logger = get_logger("produtos_logger", "log/produtos.log")
 
-router = APIRouter(prefix="/produtos", tags=["Produtos"])
+router = APIRouter(prefix="/produtos", tags=["Produtos"], route_class=RotaComCache)
+
+# Leituras simultâneas do mesmo produto (ex.: lançamentos) fazem uma única consulta
+leituras_produto = GrupoCoalescencia("produtos_get_by_id")
 
 @router.post("/create", response_model=ProdutoOut, status_code=status.HTTP_201_CREATED)
 async def criar_produto(produto: ProdutoCreate):
     produto_dict = produto.model_dump()
     if not produto_dict.get("data_de_cadastro"):
         produto_dict["data_de_cadastro"] = datetime.utcnow()
+    produto_dict.update(campos_busca(produto_dict))
     
+    # insert_one preenche o _id no próprio dicionário, que já é o documento gravado
     result = await produtos_collection.insert_one(produto_dict)
-    novo_produto = await produtos_collection.find_one({"_id": result.inserted_id})
 
-    logger.info(f"Produto com id {result.inserted_id} criado.")
-    return ProdutoOut(**novo_produto)
+    logger.info("Produto com id %s criado.", result.inserted_id)
+    return ProdutoOut(**produto_dict)
+
+async def _gravar_lote_produtos(db: AsyncIOMotorDatabase, lote: List[LinhaValida]) -> List[Dict[str, Any]]:
+    agora = datetime.utcnow()
+    resultados, operacoes, destinos = [], [], []
+    ids_no_lote = set()
+    for numero, produto in lote:
+        if produto.id is not None:
+            # Duas linhas com o mesmo _id no bulk não ordenado: a ordem de aplicação não é garantida
+            if produto.id in ids_no_lote:
+                resultados.append(resultado_linha(numero, ERRO, erro=f"_id '{produto.id}' repetido no lote."))
+                continue
+            ids_no_lote.add(produto.id)
+
+        produto_dict = produto.model_dump(exclude={"id"})
+        produto_dict.update(campos_busca(produto_dict))
+        if produto.id is None:
+            produto_dict["_id"] = ObjectId()
+            produto_dict["data_de_cadastro"] = produto_dict["data_de_cadastro"] or agora
+            operacoes.append(InsertOne(produto_dict))
+            destinos.append((numero, produto_dict["_id"], True))
+            continue
+        atualizacao = {"$set": produto_dict}
+        if produto_dict["data_de_cadastro"] is None:
+            del produto_dict["data_de_cadastro"]
+            atualizacao["$setOnInsert"] = {"data_de_cadastro": agora}
+        operacoes.append(UpdateOne({"_id": produto.id}, atualizacao, upsert=True))
+        destinos.append((numero, produto.id, False))
+
+    criados, falhas = await executar_bulk(produtos_collection, operacoes)
+    resultados += resultados_do_bulk(destinos, criados, falhas)
+
+    # Produtos novos ainda não têm variações; só os atualizados afetam preços e cache
+    atualizados = [ObjectId(resultado["id"]) for resultado in resultados if resultado["status"] == ATUALIZADO]
+    if atualizados:
+        await atualizar_precos(db, atualizados)
+        leituras_produto.descartar(*[str(produto_id) for produto_id in atualizados])
+        await invalidar_cache(*[f"produto:{produto_id}" for produto_id in atualizados])
+    return resultados
+
+@router.post("/importar")
+async def importar_produtos(request: Request, db: AsyncIOMotorDatabase = Depends(get_db)):
+    """
+    Cria ou atualiza produtos em lote. O corpo é um array JSON ou NDJSON (um produto por
+    linha). Linhas com `_id` atualizam aquele produto; as demais criam um novo. Devolve o
+    resultado de cada linha (criado, atualizado, invalido ou erro).
+    """
+    resumo = await importar_em_lotes(
+        ler_linhas(request), ProdutoImportacao, lambda lote: _gravar_lote_produtos(db, lote)
+    )
+    logger.info(
+        "Importação de produtos: %s criados, %s atualizados, %s inválidos, %s erros.",
+        resumo["criados"], resumo["atualizados"], resumo["invalidos"], resumo["erros"]
+    )
+    return resumo
 
 @router.get("/get_by_id/{produto_id}", response_model=ProdutoOut)
+@cache_resposta(tags=["produto:{produto_id}"])
 async def obter_produto(produto_id: str):
     if not ObjectId.is_valid(produto_id):
-        logger.warning(f"Id inválido {produto_id}")
+        logger.warning("Id inválido %s", produto_id)
         raise HTTPException(status_code=400, detail="ID de produto inválido.")
-    produto = await produtos_collection.find_one({"_id": ObjectId(produto_id)})
+    produto = await leituras_produto.executar(
+        produto_id, lambda: produtos_collection.find_one({"_id": ObjectId(produto_id)})
+    )
     if not produto:
-        logger.warning(f"Produto não encontrado com o id {produto_id}")
+        logger.warning("Produto não encontrado com o id %s", produto_id)
         raise HTTPException(status_code=404, detail="Produto não encontrado.")
     
-    logger.info(f"Produto com id {produto_id} retornado.")
+    logger.info("Produto com id %s retornado.", produto_id)
     return ProdutoOut(**produto)
 
 @router.get("/get_all", response_model=PaginatedResponse[ProdutoOut])
 async def listar_todos_produtos(pagination: PaginationParams = Depends()):
-    total_items = await produtos_collection.count_documents({})
-    skip = (pagination.page - 1) * pagination.per_page
+    total_items = await count_total(produtos_collection, {}, pagination.count)
 
-    cursor = produtos_collection.find().skip(skip).limit(pagination.per_page)
-    produtos = [ProdutoOut(**doc) async for doc in cursor]
-    
-    total_pages = math.ceil(total_items / pagination.per_page) if total_items > 0 else 0
-
-    return PaginatedResponse(
-        items=produtos,
-        total=total_items,
-        page=pagination.page,
-        per_page=pagination.per_page,
-        total_pages=total_pages
-    )
+    docs, next_cursor = await fetch_page(produtos_collection, {}, pagination)
+
+    return resposta_paginada(ProdutoOut, docs, total_items, pagination, next_cursor)
 
 @router.put("/update/{produto_id}", response_model=ProdutoOut)
-async def atualizar_produto(produto_id: str, dados: ProdutoCreate):
+async def atualizar_produto(produto_id: str, dados: ProdutoCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
     if not ObjectId.is_valid(produto_id):
-        logger.warning(f"Id inválido {produto_id}")
+        logger.warning("Id inválido %s", produto_id)
         raise HTTPException(status_code=400, detail="ID de produto inválido.")
     
     update_data = dados.model_dump(exclude_unset=True)
-    result = await produtos_collection.update_one(
-        {"_id": ObjectId(produto_id)},
-        {"$set": update_data}
+    filtro = {"_id": ObjectId(produto_id)}
+    if "marca" not in update_data:
+        # Os termos de busca dependem também da marca guardada; o filtro garante que ela não mudou até a escrita
+        atual = await produtos_collection.find_one(filtro, {"marca": 1})
+        if not atual:
+            logger.warning("Produto não encontrado com o id %s", produto_id)
+            raise HTTPException(status_code=404, detail="Produto não encontrado.")
+        filtro["marca"] = atual.get("marca")
+    termos = campos_busca({**update_data, "marca": update_data.get("marca", filtro.get("marca"))})
+
+    produto_atualizado = await produtos_collection.find_one_and_update(
+        filtro,
+        {"$set": {**update_data, **termos}},
+        return_document=ReturnDocument.AFTER
     )
-    if result.matched_count == 0:
-        logger.warning(f"Produto não encontrado com o id {produto_id}")
+    if not produto_atualizado:
+        if "marca" in filtro:
+            logger.warning("Produto %s alterado durante a atualização.", produto_id)
+            raise HTTPException(status_code=409, detail="Produto alterado durante a atualização; tente novamente.")
+        logger.warning("Produto não encontrado com o id %s", produto_id)
         raise HTTPException(status_code=404, detail="Produto não encontrado.")
     
-    produto_atualizado = await produtos_collection.find_one({"_id": ObjectId(produto_id)})
+    await atualizar_precos(db, [produto_atualizado["_id"]])
+    leituras_produto.descartar(produto_id)
+    await invalidar_cache(f"produto:{produto_id}")
     
-    logger.info(f"Produto com id {produto_id} atualizado.")
+    logger.info("Produto com id %s atualizado.", produto_id)
     return ProdutoOut(**produto_atualizado)
 
 @router.delete("/delete/{produto_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def deletar_produto(produto_id: str):
+async def deletar_produto(produto_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
     if not ObjectId.is_valid(produto_id):
-        logger.warning(f"Id inválido {produto_id}")
+        logger.warning("Id inválido %s", produto_id)
         raise HTTPException(status_code=400, detail="ID de produto inválido.")
     result = await produtos_collection.delete_one({"_id": ObjectId(produto_id)})
     if result.deleted_count == 0:
-        logger.warning(f"Produto não encontrado com o id {produto_id}")
+        logger.warning("Produto não encontrado com o id %s", produto_id)
         raise HTTPException(status_code=404, detail="Produto não encontrado.")
+    await atualizar_precos(db, [ObjectId(produto_id)])
+    leituras_produto.descartar(produto_id)
+    await invalidar_cache(f"produto:{produto_id}")
     
-    logger.info(f"Produto com id {produto_id} deletado.")
+    logger.info("Produto com id %s deletado.", produto_id)
     return
 
 @router.get("/filtros/", response_model=PaginatedResponse[ProdutoOut])
@@ -104,7 +181,7 @@ async def pesquisar_produtos(
     filtros = {}
 
     if nome:
-        filtros["nome"] = {"$regex": nome, "$options": "i"}
+        filtros.update(filtro_termos(nome, "termos_nome"))
     if categoria:
         filtros["categoria"] = categoria.value
     
@@ -127,26 +204,60 @@ async def pesquisar_produtos(
     if filtro_data:
         filtros["data_de_cadastro"] = filtro_data
 
-    total_items = await produtos_collection.count_documents(filtros)
+    total_items = await count_total(produtos_collection, filtros, pagination.count)
     sort_order = 1 if ordem.lower() == "asc" else -1
-    skip = (pagination.page - 1) * pagination.per_page
 
-    cursor = produtos_collection.find(filtros).sort(ordenar_por, sort_order).skip(skip).limit(pagination.per_page)
-    produtos = [ProdutoOut(**doc) async for doc in cursor]
+    docs, next_cursor = await fetch_page(produtos_collection, filtros, pagination, ordenar_por, sort_order)
 
-    total_pages = math.ceil(total_items / pagination.per_page) if total_items > 0 else 0
+    return resposta_paginada(ProdutoOut, docs, total_items, pagination, next_cursor)
 
-    return PaginatedResponse(
-        items=produtos,
-        total=total_items,
-        page=pagination.page,
-        per_page=pagination.per_page,
-        total_pages=total_pages
-    )
 
+@router.get("/busca", response_model=PaginatedResponse[ProdutoOut])
+async def buscar_produtos(
+    q: str = Query(..., min_length=1, description="Texto buscado em nome, descrição e marca"),
+    pagination: PaginationParams = Depends()
+):
+    """
+    Busca textual (índice de texto, sem distinção de acentos) ordenada por relevância.
+    No modo cursor a página seguinte continua do último par (relevância, _id) devolvido.
+    """
+    filtros = {"$text": {"$search": q}}
+    total_items = await count_total(produtos_collection, filtros, pagination.count)
+
+    pipeline: List[Dict[str, Any]] = [{"$match": filtros}, {"$addFields": {"score": {"$meta": "textScore"}}}]
+    if pagination.cursor:
+        pipeline.append({"$match": keyset_filter({}, pagination.cursor, "score", -1)})
+    pipeline.append({"$sort": {"score": -1, "_id": -1}})
+    if not pagination.keyset:
+        pipeline.append({"$skip": (pagination.page - 1) * pagination.per_page})
+    limite = pagination.per_page + 1 if pagination.keyset else pagination.per_page
+    pipeline.append({"$limit": limite})
+    docs = await produtos_collection.aggregate(pipeline).to_list(length=limite)
+
+    next_cursor = None
+    if len(docs) > pagination.per_page:
+        docs = docs[:pagination.per_page]
+        next_cursor = encode_cursor(docs[-1], "score", -1)
+
+    logger.info("Busca por '%s' encontrou %s produtos.", q, total_items)
+    return resposta_paginada(ProdutoOut, docs, total_items, pagination, next_cursor)
+
+@router.get("/autocomplete", response_model=List[Dict[str, str]])
+async def autocompletar_produtos(
+    prefixo: str = Query(..., min_length=1, description="Início do nome, descrição ou marca (acentos são ignorados)"),
+    limite: int = Query(10, ge=1, le=50)
+):
+    """
+    Sugestões de produtos cujos termos começam com as palavras digitadas.
+    """
+    filtros = filtro_termos(prefixo)
+    if not filtros:
+        return []
+    cursor = produtos_collection.find(filtros, {"nome": 1}).sort("nome", 1).limit(limite)
+    return [{"id": str(doc["_id"]), "nome": doc.get("nome", "")} async for doc in cursor]
 
 @router.get("/quantidade", response_model=int)
-async def contar_produtos():
-    total = await produtos_collection.count_documents({})
-    logger.info(f"Total de produtos: {total}")
+async def contar_produtos(count: str = Query("exact", pattern="^(exact|estimated)$", description="'exact' (padrão) ou 'estimated' (metadados da coleção, mais rápido)")):
+    total = await count_total(produtos_collection, {}, count)
+    logger.info("Total de produtos: %s", total)
     return total
\ No newline at end of file
@@ -1,89 +1,101 @@
-import math
 from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from cache_http import RotaComCache, cache_resposta, invalidar_cache
 from logger import get_logger
-from database import promocoes_collection
+from database import get_db, promocoes_collection
 from models.promocao_model import PromocaoCreate, PromocaoOut, TipoDesconto
-from pagination import PaginationParams, PaginatedResponse
+from pagination import PaginationParams, PaginatedResponse, count_total, fetch_page
+from serializacao import resposta_paginada
+from services.precos_efetivos import atualizar_precos
 from bson import ObjectId
 
 logger = get_logger("promocoes_logger", "log/promocoes.log")
 
-router = APIRouter(prefix="/promocoes", tags=["Promoções"])
+router = APIRouter(prefix="/promocoes", tags=["Promoções"], route_class=RotaComCache)
 
 def validar_object_id(id_str: str, nome_campo: str = "ID") -> ObjectId:
     if not ObjectId.is_valid(id_str):
-        logger.warning(f"Tentativa de usar um {nome_campo} inválido: {id_str}")
+        logger.warning("Tentativa de usar um %s inválido: %s", nome_campo, id_str)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{nome_campo} inválido.")
     return ObjectId(id_str)
 
 @router.post("/create", response_model=PromocaoOut, status_code=status.HTTP_201_CREATED)
-async def criar_promocao(promocao: PromocaoCreate):
-    logger.info(f"Tentativa de criar promoção: {promocao.nome}")
+async def criar_promocao(promocao: PromocaoCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
+    logger.info("Tentativa de criar promoção: %s", promocao.nome)
     dados = promocao.model_dump()
 
     if dados["data_inicio"] >= dados["data_fim"]:
-        logger.warning(f"Falha ao criar promoção '{promocao.nome}': data de início posterior ou igual à data de fim.")
+        logger.warning("Falha ao criar promoção '%s': data de início posterior ou igual à data de fim.", promocao.nome)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Data de início deve ser anterior à data de fim.")
 
     if promocao.tipo_desconto == TipoDesconto.PORCENTAGEM and not (0 < promocao.valor_desconto <= 100):
-        logger.warning(f"Falha ao criar promoção '{promocao.nome}': valor de porcentagem inválido ({promocao.valor_desconto}).")
+        logger.warning("Falha ao criar promoção '%s': valor de porcentagem inválido (%s).", promocao.nome, promocao.valor_desconto)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Porcentagem de desconto deve estar entre 1 e 100.")
 
     dados["produtos_aplicaveis"] = [validar_object_id(pid, "ID do Produto") for pid in dados["produtos_aplicaveis"]]
 
     resultado = await promocoes_collection.insert_one(dados)
-    nova_promocao = await promocoes_collection.find_one({"_id": resultado.inserted_id})
+    await atualizar_precos(db, dados["produtos_aplicaveis"])
+    await invalidar_cache("promocoes")
     
-    logger.info(f"Promoção '{nova_promocao['nome']}' criada com sucesso (ID: {resultado.inserted_id}).")
-    return PromocaoOut(**nova_promocao)
+    logger.info("Promoção '%s' criada com sucesso (ID: %s).", dados['nome'], resultado.inserted_id)
+    return PromocaoOut(**dados)
 
 @router.get("/get_by_id/{promocao_id}", response_model=PromocaoOut)
 async def obter_promocao(promocao_id: str):
     oid = validar_object_id(promocao_id, "ID da promoção")
     promocao = await promocoes_collection.find_one({"_id": oid})
     if not promocao:
-        logger.warning(f"Promoção com ID '{promocao_id}' não encontrada.")
+        logger.warning("Promoção com ID '%s' não encontrada.", promocao_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Promoção não encontrada.")
     return PromocaoOut(**promocao)
 
 @router.get("/get_all", response_model=PaginatedResponse[PromocaoOut])
+@cache_resposta(tags=["promocoes"])
 async def listar_todas_promocoes(pagination: PaginationParams = Depends()):
-    logger.info(f"Listando todas as promoções - Página: {pagination.page}, Limite: {pagination.per_page}")
-    total_items = await promocoes_collection.count_documents({})
-    skip = (pagination.page - 1) * pagination.per_page
+    logger.info("Listando todas as promoções - Página: %s, Limite: %s", pagination.page, pagination.per_page)
+    total_items = await count_total(promocoes_collection, {}, pagination.count)
 
-    cursor = promocoes_collection.find({}).sort("data_fim", -1).skip(skip).limit(pagination.per_page)
-    promocoes = [PromocaoOut(**doc) async for doc in cursor]
-    total_pages = math.ceil(total_items / pagination.per_page) if total_items > 0 else 0
+    docs, next_cursor = await fetch_page(promocoes_collection, {}, pagination, "data_fim", -1)
 
-    return PaginatedResponse(items=promocoes, total=total_items, page=pagination.page, per_page=pagination.per_page, total_pages=total_pages)
+    return resposta_paginada(PromocaoOut, docs, total_items, pagination, next_cursor)
 
 @router.put("/update/{promocao_id}", response_model=PromocaoOut)
-async def atualizar_promocao(promocao_id: str, promocao_update: PromocaoCreate):
-    logger.info(f"Tentativa de atualizar promoção ID: {promocao_id}")
+async def atualizar_promocao(promocao_id: str, promocao_update: PromocaoCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
+    logger.info("Tentativa de atualizar promoção ID: %s", promocao_id)
     oid = validar_object_id(promocao_id, "ID da promoção")
     dados = promocao_update.model_dump(exclude_unset=True)
 
-    resultado = await promocoes_collection.update_one({"_id": oid}, {"$set": dados})
-    if resultado.matched_count == 0:
-        logger.warning(f"Promoção com ID '{promocao_id}' não encontrada para atualizar.")
+    # O documento anterior indica os produtos que podem ter saído da promoção
+    promocao_anterior = await promocoes_collection.find_one_and_update(
+        {"_id": oid}, {"$set": dados}, return_document=ReturnDocument.BEFORE
+    )
+    if not promocao_anterior:
+        logger.warning("Promoção com ID '%s' não encontrada para atualizar.", promocao_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Promoção não encontrada.")
 
-    promocao_atualizada = await promocoes_collection.find_one({"_id": oid})
-    logger.info(f"Promoção ID '{promocao_id}' atualizada com sucesso.")
+    promocao_atualizada = {**promocao_anterior, **dados}
+    await atualizar_precos(
+        db, promocao_anterior.get("produtos_aplicaveis", []) + promocao_atualizada.get("produtos_aplicaveis", [])
+    )
+    await invalidar_cache("promocoes")
+    logger.info("Promoção ID '%s' atualizada com sucesso.", promocao_id)
     return PromocaoOut(**promocao_atualizada)
 
 @router.delete("/delete/{promocao_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def deletar_promocao(promocao_id: str):
-    logger.info(f"Tentativa de deletar promoção ID: {promocao_id}")
+async def deletar_promocao(promocao_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
+    logger.info("Tentativa de deletar promoção ID: %s", promocao_id)
     oid = validar_object_id(promocao_id, "ID da promoção")
-    resultado = await promocoes_collection.delete_one({"_id": oid})
-    if resultado.deleted_count == 0:
-        logger.warning(f"Promoção com ID '{promocao_id}' não encontrada para deletar.")
+    promocao_removida = await promocoes_collection.find_one_and_delete({"_id": oid})
+    if not promocao_removida:
+        logger.warning("Promoção com ID '%s' não encontrada para deletar.", promocao_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Promoção não encontrada.")
-    logger.info(f"Promoção ID '{promocao_id}' deletada com sucesso.")
+    await atualizar_precos(db, promocao_removida.get("produtos_aplicaveis", []))
+    await invalidar_cache("promocoes")
+    logger.info("Promoção ID '%s' deletada com sucesso.", promocao_id)
     return
 
 @router.get("/filtro/", response_model=PaginatedResponse[PromocaoOut])
@@ -98,7 +110,7 @@ async def pesquisar_promocoes(
 ):
     filtros = {}
     now = datetime.utcnow()
-    logger.info(f"Pesquisando promoções com filtros: nome='{nome}', tipo='{tipo_desconto}', status='{status}', produto_id='{produto_id}'")
+    logger.info("Pesquisando promoções com filtros: nome='%s', tipo='%s', status='%s', produto_id='%s'", nome, tipo_desconto, status, produto_id)
 
     if nome:
         filtros["nome"] = {"$regex": nome, "$options": "i"}
@@ -115,20 +127,17 @@ async def pesquisar_promocoes(
     elif status == "expiradas":
         filtros["data_fim"] = {"$lt": now}
 
-    total_items = await promocoes_collection.count_documents(filtros)
+    total_items = await count_total(promocoes_collection, filtros, pagination.count)
     sort_order = 1 if ordem.lower() == "asc" else -1
-    skip = (pagination.page - 1) * pagination.per_page
 
-    cursor = promocoes_collection.find(filtros).sort(ordenar_por, sort_order).skip(skip).limit(pagination.per_page)
-    promocoes = [PromocaoOut(**doc) async for doc in cursor]
-    total_pages = math.ceil(total_items / pagination.per_page) if total_items > 0 else 0
+    docs, next_cursor = await fetch_page(promocoes_collection, filtros, pagination, ordenar_por, sort_order)
     
-    logger.info(f"Pesquisa encontrou {total_items} promoções.")
-    return PaginatedResponse(items=promocoes, total=total_items, page=pagination.page, per_page=pagination.per_page, total_pages=total_pages)
+    logger.info("Pesquisa encontrou %s promoções.", total_items)
+    return resposta_paginada(PromocaoOut, docs, total_items, pagination, next_cursor)
 
 
 @router.get("/quantidade", response_model=int)  
-async def contar_promocoes():
-    total = await promocoes_collection.count_documents({})
-    logger.info(f"Total de promoções: {total}")
+async def contar_promocoes(count: str = Query("exact", pattern="^(exact|estimated)$", description="'exact' (padrão) ou 'estimated' (metadados da coleção, mais rápido)")):
+    total = await count_total(promocoes_collection, {}, count)
+    logger.info("Total de promoções: %s", total)
     return total
\ No newline at end of file
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, HTTPException, Response
+from tarefas_relatorios import PREFIXO_LINKS, Tarefa, gerenciador_tarefas
+
+router = APIRouter(prefix=PREFIXO_LINKS, tags=["Tarefas de relatórios"])
+
+
+def _tarefa_ou_404(tarefa_id: str) -> Tarefa:
+    tarefa = gerenciador_tarefas.obter(tarefa_id)
+    if tarefa is None:
+        raise HTTPException(status_code=404, detail="Tarefa não encontrada ou expirada.")
+    return tarefa
+
+
+@router.get("/{tarefa_id}")
+async def status_tarefa(tarefa_id: str):
+    """
+    Situação de uma tarefa de relatório: pendente, executando, concluida ou falhou. O
+    resultado fica disponível em `links.resultado` até expirar (TAREFAS_RETENCAO).
+    """
+    return _tarefa_ou_404(tarefa_id).resumo()
+
+
+@router.get("/{tarefa_id}/resultado")
+async def resultado_tarefa(tarefa_id: str) -> Response:
+    """
+    Resultado de uma tarefa, com o status HTTP e o corpo que o relatório devolveria na
+    requisição direta. Enquanto a tarefa não termina, responde 202 com a situação atual.
+    """
+    tarefa = _tarefa_ou_404(tarefa_id)
+    if not tarefa.concluida.is_set():
+        return tarefa.resposta_aceita()
+    return tarefa.resposta_resultado()
@@ -1,11 +1,14 @@
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
+from typing import Any, Dict, List, Optional
 from bson import ObjectId
+from pymongo import UpdateOne
 from database import users_collection
 from logger import get_logger
 from models.usuario_model import UserCreate, UserOut
-from pagination import PaginatedResponse, PaginationParams
+from pagination import PaginatedResponse, PaginationParams, count_total, fetch_page
+from serializacao import resposta_paginada
+from services.importacao import ERRO, LinhaValida, executar_bulk, importar_em_lotes, ler_linhas, resultado_linha, resultados_do_bulk
 
 logger = get_logger("usuarios_logger", "log/usuarios.log")
 
@@ -15,67 +18,98 @@ router = APIRouter(prefix="/usuarios", tags=["Usuários"])
 async def criar_usuario(usuario: UserCreate):
     usuario_dict = usuario.model_dump()
     result = await users_collection.insert_one(usuario_dict)
-    novo_usuario = await users_collection.find_one({"_id": result.inserted_id})
     
-    logger.info(f"Usuário com id {result.inserted_id} criado.")
-    return UserOut(**novo_usuario)
+    logger.info("Usuário com id %s criado.", result.inserted_id)
+    return UserOut(**usuario_dict)
+
+async def _gravar_lote_usuarios(lote: List[LinhaValida]) -> List[Dict[str, Any]]:
+    # Uma consulta por lote para saber quais e-mails já existem (e os ids, sem reler depois)
+    existentes = {
+        existente["email"]: existente["_id"]
+        async for existente in users_collection.find({"email": {"$in": [usuario.email for _, usuario in lote]}}, {"email": 1})
+    }
+
+    resultados, operacoes, destinos = [], [], []
+    emails_no_lote = set()
+    for numero, usuario in lote:
+        if usuario.email in emails_no_lote:
+            resultados.append(resultado_linha(numero, ERRO, erro=f"E-mail '{usuario.email}' repetido no lote."))
+            continue
+        emails_no_lote.add(usuario.email)
+
+        usuario_dict = usuario.model_dump()
+        atualizacao = {"$set": usuario_dict}
+        # Sem data informada, a data de cadastro só é gravada para usuários novos
+        if "data_de_cadastro" not in usuario.model_fields_set:
+            atualizacao["$setOnInsert"] = {"data_de_cadastro": usuario_dict.pop("data_de_cadastro")}
+        operacoes.append(UpdateOne({"email": usuario.email}, atualizacao, upsert=True))
+        destinos.append((numero, existentes.get(usuario.email), False))
+
+    criados, falhas = await executar_bulk(users_collection, operacoes)
+    return resultados + resultados_do_bulk(destinos, criados, falhas)
+
+@router.post("/importar")
+async def importar_usuarios(request: Request):
+    """
+    Cria ou atualiza usuários em lote, usando o e-mail como chave. O corpo é um array JSON ou
+    NDJSON (um usuário por linha). Devolve o resultado de cada linha (criado, atualizado,
+    invalido ou erro).
+    """
+    resumo = await importar_em_lotes(ler_linhas(request), UserCreate, _gravar_lote_usuarios)
+    logger.info(
+        "Importação de usuários: %s criados, %s atualizados, %s inválidos, %s erros.",
+        resumo["criados"], resumo["atualizados"], resumo["invalidos"], resumo["erros"]
+    )
+    return resumo
 
 @router.get("/get_all", response_model=PaginatedResponse) 
 async def listar_usuarios(pagination: PaginationParams = Depends()):
-    total_items = await users_collection.count_documents({})
-
-    skip = (pagination.page - 1) * pagination.per_page
+    total_items = await count_total(users_collection, {}, pagination.count)
 
-    cursor = users_collection.find().skip(skip).limit(pagination.per_page)
-    usuarios = [UserOut(**doc) async for doc in cursor]
+    docs, next_cursor = await fetch_page(users_collection, {}, pagination)
     
-    return PaginatedResponse(
-        items=usuarios,
-        total=total_items,
-        page=pagination.page,
-        per_page=pagination.per_page
-    )
+    return resposta_paginada(UserOut, docs, total_items, pagination, next_cursor)
 
 @router.get("/get_by_id/{usuario_id}", response_model=UserOut)
 async def obter_usuario(usuario_id: str):
     if not ObjectId.is_valid(usuario_id):
-        logger.warning(f"Id inválido o tentar acessar usuario")
+        logger.warning("Id inválido o tentar acessar usuario")
         raise HTTPException(status_code=400, detail="ID inválido.")
     usuario = await users_collection.find_one({"_id": ObjectId(usuario_id)})
     if not usuario:
-        logger.warning(f"Usuário não encontrado com o id {usuario_id}")
+        logger.warning("Usuário não encontrado com o id %s", usuario_id)
         raise HTTPException(status_code=404, detail="Usuário não encontrado.")
-    logger.warning(f"Usuário com id {usuario_id} retornado")
+    logger.warning("Usuário com id %s retornado", usuario_id)
     return UserOut(**usuario)
 
 @router.put("/update/{usuario_id}", response_model=UserOut)
 async def atualizar_usuario(usuario_id: str, dados: UserCreate):
     if not ObjectId.is_valid(usuario_id):
-        logger.warning(f"Id inválido o tentar atualizar usuario")
+        logger.warning("Id inválido o tentar atualizar usuario")
         raise HTTPException(status_code=400, detail="ID inválido.")
     result = await users_collection.update_one(
         {"_id": ObjectId(usuario_id)},
         {"$set": dados.model_dump()}
     )
     if result.matched_count == 0:
-        logger.warning(f"Usuário não encontrado com o id {usuario_id}")
+        logger.warning("Usuário não encontrado com o id %s", usuario_id)
         raise HTTPException(status_code=404, detail="Usuário não encontrado.")
     usuario = await users_collection.find_one({"_id": ObjectId(usuario_id)})
 
-    logger.info(f"Usuário com id {usuario_id} atualizado.")
+    logger.info("Usuário com id %s atualizado.", usuario_id)
     return UserOut(**usuario)
 
 @router.delete("/{usuario_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def deletar_usuario(usuario_id: str):
     if not ObjectId.is_valid(usuario_id):
-        logger.warning(f"Id inválido o tentar deletar usuario")
+        logger.warning("Id inválido o tentar deletar usuario")
         raise HTTPException(status_code=400, detail="ID inválido.")
     result = await users_collection.delete_one({"_id": ObjectId(usuario_id)})
     if result.deleted_count == 0:
-        logger.warning(f"Usuário não encontrado com o id {usuario_id}")
+        logger.warning("Usuário não encontrado com o id %s", usuario_id)
         raise HTTPException(status_code=404, detail="Usuário não encontrado.")
     
-    logger.info(f"Usuário com id {usuario_id} deletado.")
+    logger.info("Usuário com id %s deletado.", usuario_id)
     return
 
 @router.get("/filtros/", response_model=PaginatedResponse[UserOut])
@@ -109,24 +143,17 @@ async def pesquisar_usuarios(
     if filtro_data:
         filtros["data_de_cadastro"] = filtro_data
 
-    total_items = await users_collection.count_documents(filtros)
+    total_items = await count_total(users_collection, filtros, pagination.count)
     sort_order = 1 if ordem.lower() == "asc" else -1
-    skip = (pagination.page - 1) * pagination.per_page
 
-    cursor = users_collection.find(filtros).sort(ordenar_por, sort_order).skip(skip).limit(pagination.per_page)
-    usuarios = [UserOut(**doc) async for doc in cursor]
+    docs, next_cursor = await fetch_page(users_collection, filtros, pagination, ordenar_por, sort_order)
 
-    return PaginatedResponse(
-        items=usuarios,
-        total=total_items,
-        page=pagination.page,
-        per_page=pagination.per_page
-    )
+    return resposta_paginada(UserOut, docs, total_items, pagination, next_cursor)
     
     
     
 @router.get("/quantidade", response_model=int)
-async def contar_usuarios():
-    total = await users_collection.count_documents({})
-    logger.info(f"Total de usuários: {total}")
+async def contar_usuarios(count: str = Query("exact", pattern="^(exact|estimated)$", description="'exact' (padrão) ou 'estimated' (metadados da coleção, mais rápido)")):
+    total = await count_total(users_collection, {}, count)
+    logger.info("Total de usuários: %s", total)
     return total
\ No newline at end of file
@@ -1,127 +1,202 @@
-import math
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
+from typing import Any, Dict, List
+from cache_http import RotaComCache, cache_resposta, invalidar_cache
+from coalescencia import GrupoCoalescencia
 from logger import get_logger
 from models.variacao_produto import VariacaoCreate, VariacaoOut
-from pagination import PaginationParams, PaginatedResponse
-from database import produtos_collection, variacao_collection
+from pagination import PaginationParams, PaginatedResponse, count_total, fetch_page
+from serializacao import resposta_paginada
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from database import get_db, variacao_collection
+from services.carregadores import Carregadores, get_carregadores
+from services.importacao import ERRO, LinhaValida, executar_bulk, importar_em_lotes, ler_linhas, resultado_linha, resultados_do_bulk
+from services.precos_efetivos import atualizar_precos
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 
 logger = get_logger("variacoes_logger", "log/variacoes.log")
 
-router = APIRouter(prefix="/variacoes", tags=["Variações de Produto"])
+router = APIRouter(prefix="/variacoes", tags=["Variações de Produto"], route_class=RotaComCache)
+
+# Leituras simultâneas das variações do mesmo produto fazem uma única consulta
+leituras_variacoes = GrupoCoalescencia("variacoes_get_by_produto")
 
 @router.post("/create", response_model=VariacaoOut, status_code=status.HTTP_201_CREATED)
-async def criar_variacao(variacao: VariacaoCreate):
-    logger.info(f"Tentativa de criar variação com SKU: {variacao.sku}")
+async def criar_variacao(
+    variacao: VariacaoCreate,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    carregadores: Carregadores = Depends(get_carregadores)
+):
+    logger.info("Tentativa de criar variação com SKU: %s", variacao.sku)
     
     # 1. Verifica se o produto-pai existe
-    produto_pai = await produtos_collection.find_one({"_id": variacao.produto_id})
+    produto_pai = await carregadores.produtos.carregar(variacao.produto_id)
     if not produto_pai:
-        logger.warning(f"Falha ao criar variação: Produto com ID '{variacao.produto_id}' não encontrado.")
+        logger.warning("Falha ao criar variação: Produto com ID '%s' não encontrado.", variacao.produto_id)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Produto com ID '{variacao.produto_id}' não encontrado."
         )
 
-    # 2. Verifica se o SKU já existe
-    variacao_existente = await variacao_collection.find_one({"sku": variacao.sku})
-    if variacao_existente:
-        logger.warning(f"Falha ao criar variação: SKU '{variacao.sku}' já está em uso.")
+    # 2. Insere a nova variação; o índice único em 'sku' rejeita SKUs repetidos
+    variacao_dict = variacao.model_dump()
+    try:
+        result = await variacao_collection.insert_one(variacao_dict)
+    except DuplicateKeyError:
+        logger.warning("Falha ao criar variação: SKU '%s' já está em uso.", variacao.sku)
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"SKU '{variacao.sku}' já está em uso."
         )
-
-    # 3. Insere a nova variação
-    variacao_dict = variacao.model_dump()
-    result = await variacao_collection.insert_one(variacao_dict)
-    nova_variacao = await variacao_collection.find_one({"_id": result.inserted_id})
+    await atualizar_precos(db, [variacao.produto_id])
+    leituras_variacoes.descartar(str(variacao.produto_id))
+    await invalidar_cache(f"variacoes:{variacao.produto_id}")
     
-    logger.info(f"Variação com SKU '{nova_variacao['sku']}' criada com sucesso (ID: {result.inserted_id}).")
-    return VariacaoOut(**nova_variacao)
+    logger.info("Variação com SKU '%s' criada com sucesso (ID: %s).", variacao.sku, result.inserted_id)
+    return VariacaoOut(**variacao_dict)
+
+async def _gravar_lote_variacoes(db: AsyncIOMotorDatabase, lote: List[LinhaValida]) -> List[Dict[str, Any]]:
+    # Carregadores do lote (e não da requisição: o lote seguinte precisa ver o que este gravou).
+    # Cada linha busca seu produto-pai e seu SKU; são duas consultas por lote, não duas por linha.
+    carregadores = Carregadores(db)
+
+    async def consultar(variacao: VariacaoCreate):
+        return await asyncio.gather(
+            carregadores.produtos.carregar(variacao.produto_id), carregadores.variacoes_por_sku.carregar(variacao.sku)
+        )
+
+    consultas = await asyncio.gather(*(consultar(variacao) for _, variacao in lote))
+
+    resultados, operacoes, destinos = [], [], []
+    skus_no_lote, afetados = set(), set()
+    for (numero, variacao), (pai, existente) in zip(lote, consultas):
+        if not pai:
+            resultados.append(resultado_linha(numero, ERRO, erro=f"Produto com ID '{variacao.produto_id}' não encontrado."))
+            continue
+        if variacao.sku in skus_no_lote:
+            resultados.append(resultado_linha(numero, ERRO, erro=f"SKU '{variacao.sku}' repetido no lote."))
+            continue
+        skus_no_lote.add(variacao.sku)
+
+        operacoes.append(UpdateOne({"sku": variacao.sku}, {"$set": variacao.model_dump()}, upsert=True))
+        destinos.append((numero, existente["_id"] if existente else None, False))
+        afetados.add(variacao.produto_id)
+        if existente:
+            # A variação pode ter mudado de produto: o antigo também perde o SKU
+            afetados.add(existente["produto_id"])
+
+    criados, falhas = await executar_bulk(variacao_collection, operacoes)
+    resultados += resultados_do_bulk(destinos, criados, falhas)
+    if afetados:
+        await atualizar_precos(db, afetados)
+        leituras_variacoes.descartar(*[str(produto_id) for produto_id in afetados])
+        await invalidar_cache(*[f"variacoes:{produto_id}" for produto_id in afetados])
+    return resultados
+
+@router.post("/importar")
+async def importar_variacoes(request: Request, db: AsyncIOMotorDatabase = Depends(get_db)):
+    """
+    Cria ou atualiza variações em lote, usando o SKU como chave. O corpo é um array JSON ou
+    NDJSON (uma variação por linha). Devolve o resultado de cada linha (criado, atualizado,
+    invalido ou erro).
+    """
+    resumo = await importar_em_lotes(
+        ler_linhas(request), VariacaoCreate, lambda lote: _gravar_lote_variacoes(db, lote)
+    )
+    logger.info(
+        "Importação de variações: %s criadas, %s atualizadas, %s inválidas, %s erros.",
+        resumo["criados"], resumo["atualizados"], resumo["invalidos"], resumo["erros"]
+    )
+    return resumo
 
 @router.get("/get_all", response_model=PaginatedResponse[VariacaoOut])
 async def listar_todas_variacoes(pagination: PaginationParams = Depends()):
-    logger.info(f"Listando todas as variações - Página: {pagination.page}, Limite: {pagination.per_page}")
+    logger.info("Listando todas as variações - Página: %s, Limite: %s", pagination.page, pagination.per_page)
     
-    total_items = await variacao_collection.count_documents({})
-    skip = (pagination.page - 1) * pagination.per_page
+    total_items = await count_total(variacao_collection, {}, pagination.count)
 
-    cursor = variacao_collection.find({}).sort("sku", 1).skip(skip).limit(pagination.per_page)
-    variacoes = [VariacaoOut(**doc) async for doc in cursor]
+    docs, next_cursor = await fetch_page(variacao_collection, {}, pagination, "sku", 1)
 
-    total_pages = math.ceil(total_items / pagination.per_page) if total_items > 0 else 0
-
-    return PaginatedResponse(
-        items=variacoes,
-        total=total_items,
-        page=pagination.page,
-        per_page=pagination.per_page,
-        total_pages=total_pages
-    )
+    return resposta_paginada(VariacaoOut, docs, total_items, pagination, next_cursor)
 
 @router.get("/get_by_id/{variacao_id}", response_model=VariacaoOut)
 async def obter_variacao(variacao_id: str):
     if not ObjectId.is_valid(variacao_id):
-        logger.warning(f"Tentativa de obter variação com ID inválido: {variacao_id}")
+        logger.warning("Tentativa de obter variação com ID inválido: %s", variacao_id)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de variação inválido.")
     
     variacao = await variacao_collection.find_one({"_id": ObjectId(variacao_id)})
     if not variacao:
-        logger.warning(f"Variação com ID '{variacao_id}' não encontrada.")
+        logger.warning("Variação com ID '%s' não encontrada.", variacao_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Variação não encontrada.")
     
     return VariacaoOut(**variacao)
 
 @router.put("/update/{variacao_id}", response_model=VariacaoOut)
-async def atualizar_variacao(variacao_id: str, dados: VariacaoCreate):
+async def atualizar_variacao(variacao_id: str, dados: VariacaoCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
     if not ObjectId.is_valid(variacao_id):
-        logger.warning(f"Tentativa de atualizar variação com ID inválido: {variacao_id}")
+        logger.warning("Tentativa de atualizar variação com ID inválido: %s", variacao_id)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de variação inválido.")
     
     update_data = dados.model_dump(exclude_unset=True)
-    result = await variacao_collection.update_one(
-        {"_id": ObjectId(variacao_id)},
-        {"$set": update_data}
-    )
-    if result.matched_count == 0:
-        logger.warning(f"Variação com ID '{variacao_id}' não encontrada para atualizar.")
+    try:
+        # O documento anterior indica o produto de origem caso a variação mude de produto
+        variacao_anterior = await variacao_collection.find_one_and_update(
+            {"_id": ObjectId(variacao_id)},
+            {"$set": update_data},
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        logger.warning("Falha ao atualizar variação: SKU '%s' já está em uso.", dados.sku)
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"SKU '{dados.sku}' já está em uso.")
+    if not variacao_anterior:
+        logger.warning("Variação com ID '%s' não encontrada para atualizar.", variacao_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Variação não encontrada para atualizar.")
     
-    variacao_atualizada = await variacao_collection.find_one({"_id": ObjectId(variacao_id)})
-    logger.info(f"Variação ID '{variacao_id}' atualizada com sucesso.")
+    variacao_atualizada = {**variacao_anterior, **update_data}
+    await atualizar_precos(db, [variacao_anterior["produto_id"], variacao_atualizada["produto_id"]])
+    leituras_variacoes.descartar(str(variacao_anterior["produto_id"]), str(variacao_atualizada["produto_id"]))
+    await invalidar_cache(f"variacoes:{variacao_anterior['produto_id']}", f"variacoes:{variacao_atualizada['produto_id']}")
+    logger.info("Variação ID '%s' atualizada com sucesso.", variacao_id)
     return VariacaoOut(**variacao_atualizada)
 
 
 @router.delete("/delete/{variacao_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def deletar_variacao(variacao_id: str):
+async def deletar_variacao(variacao_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
     if not ObjectId.is_valid(variacao_id):
-        logger.warning(f"Tentativa de deletar variação com ID inválido: {variacao_id}")
+        logger.warning("Tentativa de deletar variação com ID inválido: %s", variacao_id)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de variação inválido.")
     
-    result = await variacao_collection.delete_one({"_id": ObjectId(variacao_id)})
-    if result.deleted_count == 0:
-        logger.warning(f"Variação com ID '{variacao_id}' não encontrada para deletar.")
+    variacao_removida = await variacao_collection.find_one_and_delete({"_id": ObjectId(variacao_id)})
+    if not variacao_removida:
+        logger.warning("Variação com ID '%s' não encontrada para deletar.", variacao_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Variação não encontrada para deletar.")
+    await atualizar_precos(db, [variacao_removida["produto_id"]])
+    leituras_variacoes.descartar(str(variacao_removida["produto_id"]))
+    await invalidar_cache(f"variacoes:{variacao_removida['produto_id']}")
     
-    logger.info(f"Variação ID '{variacao_id}' deletada com sucesso.")
+    logger.info("Variação ID '%s' deletada com sucesso.", variacao_id)
     return
 
 @router.get("/get_by_produto/{produto_id}", response_model=List[VariacaoOut])
+@cache_resposta(tags=["variacoes:{produto_id}"])
 async def listar_variacoes_por_produto(produto_id: str):
     if not ObjectId.is_valid(produto_id):
-        logger.warning(f"Tentativa de listar variações com ID de produto inválido: {produto_id}")
+        logger.warning("Tentativa de listar variações com ID de produto inválido: %s", produto_id)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de produto inválido.")
     
-    cursor = variacao_collection.find({"produto_id": ObjectId(produto_id)})
-    variacoes = [VariacaoOut(**doc) async for doc in cursor]
-    logger.info(f"Encontradas {len(variacoes)} variações para o produto ID: {produto_id}")
+    docs = await leituras_variacoes.executar(
+        produto_id, lambda: variacao_collection.find({"produto_id": ObjectId(produto_id)}).to_list(length=None)
+    )
+    variacoes = [VariacaoOut(**doc) for doc in docs]
+    logger.info("Encontradas %s variações para o produto ID: %s", len(variacoes), produto_id)
     return variacoes
 
 
 @router.get("/quantidade", response_model=int)
-async def contar_variacoes():
-    total = await variacao_collection.count_documents({})
-    logger.info(f"Total de variações: {total}")
+async def contar_variacoes(count: str = Query("exact", pattern="^(exact|estimated)$", description="'exact' (padrão) ou 'estimated' (metadados da coleção, mais rápido)")):
+    total = await count_total(variacao_collection, {}, count)
+    logger.info("Total de variações: %s", total)
     return total
\ No newline at end of file
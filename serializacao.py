@@ -0,0 +1,52 @@
+import os
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Type, Union
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+from pagination import PaginatedResponse, PaginationParams
+
+# Caminho rápido das listagens (opt-in): valida os documentos do Mongo uma única vez com um
+# TypeAdapter pré-compilado e devolve o JSON pronto, sem a revalidação do response_model.
+SERIALIZACAO_RAPIDA = os.getenv("SERIALIZACAO_RAPIDA", "0") == "1"
+
+
+@lru_cache(maxsize=None)
+def adaptador_pagina(modelo: Type[BaseModel]) -> TypeAdapter:
+    """TypeAdapter de PaginatedResponse[modelo], compilado uma vez por modelo."""
+    return TypeAdapter(PaginatedResponse[modelo])
+
+
+def resposta_paginada(
+    modelo: Type[BaseModel],
+    docs: List[Dict[str, Any]],
+    total: Optional[int],
+    pagination: PaginationParams,
+    next_cursor: Optional[str] = None
+) -> Union[PaginatedResponse, Response]:
+    """
+    Monta a resposta de uma listagem paginada a partir dos documentos do Mongo.
+
+    Com SERIALIZACAO_RAPIDA=1 a página inteira é validada em uma chamada ao TypeAdapter e
+    codificada em JSON pelo próprio pydantic-core; o FastAPI não revalida respostas que já são
+    `Response`. Caso contrário, segue o caminho padrão (modelos instanciados e validados pelo
+    response_model). Os dois caminhos produzem o mesmo JSON (benchmarks.serializacao compara).
+    """
+    if not SERIALIZACAO_RAPIDA:
+        return PaginatedResponse(
+            items=[modelo(**doc) for doc in docs],
+            total=total,
+            page=pagination.page,
+            per_page=pagination.per_page,
+            next_cursor=next_cursor
+        )
+
+    adaptador = adaptador_pagina(modelo)
+    pagina = adaptador.validate_python({
+        "items": docs,
+        "total": total,
+        "page": pagination.page,
+        "per_page": pagination.per_page,
+        "next_cursor": next_cursor
+    })
+    # dump_json gera o JSON direto no Rust, sem montar dicionários Python intermediários
+    return Response(content=adaptador.dump_json(pagina, by_alias=True), media_type="application/json")
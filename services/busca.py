@@ -0,0 +1,87 @@
+import asyncio
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional
+from bson.regex import Regex
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+CAMPOS_BUSCA = ("nome", "descricao", "marca")
+TAMANHO_LOTE = 1000
+
+
+def normalizar(texto: str) -> str:
+    """Remove acentos e diferenças de caixa: 'Decoração' -> 'decoracao'."""
+    decomposto = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in decomposto if not unicodedata.combining(c)).casefold()
+
+
+def tokenizar(texto: str) -> List[str]:
+    return re.findall(r"\w+", normalizar(texto))
+
+
+def termos_produto(produto: Dict[str, Any]) -> List[str]:
+    """Termos normalizados de nome, descrição e marca, gravados em `termos_busca`."""
+    termos = set()
+    for campo in CAMPOS_BUSCA:
+        if produto.get(campo):
+            termos.update(tokenizar(str(produto[campo])))
+    return sorted(termos)
+
+
+def termos_nome(produto: Dict[str, Any]) -> List[str]:
+    """Termos normalizados apenas do nome, gravados em `termos_nome` (filtro por nome)."""
+    return sorted(set(tokenizar(str(produto.get("nome") or ""))))
+
+
+def campos_busca(produto: Dict[str, Any]) -> Dict[str, List[str]]:
+    """Campos derivados gravados junto com o produto a cada criação ou alteração."""
+    return {"termos_busca": termos_produto(produto), "termos_nome": termos_nome(produto)}
+
+
+def regiao_usuario(endereco: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Cidade e estado normalizados do endereço de entrega, gravados no pedido em `regiao_entrega`:
+    permitem filtrar por região com igualdade (e índice) em vez de regex sem distinção de caixa.
+    """
+    endereco = endereco or {}
+    return {
+        "cidade": normalizar(str(endereco.get("cidade") or "")).strip(),
+        "estado": normalizar(str(endereco.get("estado") or "")).strip()
+    }
+
+
+def filtro_termos(consulta: str, campo: str = "termos_busca") -> Dict[str, Any]:
+    """
+    Filtro em que cada palavra da consulta precisa ser prefixo de algum termo do produto:
+    em `termos_busca` (nome, descrição e marca) ou, com campo="termos_nome", só no nome.
+    Regex ancoradas sobre o campo usam o índice multikey dele.
+    """
+    tokens = tokenizar(consulta)
+    if not tokens:
+        return {}
+    condicoes = [{campo: Regex(f"^{re.escape(token)}")} for token in tokens]
+    return condicoes[0] if len(condicoes) == 1 else {"$and": condicoes}
+
+
+async def reindexar_produtos(db: AsyncIOMotorDatabase) -> int:
+    """Recalcula `termos_busca` e `termos_nome` de todos os produtos (carga inicial ou correção)."""
+    operacoes = []
+    total = 0
+    async for produto in db.produtos.find({}, {campo: 1 for campo in CAMPOS_BUSCA}):
+        operacoes.append(UpdateOne({"_id": produto["_id"]}, {"$set": campos_busca(produto)}))
+        if len(operacoes) == TAMANHO_LOTE:
+            await db.produtos.bulk_write(operacoes, ordered=False)
+            total += len(operacoes)
+            operacoes = []
+    if operacoes:
+        await db.produtos.bulk_write(operacoes, ordered=False)
+        total += len(operacoes)
+    return total
+
+
+if __name__ == "__main__":
+    # Recalcula os termos de busca dos produtos: python -m services.busca
+    from database import get_db
+
+    print(f"{asyncio.run(reindexar_produtos(get_db()))} produtos reindexados.")
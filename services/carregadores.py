@@ -0,0 +1,122 @@
+import asyncio
+from functools import cached_property
+from typing import Any, Dict, Iterable, List, Optional, Set
+from bson import ObjectId
+from fastapi import Depends
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from database import get_db
+
+
+class CarregadorEmLote:
+    """
+    Carregador no estilo DataLoader, com escopo de uma requisição: as chaves pedidas durante
+    o mesmo ciclo do event loop viram uma única consulta `$in`, e cada documento fica guardado
+    até o fim da requisição (a mesma chave nunca é consultada duas vezes). Chaves sem
+    documento resultam em None.
+
+    O agrupamento só acontece entre chamadas feitas juntas (ex.: `asyncio.gather` sobre os
+    itens); um laço que aguarda cada `carregar` antes do próximo faz uma consulta por chave.
+    """
+
+    colecao = ""
+    campo = "_id"
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self._colecao = db[self.colecao]
+        self._cache: Dict[Any, asyncio.Future] = {}
+        self._pendentes: Dict[Any, asyncio.Future] = {}
+        # O event loop guarda só referências fracas às tasks: as consultas em andamento ficam aqui
+        self._consultas: Set[asyncio.Task] = set()
+
+    def _normalizar(self, chave: Any) -> Any:
+        return chave
+
+    def _futuro(self, chave: Any) -> asyncio.Future:
+        chave = self._normalizar(chave)
+        futuro = self._cache.get(chave)
+        if futuro is None:
+            loop = asyncio.get_running_loop()
+            futuro = self._cache[chave] = loop.create_future()
+            if not self._pendentes:
+                # Despacha depois que as demais tasks prontas neste ciclo pedirem suas chaves
+                loop.call_soon(self._despachar)
+            self._pendentes[chave] = futuro
+        return futuro
+
+    async def carregar(self, chave: Any) -> Optional[Dict[str, Any]]:
+        return await asyncio.shield(self._futuro(chave))
+
+    async def carregar_varios(self, chaves: Iterable[Any]) -> List[Optional[Dict[str, Any]]]:
+        """Documentos na ordem das chaves, com uma consulta para todas as que ainda não foram carregadas."""
+        return list(await asyncio.gather(*(asyncio.shield(self._futuro(chave)) for chave in chaves)))
+
+    def _despachar(self) -> None:
+        pendentes, self._pendentes = self._pendentes, {}
+        consulta = asyncio.ensure_future(self._buscar(pendentes))
+        self._consultas.add(consulta)
+        consulta.add_done_callback(lambda concluida: self._concluir(pendentes, concluida))
+
+    async def _buscar(self, pendentes: Dict[Any, asyncio.Future]) -> None:
+        docs = await self._colecao.find({self.campo: {"$in": list(pendentes)}}).to_list(length=None)
+        encontrados = {doc[self.campo]: doc for doc in docs}
+        for chave, futuro in pendentes.items():
+            if not futuro.done():
+                futuro.set_result(encontrados.get(chave))
+
+    def _concluir(self, pendentes: Dict[Any, asyncio.Future], consulta: asyncio.Task) -> None:
+        self._consultas.discard(consulta)
+        if not consulta.cancelled() and consulta.exception() is None:
+            return
+        for chave, futuro in pendentes.items():
+            # Sem guardar a falha: uma nova chamada tenta de novo
+            self._cache.pop(chave, None)
+            if futuro.done():
+                continue
+            if consulta.cancelled():
+                futuro.cancel()
+            else:
+                futuro.set_exception(consulta.exception())
+
+
+class _CarregadorPorId(CarregadorEmLote):
+    def _normalizar(self, chave: Any) -> Any:
+        if isinstance(chave, str) and ObjectId.is_valid(chave):
+            return ObjectId(chave)
+        return chave
+
+
+class ProdutoLoader(_CarregadorPorId):
+    colecao = "produtos"
+
+
+class UsuarioLoader(_CarregadorPorId):
+    colecao = "usuarios"
+
+
+class VariacaoBySkuLoader(CarregadorEmLote):
+    colecao = "variacoes_produto"
+    campo = "sku"
+
+
+class Carregadores:
+    """Carregadores de uma requisição, criados quando usados pela primeira vez."""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self._db = db
+
+    @cached_property
+    def produtos(self) -> ProdutoLoader:
+        return ProdutoLoader(self._db)
+
+    @cached_property
+    def usuarios(self) -> UsuarioLoader:
+        return UsuarioLoader(self._db)
+
+    @cached_property
+    def variacoes_por_sku(self) -> VariacaoBySkuLoader:
+        return VariacaoBySkuLoader(self._db)
+
+
+def get_carregadores(db: AsyncIOMotorDatabase = Depends(get_db)) -> Carregadores:
+    # O FastAPI resolve a dependência uma vez por requisição: todos os usos compartilham o cache
+    return Carregadores(db)
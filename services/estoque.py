@@ -0,0 +1,92 @@
+from typing import Dict, Iterable, List
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import UpdateMany, UpdateOne
+
+
+class EstoqueInsuficiente(Exception):
+    """Levantada quando ao menos um SKU não tem estoque para a quantidade pedida."""
+
+    def __init__(self, skus: List[str]):
+        super().__init__(f"Estoque insuficiente para os SKUs: {', '.join(skus)}")
+        self.skus = skus
+
+
+def quantidades_por_sku(itens: Iterable) -> Dict[str, int]:
+    """Soma as quantidades pedidas de cada SKU (o mesmo SKU pode aparecer em mais de um item)."""
+    quantidades: Dict[str, int] = {}
+    for item in itens:
+        quantidades[item.sku_selecionado] = quantidades.get(item.sku_selecionado, 0) + item.quantidade
+    return quantidades
+
+
+async def reservar_estoque(
+    colecao: AsyncIOMotorCollection,
+    reserva_id: ObjectId,
+    quantidades: Dict[str, int]
+) -> None:
+    """
+    Abate o estoque de todos os SKUs em um único bulk_write, com `$inc` condicional
+    (`estoque >= quantidade`), de modo que pedidos concorrentes nunca deixam o estoque negativo.
+
+    Cada variação reservada recebe o `reserva_id` em `reservas`, o que permite desfazer só
+    as reservas que de fato aconteceram. Se algum SKU não puder ser reservado, as demais
+    reservas são desfeitas e `EstoqueInsuficiente` é levantada.
+    """
+    operacoes = [
+        UpdateOne(
+            {"sku": sku, "estoque": {"$gte": quantidade}},
+            {"$inc": {"estoque": -quantidade}, "$push": {"reservas": reserva_id}}
+        )
+        for sku, quantidade in quantidades.items()
+    ]
+    if not operacoes:
+        return
+    resultado = await colecao.bulk_write(operacoes, ordered=False)
+    if resultado.matched_count == len(operacoes):
+        return
+
+    reservados = {
+        doc["sku"]
+        async for doc in colecao.find({"sku": {"$in": list(quantidades)}, "reservas": reserva_id}, {"sku": 1})
+    }
+    await cancelar_reserva(colecao, reserva_id, quantidades)
+    raise EstoqueInsuficiente([sku for sku in quantidades if sku not in reservados])
+
+
+async def confirmar_reserva(
+    colecao: AsyncIOMotorCollection,
+    reserva_id: ObjectId,
+    quantidades: Dict[str, int]
+) -> None:
+    """Remove a marcação da reserva depois que o pedido foi gravado; o estoque já foi abatido."""
+    if not quantidades:
+        return
+    await colecao.bulk_write([
+        UpdateMany({"sku": {"$in": list(quantidades)}, "reservas": reserva_id}, {"$pull": {"reservas": reserva_id}}),
+        _remover_reservas_vazias(quantidades)
+    ])
+
+
+async def cancelar_reserva(
+    colecao: AsyncIOMotorCollection,
+    reserva_id: ObjectId,
+    quantidades: Dict[str, int]
+) -> None:
+    """Devolve ao estoque somente as quantidades dos SKUs que ainda estão marcados com a reserva."""
+    operacoes = [
+        UpdateOne(
+            {"sku": sku, "reservas": reserva_id},
+            {"$inc": {"estoque": quantidade}, "$pull": {"reservas": reserva_id}}
+        )
+        for sku, quantidade in quantidades.items()
+    ]
+    if not operacoes:
+        return
+    await colecao.bulk_write(operacoes + [_remover_reservas_vazias(quantidades)])
+
+
+def _remover_reservas_vazias(quantidades: Dict[str, int]) -> UpdateMany:
+    # O $pull deixa `reservas: []`; o filtro por tamanho preserva reservas que chegaram nesse meio-tempo.
+    # Vai no mesmo bulk_write ordenado, depois dos $pull: um único comando de update, uma ida ao banco.
+    return UpdateMany({"sku": {"$in": list(quantidades)}, "reservas": {"$size": 0}}, {"$unset": {"reservas": ""}})
@@ -0,0 +1,84 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List
+from bson import ObjectId
+from fastapi.responses import StreamingResponse
+
+TAMANHO_LOTE_CURSOR = 500
+
+TIPOS_MIDIA = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def _serializar(valor: Any) -> Any:
+    if isinstance(valor, ObjectId):
+        return str(valor)
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(valor).__name__}")
+
+
+def _valor_csv(valor: Any) -> Any:
+    if isinstance(valor, (dict, list)):
+        return json.dumps(valor, default=_serializar, ensure_ascii=False)
+    if isinstance(valor, (ObjectId, datetime)):
+        return _serializar(valor)
+    return valor
+
+
+async def gerar_ndjson(documentos: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """Um objeto JSON por linha, emitido à medida que o cursor entrega os documentos."""
+    async for documento in documentos:
+        yield (json.dumps(documento, default=_serializar, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def gerar_csv(
+    documentos: AsyncIterator[Dict[str, Any]],
+    campos: List[str],
+    linhas: Callable[[Dict[str, Any]], Iterable[Dict[str, Any]]]
+) -> AsyncIterator[bytes]:
+    """
+    CSV com cabeçalho `campos`. `linhas` transforma cada documento em uma ou mais linhas
+    planas (ex.: uma linha por item de pedido).
+    """
+    buffer = io.StringIO()
+    escritor = csv.DictWriter(buffer, fieldnames=campos, extrasaction="ignore")
+
+    def esvaziar() -> bytes:
+        conteudo = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return conteudo.encode("utf-8")
+
+    escritor.writeheader()
+    yield esvaziar()
+    async for documento in documentos:
+        for linha in linhas(documento):
+            escritor.writerow({campo: _valor_csv(valor) for campo, valor in linha.items()})
+        yield esvaziar()
+
+
+def resposta_exportacao(
+    documentos: AsyncIterator[Dict[str, Any]],
+    formato: str,
+    nome_arquivo: str,
+    campos_csv: List[str],
+    linhas_csv: Callable[[Dict[str, Any]], Iterable[Dict[str, Any]]]
+) -> StreamingResponse:
+    """
+    Resposta em streaming (NDJSON ou CSV). Os documentos são lidos do cursor conforme o
+    cliente consome a resposta, mantendo o uso de memória constante.
+    """
+    if formato == "csv":
+        corpo = gerar_csv(documentos, campos_csv, linhas_csv)
+    else:
+        corpo = gerar_ndjson(documentos)
+    return StreamingResponse(
+        corpo,
+        media_type=TIPOS_MIDIA[formato],
+        headers={"Content-Disposition": f'attachment; filename="{nome_arquivo}.{formato}"'}
+    )
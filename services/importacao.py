@@ -0,0 +1,150 @@
+import json
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple, Type
+from fastapi import HTTPException, Request, status
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pydantic import BaseModel, ValidationError
+from pymongo.errors import BulkWriteError
+
+# Linhas validadas e gravadas por vez: limita a memória e o tamanho de cada bulk_write.
+TAMANHO_LOTE_IMPORTACAO = int(os.getenv("TAMANHO_LOTE_IMPORTACAO", "1000"))
+
+CRIADO = "criado"
+ATUALIZADO = "atualizado"
+INVALIDO = "invalido"
+ERRO = "erro"
+
+_TIPOS_NDJSON = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines")
+
+# (número da linha, modelo validado)
+LinhaValida = Tuple[int, BaseModel]
+ProcessarLote = Callable[[List[LinhaValida]], Awaitable[List[Dict[str, Any]]]]
+
+
+def resultado_linha(linha: int, situacao: str, id_documento: Any = None, erro: Any = None) -> Dict[str, Any]:
+    resultado: Dict[str, Any] = {"linha": linha, "status": situacao}
+    if id_documento is not None:
+        resultado["id"] = str(id_documento)
+    if erro is not None:
+        resultado["erro"] = erro
+    return resultado
+
+
+async def ler_linhas(request: Request) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    Lê o corpo de uma importação: um array JSON ou, com Content-Type NDJSON, um documento por
+    linha. O NDJSON é lido em streaming e cada linha segue como bytes, para ser validada
+    direto do JSON pelo modelo (uma linha malformada vira um erro só daquela linha).
+    """
+    tipo = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if tipo in _TIPOS_NDJSON:
+        numero = 0
+        resto = b""
+        async for pedaco in request.stream():
+            resto += pedaco
+            *linhas, resto = resto.split(b"\n")
+            for linha in linhas:
+                numero += 1
+                if linha.strip():
+                    yield numero, linha
+        if resto.strip():
+            yield numero + 1, resto
+        return
+
+    try:
+        dados = json.loads(await request.body())
+    except ValueError:
+        dados = None
+    if not isinstance(dados, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="O corpo deve ser um array JSON ou NDJSON (Content-Type: application/x-ndjson)."
+        )
+    for numero, item in enumerate(dados, start=1):
+        yield numero, item
+
+
+def _validar(modelo: Type[BaseModel], dados: Any) -> BaseModel:
+    if isinstance(dados, bytes):
+        return modelo.model_validate_json(dados)
+    return modelo.model_validate(dados)
+
+
+async def importar_em_lotes(
+    linhas: AsyncIterator[Tuple[int, Any]],
+    modelo: Type[BaseModel],
+    processar_lote: ProcessarLote,
+    tamanho_lote: int = TAMANHO_LOTE_IMPORTACAO
+) -> Dict[str, Any]:
+    """
+    Valida as linhas com `modelo` e entrega as válidas a `processar_lote` a cada `tamanho_lote`
+    linhas. Linhas inválidas não interrompem a importação: viram um resultado "invalido" com
+    os erros de validação. Devolve os totais e o resultado de cada linha, em ordem.
+    """
+    resultados: List[Dict[str, Any]] = []
+    lote: List[LinhaValida] = []
+    async for numero, dados in linhas:
+        try:
+            lote.append((numero, _validar(modelo, dados)))
+        except ValidationError as erro:
+            resultados.append(resultado_linha(
+                numero, INVALIDO, erro=erro.errors(include_url=False, include_context=False, include_input=False)
+            ))
+        if len(lote) >= tamanho_lote:
+            resultados += await processar_lote(lote)
+            lote = []
+    if lote:
+        resultados += await processar_lote(lote)
+
+    resultados.sort(key=lambda resultado: resultado["linha"])
+    totais = {situacao: 0 for situacao in (CRIADO, ATUALIZADO, INVALIDO, ERRO)}
+    for resultado in resultados:
+        totais[resultado["status"]] += 1
+    return {
+        "total": len(resultados),
+        "criados": totais[CRIADO],
+        "atualizados": totais[ATUALIZADO],
+        "invalidos": totais[INVALIDO],
+        "erros": totais[ERRO],
+        "resultados": resultados
+    }
+
+
+async def executar_bulk(colecao: AsyncIOMotorCollection, operacoes: List[Any]) -> Tuple[Dict[int, Any], Dict[int, str]]:
+    """
+    Executa as operações em um bulk_write não ordenado (uma falha não impede as demais).
+    Devolve os _id criados por upsert e as mensagens de erro, ambos pelo índice da operação.
+    """
+    if not operacoes:
+        return {}, {}
+    try:
+        resultado = await colecao.bulk_write(operacoes, ordered=False)
+    except BulkWriteError as erro:
+        detalhes = erro.details
+        criados = {upsert["index"]: upsert["_id"] for upsert in detalhes.get("upserted", [])}
+        falhas = {falha["index"]: falha.get("errmsg", "Erro de escrita.") for falha in detalhes.get("writeErrors", [])}
+        return criados, falhas
+    return resultado.upserted_ids or {}, {}
+
+
+def resultados_do_bulk(
+    destinos: List[Tuple[int, Any, bool]],
+    criados: Dict[int, Any],
+    falhas: Dict[int, str]
+) -> List[Dict[str, Any]]:
+    """
+    Resultado por linha a partir do bulk_write, sem reler os documentos. `destinos[i]` descreve
+    a operação i: (linha, _id já conhecido ou None, se é um insert). Upserts que criaram o
+    documento aparecem em `criados`; os demais atualizaram um documento existente.
+    """
+    resultados = []
+    for indice, (numero, id_documento, insercao) in enumerate(destinos):
+        if indice in falhas:
+            resultados.append(resultado_linha(numero, ERRO, id_documento, falhas[indice]))
+        elif insercao:
+            resultados.append(resultado_linha(numero, CRIADO, id_documento))
+        elif indice in criados:
+            resultados.append(resultado_linha(numero, CRIADO, criados[indice]))
+        else:
+            resultados.append(resultado_linha(numero, ATUALIZADO, id_documento))
+    return resultados
@@ -0,0 +1,119 @@
+import asyncio
+import heapq
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+import cache_http
+from database import promocoes_collection
+from logger import get_logger
+
+logger = get_logger("indice_promocoes_logger", "log/indice_promocoes.log")
+
+INDICE_PROMOCOES_TTL = float(os.getenv("INDICE_PROMOCOES_TTL", "60"))
+
+# Tag invalidada pelas rotas de escrita de promoções (invalidar_cache("promocoes"))
+TAG_PROMOCOES = "promocoes"
+
+
+def _normalizar_data(agora: datetime) -> datetime:
+    # O Mongo devolve datas "naive" em UTC; datas com fuso são convertidas para o mesmo formato.
+    if agora.tzinfo is not None:
+        return agora.astimezone(timezone.utc).replace(tzinfo=None)
+    return agora
+
+
+def _dentro_da_janela(promocao: Dict, agora: datetime) -> bool:
+    return promocao["data_inicio"] <= agora <= promocao["data_fim"]
+
+
+class IndicePromocoes:
+    """
+    Índice em memória das promoções vigentes e agendadas, mapeando cada produto às suas promoções.
+
+    O índice é recarregado quando a geração da tag "promocoes" no cache HTTP muda (as rotas de
+    escrita a invalidam com `invalidar_cache`) e, de qualquer forma, após `ttl` segundos. Com
+    CACHE_BACKEND=redis a geração é compartilhada e uma escrita em um worker recarrega o índice
+    de todos; com o cache em memória (ou com o backend indisponível) os demais workers só
+    enxergam a alteração depois do `ttl`. Promoções agendadas ficam no índice e passam a valer
+    exatamente em `data_inicio`; as encerradas deixam de valer exatamente em `data_fim` e são
+    removidas da memória no acesso seguinte. O índice não tem relógio próprio: vale o `agora`
+    de quem consulta.
+    """
+
+    def __init__(self, colecao: AsyncIOMotorCollection, ttl: float = INDICE_PROMOCOES_TTL):
+        self._colecao = colecao
+        self._ttl = ttl
+        self._lock = asyncio.Lock()
+        self._carregado_em: Optional[float] = None
+        self._geracao: Optional[int] = None
+        self._promocoes: Dict[ObjectId, Dict] = {}
+        self._por_produto: Dict[ObjectId, List[Dict]] = {}
+        self._expiracoes: List[Tuple[datetime, int, ObjectId]] = []
+
+    def _expirado(self, geracao: Optional[int]) -> bool:
+        return (
+            self._carregado_em is None
+            or time.monotonic() - self._carregado_em >= self._ttl
+            or (geracao is not None and geracao != self._geracao)
+        )
+
+    async def _geracao_atual(self) -> Optional[int]:
+        try:
+            return (await cache_http.cache.geracoes([TAG_PROMOCOES]))[0]
+        except Exception as erro:
+            logger.error("Falha ao ler a geração das promoções no cache; valendo só o TTL: %s", erro)
+            return None
+
+    async def _garantir_carregado(self, agora: datetime) -> None:
+        # A geração é lida antes da carga: uma escrita durante a carga força outra na consulta seguinte
+        geracao = await self._geracao_atual()
+        if not self._expirado(geracao):
+            return
+        async with self._lock:
+            if not self._expirado(geracao):
+                return
+            await self._carregar(agora)
+            self._geracao = geracao
+
+    async def _carregar(self, agora: datetime) -> None:
+        promocoes: Dict[ObjectId, Dict] = {}
+        por_produto: Dict[ObjectId, List[Dict]] = {}
+        expiracoes: List[Tuple[datetime, int, ObjectId]] = []
+
+        async for promocao in self._colecao.find({"data_fim": {"$gte": agora}}):
+            promocoes[promocao["_id"]] = promocao
+            expiracoes.append((promocao["data_fim"], len(expiracoes), promocao["_id"]))
+            for produto_id in promocao.get("produtos_aplicaveis", []):
+                por_produto.setdefault(produto_id, []).append(promocao)
+
+        heapq.heapify(expiracoes)
+        self._promocoes = promocoes
+        self._por_produto = por_produto
+        self._expiracoes = expiracoes
+        self._carregado_em = time.monotonic()
+
+    def _remover_encerradas(self, agora: datetime) -> None:
+        while self._expiracoes and self._expiracoes[0][0] < agora:
+            _, _, promocao_id = heapq.heappop(self._expiracoes)
+            promocao = self._promocoes.pop(promocao_id, None)
+            if not promocao:
+                continue
+            for produto_id in promocao.get("produtos_aplicaveis", []):
+                restantes = [p for p in self._por_produto.get(produto_id, []) if p["_id"] != promocao_id]
+                if restantes:
+                    self._por_produto[produto_id] = restantes
+                else:
+                    self._por_produto.pop(produto_id, None)
+
+    async def promocoes_ativas(self, agora: datetime) -> List[Dict]:
+        """Retorna todas as promoções vigentes em `agora`, na ordem em que foram lidas do banco."""
+        agora = _normalizar_data(agora)
+        await self._garantir_carregado(agora)
+        self._remover_encerradas(agora)
+        return [promocao for promocao in self._promocoes.values() if _dentro_da_janela(promocao, agora)]
+
+
+indice_promocoes = IndicePromocoes(promocoes_collection)
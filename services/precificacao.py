@@ -0,0 +1,40 @@
+from typing import Dict, Optional, Tuple
+
+
+def aplicar_desconto(preco_original: float, promocao: Optional[Dict]) -> float:
+    """
+    Aplica o desconto de uma promoção ao preço original, sem deixar o preço negativo.
+    """
+    if not promocao:
+        return round(preco_original, 2)
+
+    tipo_desconto = promocao.get("tipo_desconto")
+    valor_desconto = promocao.get("valor_desconto", 0)
+    preco_final = preco_original
+
+    if tipo_desconto == "porcentagem":
+        preco_final = preco_original * (1 - valor_desconto / 100)
+    elif tipo_desconto == "valor_fixo":
+        preco_final = preco_original - valor_desconto
+
+    return max(0, round(preco_final, 2))
+
+
+def calcular_preco(
+    produto: Dict,
+    variacao: Dict,
+    promocao: Optional[Dict]
+) -> Tuple[float, Optional[Dict]]:
+    """
+    Calcula o preço final de uma variação a partir do produto pai e da promoção ativa (se houver).
+    """
+    preco_original = produto.get("preco_base", 0) + variacao.get("preco_adicional", 0)
+
+    if not promocao:
+        return round(preco_original, 2), None
+
+    info_promocao = {
+        "id_promocao": promocao["_id"],
+        "nome_promocao": promocao.get("nome")
+    }
+    return aplicar_desconto(preco_original, promocao), info_promocao
@@ -0,0 +1,300 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import DeleteMany, ReplaceOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from cache_http import invalidar_cache
+from logger import get_logger
+from services.carregadores import VariacaoBySkuLoader
+from services.precificacao import calcular_preco
+
+logger = get_logger("precos_logger", "log/precos.log")
+
+COLECAO_PRECOS = "precos_efetivos"
+TAMANHO_LOTE = 500
+
+# Intervalo máximo entre duas verificações do atualizador. Cada processo só conhece a próxima
+# fronteira no momento da consulta; entradas gravadas depois por outros processos, com validade
+# mais curta, são percebidas no máximo após esse intervalo.
+PRECOS_INTERVALO_MAXIMO = float(os.getenv("PRECOS_INTERVALO_MAXIMO", "60"))
+
+# Validade máxima de uma entrada, mesmo sem promoção prevista: nenhuma entrada fica no
+# catálogo sem ser recalculada por mais do que isso.
+PRECOS_VALIDADE_MAXIMA = timedelta(seconds=float(os.getenv("PRECOS_VALIDADE_MAXIMA", "300")))
+
+# Código de chave duplicada: o upsert condicional encontrou uma entrada mais nova para o SKU.
+_CHAVE_DUPLICADA = 11000
+
+# Datas no Mongo têm precisão de milissegundos: uma promoção deixa de valer 1 ms após data_fim.
+_RESOLUCAO = timedelta(milliseconds=1)
+
+
+def _agora() -> datetime:
+    # Mesmo relógio usado na criação de pedidos (data_pedido).
+    return datetime.now()
+
+
+async def _promocoes_por_produto(db: AsyncIOMotorDatabase, produtos_ids: List, agora: datetime) -> Dict[Any, List[Dict]]:
+    """
+    Promoções vigentes ou agendadas dos produtos, lidas do banco (e não do índice em memória
+    de cada processo, que pode estar até um TTL atrasado em relação às escritas de outro worker).
+    """
+    por_produto: Dict[Any, List[Dict]] = {}
+    cursor = db.promocoes.find({"produtos_aplicaveis": {"$in": produtos_ids}, "data_fim": {"$gte": agora}})
+    async for promocao in cursor:
+        for produto_id in promocao.get("produtos_aplicaveis", []):
+            por_produto.setdefault(produto_id, []).append(promocao)
+    return por_produto
+
+
+def _promocao_e_validade(promocoes: List[Dict], agora: datetime) -> Tuple[Optional[Dict], datetime]:
+    """
+    Promoção vigente do produto e o instante em que o preço pode mudar: o fim da promoção
+    vigente ou o início da próxima agendada, o que vier primeiro, limitado a PRECOS_VALIDADE_MAXIMA.
+    """
+    promocao = next((p for p in promocoes if p["data_inicio"] <= agora <= p["data_fim"]), None)
+    fronteiras = [agora + PRECOS_VALIDADE_MAXIMA]
+    for candidata in promocoes:
+        if candidata["data_inicio"] > agora:
+            fronteiras.append(candidata["data_inicio"])
+        elif candidata["data_fim"] >= agora:
+            fronteiras.append(candidata["data_fim"] + _RESOLUCAO)
+    return promocao, min(fronteiras)
+
+
+def _entrada(produto: Dict, variacao: Dict, promocao: Optional[Dict], valido_ate: datetime, agora: datetime) -> Dict[str, Any]:
+    preco_final, _ = calcular_preco(produto, variacao, promocao)
+    return {
+        "sku": variacao["sku"],
+        "produto_id": produto["_id"],
+        "variacao_id": variacao["_id"],
+        "nome_produto": produto.get("nome"),
+        "categoria": produto.get("categoria"),
+        "marca": produto.get("marca"),
+        "atributos": variacao.get("atributos", {}),
+        "preco_original": round(produto.get("preco_base", 0) + variacao.get("preco_adicional", 0), 2),
+        "preco_final": preco_final,
+        "em_promocao": promocao is not None,
+        "id_promocao": promocao["_id"] if promocao else None,
+        "promocao": {
+            "nome": promocao.get("nome"),
+            "data_fim": promocao.get("data_fim"),
+            "tipo_desconto": promocao.get("tipo_desconto"),
+            "valor_desconto": promocao.get("valor_desconto")
+        } if promocao else None,
+        "valido_ate": valido_ate,
+        "atualizado_em": agora
+    }
+
+
+async def calcular_precos(db: AsyncIOMotorDatabase, produtos_ids: Iterable) -> Dict[str, Dict[str, Any]]:
+    """Calcula, sem gravar, as entradas de todas as variações dos produtos informados, por SKU."""
+    ids = list(set(produtos_ids))
+    if not ids:
+        return {}
+
+    agora = _agora()
+    cursor_produtos = db.produtos.find({"_id": {"$in": ids}}, {"nome": 1, "categoria": 1, "marca": 1, "preco_base": 1})
+    produtos = {produto["_id"]: produto async for produto in cursor_produtos}
+    promocoes = await _promocoes_por_produto(db, list(produtos), agora)
+
+    entradas: Dict[str, Dict[str, Any]] = {}
+    validades: Dict[Any, Tuple[Optional[Dict], datetime]] = {}
+    cursor_variacoes = db.variacoes_produto.find(
+        {"produto_id": {"$in": list(produtos)}},
+        {"sku": 1, "produto_id": 1, "preco_adicional": 1, "atributos": 1}
+    )
+    async for variacao in cursor_variacoes:
+        produto_id = variacao["produto_id"]
+        if produto_id not in validades:
+            validades[produto_id] = _promocao_e_validade(promocoes.get(produto_id, []), agora)
+        promocao, valido_ate = validades[produto_id]
+        entradas[variacao["sku"]] = _entrada(produtos[produto_id], variacao, promocao, valido_ate, agora)
+    return entradas
+
+
+async def gravar_precos(db: AsyncIOMotorDatabase, produtos_ids: Iterable, entradas: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Substitui as entradas dos produtos informados; SKUs que não existem mais são removidos.
+    Uma entrada só é substituída por outra calculada no mesmo instante ou depois: quando dois
+    processos recalculam o mesmo produto, o cálculo mais antigo não sobrescreve o mais novo.
+    """
+    ids = list(set(produtos_ids))
+    if not ids:
+        return
+    operacoes: List[Any] = [
+        ReplaceOne({"sku": sku, "atualizado_em": {"$lte": entrada["atualizado_em"]}}, entrada, upsert=True)
+        for sku, entrada in entradas.items()
+    ]
+    operacoes.append(DeleteMany({"produto_id": {"$in": ids}, "sku": {"$nin": list(entradas)}}))
+    try:
+        await db[COLECAO_PRECOS].bulk_write(operacoes, ordered=False)
+    except BulkWriteError as erro:
+        # Sem correspondência por causa de uma entrada mais nova, o upsert esbarra no índice único de sku
+        falhas = erro.details.get("writeErrors", [])
+        if erro.details.get("writeConcernErrors") or any(falha.get("code") != _CHAVE_DUPLICADA for falha in falhas):
+            raise
+    await invalidar_cache("precos")
+
+
+async def atualizar_precos(db: AsyncIOMotorDatabase, produtos_ids: Iterable) -> None:
+    """
+    Recalcula os preços efetivos dos produtos informados. Chamado pelas rotas de escrita de
+    produtos, variações e promoções. Se o recálculo falhar, as entradas dos produtos são
+    removidas e o checkout passa a calcular o preço na hora; se nem a remoção for possível,
+    o erro é propagado para quem chamou.
+    """
+    ids = list(set(produtos_ids))
+    try:
+        await gravar_precos(db, ids, await calcular_precos(db, ids))
+    except PyMongoError as erro:
+        logger.error("Falha ao atualizar preços efetivos dos produtos %s: %s", ids, erro)
+        await db[COLECAO_PRECOS].delete_many({"produto_id": {"$in": ids}})
+        await invalidar_cache("precos")
+
+
+async def reconstruir_precos_efetivos(db: AsyncIOMotorDatabase) -> int:
+    """Recalcula o catálogo inteiro e remove entradas de produtos que não existem mais."""
+    inicio = _agora()
+    total = 0
+    lote: List[Any] = []
+    async for produto in db.produtos.find({}, {"_id": 1}):
+        lote.append(produto["_id"])
+        if len(lote) == TAMANHO_LOTE:
+            entradas = await calcular_precos(db, lote)
+            await gravar_precos(db, lote, entradas)
+            total += len(entradas)
+            lote = []
+    if lote:
+        entradas = await calcular_precos(db, lote)
+        await gravar_precos(db, lote, entradas)
+        total += len(entradas)
+    await db[COLECAO_PRECOS].delete_many({"atualizado_em": {"$lt": inicio}})
+    logger.info("Catálogo de preços efetivos reconstruído: %s SKUs.", total)
+    return total
+
+
+async def manter_precos_atualizados(db: AsyncIOMotorDatabase) -> None:
+    """
+    Tarefa em segundo plano (iniciada no lifespan da aplicação) que recalcula as entradas
+    cujo `valido_ate` passou: quando uma promoção começa ou termina, ou quando a entrada
+    atinge PRECOS_VALIDADE_MAXIMA. Dorme até a próxima fronteira conhecida, limitado a
+    PRECOS_INTERVALO_MAXIMO segundos. Vários processos podem rodar o atualizador ao mesmo
+    tempo: a gravação condicional de `gravar_precos` mantém sempre o cálculo mais recente.
+    """
+    try:
+        if await db[COLECAO_PRECOS].estimated_document_count() == 0:
+            await reconstruir_precos_efetivos(db)
+    except PyMongoError as erro:
+        logger.error("Falha ao montar o catálogo de preços efetivos: %s", erro)
+
+    while True:
+        espera = PRECOS_INTERVALO_MAXIMO
+        try:
+            vencidos = await db[COLECAO_PRECOS].distinct(
+                "produto_id", {"$or": [{"valido_ate": {"$lte": _agora()}}, {"valido_ate": None}]}
+            )
+            for inicio in range(0, len(vencidos), TAMANHO_LOTE):
+                await atualizar_precos(db, vencidos[inicio:inicio + TAMANHO_LOTE])
+            if vencidos:
+                logger.info("Preços de %s produtos com entradas vencidas recalculados.", len(vencidos))
+            proxima = await db[COLECAO_PRECOS].find_one(
+                {"valido_ate": {"$type": "date"}}, {"valido_ate": 1}, sort=[("valido_ate", 1)]
+            )
+            if proxima:
+                espera = min(espera, max(0.1, (proxima["valido_ate"] - _agora()).total_seconds()))
+        except PyMongoError as erro:
+            logger.error("Falha ao verificar preços vencidos: %s", erro)
+        await asyncio.sleep(espera)
+
+
+class ContextoPrecos:
+    """
+    Resultado das consultas em lote usadas para precificar um carrinho: variações por SKU,
+    preços efetivos por SKU e os dados do produto pai (nome, categoria e marca) guardados no catálogo.
+    """
+
+    def __init__(self, variacoes: Dict[str, Dict], precos: Dict[str, Dict]):
+        self.variacoes = variacoes
+        self.precos = precos
+        self.produtos = {
+            entrada["produto_id"]: {
+                "_id": entrada["produto_id"],
+                "nome": entrada.get("nome_produto"),
+                "categoria": entrada.get("categoria"),
+                "marca": entrada.get("marca")
+            }
+            for entrada in precos.values()
+        }
+
+    def variacao(self, sku: str) -> Optional[Dict]:
+        return self.variacoes.get(sku)
+
+    def produto(self, produto_id) -> Optional[Dict]:
+        return self.produtos.get(produto_id)
+
+    def preco(self, produto: Dict, variacao: Dict) -> Tuple[float, Optional[Dict]]:
+        entrada = self.precos[variacao["sku"]]
+        if not entrada.get("id_promocao"):
+            return entrada["preco_final"], None
+        return entrada["preco_final"], {
+            "id_promocao": entrada["id_promocao"],
+            "nome_promocao": entrada["promocao"].get("nome")
+        }
+
+
+async def carregar_contexto_precos(
+    db: AsyncIOMotorDatabase,
+    skus: Iterable[str],
+    carregador_variacoes: Optional[VariacaoBySkuLoader] = None
+) -> ContextoPrecos:
+    """
+    Resolve todos os SKUs do carrinho com duas consultas em paralelo: as variações (estoque e
+    atributos) e o catálogo de preços efetivos. Entradas ausentes ou vencidas são recalculadas
+    na hora a partir dos produtos e promoções, e gravadas de volta no catálogo.
+
+    As variações vêm de `carregador_variacoes` quando informado (o carregador da requisição),
+    de modo que SKUs já carregados por ela não são consultados de novo.
+    """
+    skus_unicos = list(dict.fromkeys(skus))
+    agora = _agora()
+    carregador_variacoes = carregador_variacoes or VariacaoBySkuLoader(db)
+
+    lista_variacoes, lista_precos = await asyncio.gather(
+        carregador_variacoes.carregar_varios(skus_unicos),
+        db[COLECAO_PRECOS].find({"sku": {"$in": skus_unicos}}).to_list(length=None)
+    )
+    variacoes = {variacao["sku"]: variacao for variacao in lista_variacoes if variacao}
+    precos = {entrada["sku"]: entrada for entrada in lista_precos}
+
+    pendentes = {
+        variacao["produto_id"]
+        for sku, variacao in variacoes.items()
+        if sku not in precos
+        or precos[sku]["produto_id"] != variacao["produto_id"]
+        # Entradas gravadas antes de o catálogo guardar a marca ou antes de toda entrada ter validade
+        or "marca" not in precos[sku]
+        or precos[sku].get("valido_ate") is None
+        or precos[sku]["valido_ate"] <= agora
+    }
+    if pendentes:
+        recalculadas = await calcular_precos(db, pendentes)
+        for sku in variacoes:
+            if variacoes[sku]["produto_id"] in pendentes:
+                precos.pop(sku, None)
+        precos.update({sku: entrada for sku, entrada in recalculadas.items() if sku in variacoes})
+        try:
+            await gravar_precos(db, pendentes, recalculadas)
+        except PyMongoError as erro:
+            logger.error("Falha ao gravar preços recalculados no checkout: %s", erro)
+
+    return ContextoPrecos(variacoes, precos)
+
+
+if __name__ == "__main__":
+    # Reconstrução completa do catálogo: python -m services.precos_efetivos
+    from database import get_db
+
+    print(f"{asyncio.run(reconstruir_precos_efetivos(get_db()))} SKUs precificados.")
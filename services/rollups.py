@@ -0,0 +1,184 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from logger import get_logger
+from services.snapshot_pedidos import preencher_snapshot_pedidos
+
+logger = get_logger("rollups_logger", "log/rollups.log")
+
+COLECAO_ROLLUPS = "vendas_diarias"
+
+
+def inicio_do_dia(data: datetime) -> datetime:
+    return datetime(data.year, data.month, data.day)
+
+
+def _como_object_id(valor: Any) -> Any:
+    if isinstance(valor, str) and ObjectId.is_valid(valor):
+        return ObjectId(valor)
+    return valor
+
+
+async def _dimensoes_pedido(db: AsyncIOMotorDatabase, pedido: Dict) -> Dict[str, Any]:
+    """
+    Categoria de cada produto e estado do comprador de um pedido. Vêm do retrato gravado no
+    pedido; só pedidos ainda não migrados (services.snapshot_pedidos) consultam o banco.
+    """
+    if "estado_entrega" in pedido:
+        categorias = {item["id_produto"]: item.get("categoria") for item in pedido.get("itens", []) if item.get("id_produto")}
+        return {"categorias": categorias, "estado": pedido.get("estado_entrega")}
+
+    ids_produtos = list({item["id_produto"] for item in pedido.get("itens", []) if item.get("id_produto")})
+    cursor_produtos = db.produtos.find({"_id": {"$in": ids_produtos}}, {"categoria": 1})
+    categorias = {produto["_id"]: produto.get("categoria") async for produto in cursor_produtos}
+
+    usuario = await db.usuarios.find_one(
+        {"_id": _como_object_id(pedido.get("id_usuario"))},
+        {"endereco_de_entrega.estado": 1}
+    )
+    estado = (usuario or {}).get("endereco_de_entrega", {}).get("estado")
+    return {"categorias": categorias, "estado": estado}
+
+
+def _operacoes(pedido: Dict, categorias: Dict, estado: Optional[str], sinal: int) -> List[UpdateOne]:
+    dia = inicio_do_dia(pedido["data_pedido"])
+    operacoes = []
+    for item in pedido.get("itens", []):
+        id_produto = item.get("id_produto")
+        if not id_produto:
+            continue
+        quantidade = item.get("quantidade", 0)
+        chave = {
+            "dia": dia,
+            "id_produto": id_produto,
+            "categoria": categorias.get(id_produto),
+            "estado": estado,
+            "status": pedido.get("status")
+        }
+        operacoes.append(UpdateOne(
+            chave,
+            {"$inc": {
+                "unidades": sinal * quantidade,
+                "receita": sinal * quantidade * item.get("preco_unitario", 0.0),
+                "itens": sinal
+            }},
+            upsert=True
+        ))
+    return operacoes
+
+
+async def registrar_pedido(
+    db: AsyncIOMotorDatabase,
+    pedido: Dict,
+    sinal: int = 1,
+    categorias: Optional[Dict] = None,
+    estado: Optional[str] = None
+) -> None:
+    """
+    Soma (sinal=1) ou subtrai (sinal=-1) os itens de um pedido dos agregados diários.
+
+    `categorias` e `estado` podem ser informados por quem já os tem em mãos; caso contrário
+    vêm do retrato gravado no pedido. Falhas são registradas em log e não
+    interrompem a operação do pedido, já que `reconstruir_rollups` corrige qualquer desvio.
+    """
+    try:
+        if categorias is None:
+            dimensoes = await _dimensoes_pedido(db, pedido)
+            categorias, estado = dimensoes["categorias"], dimensoes["estado"]
+        operacoes = _operacoes(pedido, categorias, estado, sinal)
+        if operacoes:
+            await db[COLECAO_ROLLUPS].bulk_write(operacoes, ordered=False)
+    except PyMongoError as erro:
+        logger.error("Falha ao atualizar rollups do pedido '%s': %s", pedido.get('_id'), erro)
+
+
+async def substituir_pedido(db: AsyncIOMotorDatabase, anterior: Dict, atual: Dict) -> None:
+    """Move os itens de um pedido alterado da chave antiga para a nova (ex.: mudança de status)."""
+    campos_chave = ("status", "id_usuario", "data_pedido")
+    if all(anterior.get(campo) == atual.get(campo) for campo in campos_chave):
+        return
+    await registrar_pedido(db, anterior, sinal=-1)
+    await registrar_pedido(db, atual, sinal=1)
+
+
+async def reconstruir_rollups(db: AsyncIOMotorDatabase) -> None:
+    """
+    Recalcula toda a coleção de rollups a partir dos pedidos, lendo só a coleção de pedidos:
+    categoria e estado vêm do retrato de cada pedido, preenchido antes nos pedidos antigos.
+    """
+    await preencher_snapshot_pedidos(db)
+    pipeline: List[Dict[str, Any]] = [
+        {"$unwind": "$itens"},
+        {"$match": {"itens.id_produto": {"$nin": [None, ""]}}},
+        {
+            "$group": {
+                "_id": {
+                    "dia": {
+                        "$dateFromParts": {
+                            "year": {"$year": "$data_pedido"},
+                            "month": {"$month": "$data_pedido"},
+                            "day": {"$dayOfMonth": "$data_pedido"}
+                        }
+                    },
+                    "id_produto": "$itens.id_produto",
+                    "categoria": {"$ifNull": ["$itens.categoria", None]},
+                    "estado": {"$ifNull": ["$estado_entrega", None]},
+                    "status": "$status"
+                },
+                "unidades": {"$sum": "$itens.quantidade"},
+                "receita": {"$sum": {"$multiply": ["$itens.quantidade", "$itens.preco_unitario"]}},
+                "itens": {"$sum": 1}
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "dia": "$_id.dia",
+                "id_produto": "$_id.id_produto",
+                "categoria": "$_id.categoria",
+                "estado": "$_id.estado",
+                "status": "$_id.status",
+                "unidades": 1,
+                "receita": 1,
+                "itens": 1
+            }
+        },
+        {"$out": COLECAO_ROLLUPS}
+    ]
+    await db.pedidos.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+    logger.info("Rollups de vendas reconstruídos a partir dos pedidos.")
+
+
+async def verificar_rollups(db: AsyncIOMotorDatabase) -> bool:
+    """
+    Chamado no lifespan da aplicação: só confere se a coleção de rollups está vazia com
+    pedidos já existentes (primeira implantação ou banco restaurado sem ela) e, nesse caso,
+    registra um erro. A reconstrução não roda aqui: ela percorre todos os pedidos, o que
+    atrasaria a subida, e o $out final substituiria os rollups gravados por
+    `registrar_pedido` durante a reconstrução. Deve ser feita com
+    `python -m services.rollups` antes de a aplicação receber pedidos.
+    """
+    try:
+        if await db[COLECAO_ROLLUPS].estimated_document_count() > 0:
+            return True
+        if await db.pedidos.find_one({}, {"_id": 1}) is None:
+            return True
+    except PyMongoError as erro:
+        logger.error("Falha ao verificar os rollups de vendas: %s", erro)
+        return False
+    logger.error(
+        "Coleção %s vazia com pedidos existentes; os relatórios sairão zerados até rodar "
+        "`python -m services.rollups`.", COLECAO_ROLLUPS
+    )
+    return False
+
+
+if __name__ == "__main__":
+    # Reconstrução completa, com a aplicação parada: python -m services.rollups
+    from database import get_db
+
+    asyncio.run(reconstruir_rollups(get_db()))
@@ -0,0 +1,153 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from logger import get_logger
+from services.busca import regiao_usuario, termos_nome
+
+logger = get_logger("snapshot_pedidos_logger", "log/snapshot_pedidos.log")
+
+TAMANHO_LOTE = 500
+
+# Pedidos gravados antes do retrato não têm o campo (nos novos ele existe, mesmo que nulo)
+FILTRO_SEM_SNAPSHOT = {"estado_entrega": {"$exists": False}}
+# Pedidos com retrato gravado antes de ele incluir a região normalizada (`regiao_entrega`)
+FILTRO_SEM_REGIAO = {"estado_entrega": {"$exists": True}, "regiao_entrega": {"$exists": False}}
+# Pedidos com retrato gravado antes de os itens guardarem os termos do nome (`itens.termos_nome`)
+FILTRO_SEM_TERMOS = {"estado_entrega": {"$exists": True}, "itens.0": {"$exists": True}, "itens.termos_nome": {"$exists": False}}
+
+
+def _como_object_id(valor: Any) -> Any:
+    if isinstance(valor, str) and ObjectId.is_valid(valor):
+        return ObjectId(valor)
+    return valor
+
+
+def _itens_com_termos(itens: List[Dict]) -> List[Dict]:
+    """Itens com os termos do nome gravado na compra (`nome_produto`), não do nome atual do produto."""
+    return [{**item, "termos_nome": termos_nome({"nome": item.get("nome_produto")})} for item in itens]
+
+
+def _promocao_na_data(promocoes: List[Dict], data: datetime) -> Optional[ObjectId]:
+    for promocao in promocoes:
+        if promocao["data_inicio"] <= data <= promocao["data_fim"]:
+            return promocao["_id"]
+    return None
+
+
+async def _operacoes_lote(db: AsyncIOMotorDatabase, pedidos: List[Dict]) -> List[UpdateOne]:
+    """Monta o retrato de um lote de pedidos com três consultas: produtos, usuários e promoções."""
+    ids_produtos = list({item["id_produto"] for pedido in pedidos for item in pedido.get("itens", []) if item.get("id_produto")})
+    ids_usuarios = list({_como_object_id(pedido.get("id_usuario")) for pedido in pedidos})
+
+    lista_produtos, lista_usuarios, lista_promocoes = await asyncio.gather(
+        db.produtos.find({"_id": {"$in": ids_produtos}}, {"categoria": 1, "marca": 1}).to_list(length=None),
+        db.usuarios.find({"_id": {"$in": ids_usuarios}}, {"endereco_de_entrega": 1}).to_list(length=None),
+        db.promocoes.find(
+            {"produtos_aplicaveis": {"$in": ids_produtos}}, {"produtos_aplicaveis": 1, "data_inicio": 1, "data_fim": 1}
+        ).to_list(length=None)
+    )
+    produtos = {produto["_id"]: produto for produto in lista_produtos}
+    enderecos = {usuario["_id"]: usuario.get("endereco_de_entrega") or {} for usuario in lista_usuarios}
+    promocoes_por_produto: Dict[ObjectId, List[Dict]] = {}
+    for promocao in lista_promocoes:
+        for produto_id in promocao.get("produtos_aplicaveis", []):
+            promocoes_por_produto.setdefault(produto_id, []).append(promocao)
+
+    operacoes = []
+    for pedido in pedidos:
+        itens = []
+        for item in _itens_com_termos(pedido.get("itens", [])):
+            produto = produtos.get(item.get("id_produto"), {})
+            # A promoção de pedidos antigos é a que estava vigente para o produto na data da compra
+            itens.append({
+                "categoria": produto.get("categoria"),
+                "marca": produto.get("marca"),
+                "id_promocao": _promocao_na_data(promocoes_por_produto.get(item.get("id_produto"), []), pedido["data_pedido"]),
+                **item
+            })
+        endereco = enderecos.get(_como_object_id(pedido.get("id_usuario")), {})
+        operacoes.append(UpdateOne(
+            {"_id": pedido["_id"], **FILTRO_SEM_SNAPSHOT},
+            {"$set": {
+                "itens": itens,
+                "cidade_entrega": endereco.get("cidade"),
+                "estado_entrega": endereco.get("estado"),
+                "regiao_entrega": regiao_usuario(endereco)
+            }}
+        ))
+    return operacoes
+
+
+async def _atualizar_em_lotes(
+    db: AsyncIOMotorDatabase,
+    filtro: Dict[str, Any],
+    projecao: Dict[str, int],
+    alteracoes: Callable[[Dict], Dict[str, Any]]
+) -> int:
+    """Aplica `$set` com as alterações calculadas de cada pedido do filtro, em lotes."""
+    total = 0
+    operacoes: List[UpdateOne] = []
+    async for pedido in db.pedidos.find(filtro, projecao):
+        operacoes.append(UpdateOne({"_id": pedido["_id"]}, {"$set": alteracoes(pedido)}))
+        if len(operacoes) == TAMANHO_LOTE:
+            await db.pedidos.bulk_write(operacoes, ordered=False)
+            total += len(operacoes)
+            operacoes = []
+    if operacoes:
+        await db.pedidos.bulk_write(operacoes, ordered=False)
+        total += len(operacoes)
+    return total
+
+
+async def _preencher_regiao_pedidos(db: AsyncIOMotorDatabase) -> int:
+    """Normaliza a cidade/estado já gravados no retrato, sem consultar os usuários."""
+    def regiao(pedido: Dict) -> Dict[str, Any]:
+        endereco = {"cidade": pedido.get("cidade_entrega"), "estado": pedido.get("estado_entrega")}
+        return {"regiao_entrega": regiao_usuario(endereco)}
+
+    return await _atualizar_em_lotes(db, FILTRO_SEM_REGIAO, {"cidade_entrega": 1, "estado_entrega": 1}, regiao)
+
+
+async def _preencher_termos_itens(db: AsyncIOMotorDatabase) -> int:
+    """Grava os termos do nome nos itens de pedidos que já têm o retrato."""
+    return await _atualizar_em_lotes(
+        db, FILTRO_SEM_TERMOS, {"itens": 1}, lambda pedido: {"itens": _itens_com_termos(pedido["itens"])}
+    )
+
+
+async def preencher_snapshot_pedidos(db: AsyncIOMotorDatabase) -> int:
+    """
+    Migração dos pedidos gravados antes do retrato: preenche categoria, marca e promoção dos
+    itens e a cidade/estado de entrega com os dados atuais de produtos e usuários. Campos já
+    presentes nos itens são mantidos. Pedidos que já têm o retrato, mas sem `regiao_entrega`
+    ou sem os termos do nome nos itens, recebem só o que falta, calculado a partir do que o
+    próprio pedido guarda. Pode ser executada mais de uma vez.
+    """
+    total = 0
+    lote: List[Dict] = []
+    async for pedido in db.pedidos.find(FILTRO_SEM_SNAPSHOT, {"id_usuario": 1, "data_pedido": 1, "itens": 1}):
+        lote.append(pedido)
+        if len(lote) == TAMANHO_LOTE:
+            await db.pedidos.bulk_write(await _operacoes_lote(db, lote), ordered=False)
+            total += len(lote)
+            lote = []
+    if lote:
+        await db.pedidos.bulk_write(await _operacoes_lote(db, lote), ordered=False)
+        total += len(lote)
+    so_regiao = await _preencher_regiao_pedidos(db)
+    so_termos = await _preencher_termos_itens(db)
+    logger.info(
+        "Retrato preenchido em %s pedidos; região normalizada em %s e termos dos itens em %s.",
+        total, so_regiao, so_termos
+    )
+    return total + so_regiao + so_termos
+
+
+if __name__ == "__main__":
+    # Migração dos pedidos antigos: python -m services.snapshot_pedidos
+    from database import get_db
+
+    print(f"{asyncio.run(preencher_snapshot_pedidos(get_db()))} pedidos atualizados.")
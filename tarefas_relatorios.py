@@ -0,0 +1,343 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+from fastapi import HTTPException, Request, Response
+from fastapi.dependencies.models import Dependant
+from cache_http import RotaComCache
+from logger import get_logger
+
+logger = get_logger("tarefas_logger", "log/tarefas.log")
+
+# Relatórios executados ao mesmo tempo; o restante espera na fila, sem disputar o pool do
+# Mongo com as rotas transacionais (pedidos, checkout).
+TAREFAS_WORKERS = int(os.getenv("TAREFAS_WORKERS", "2"))
+# Tarefas aguardando um worker; acima disso novas requisições recebem 503.
+TAREFAS_MAX_FILA = int(os.getenv("TAREFAS_MAX_FILA", "100"))
+# Por quanto tempo (s) um resultado bem-sucedido é reaproveitado por requisições iguais, nos
+# endpoints que optam por isso (executar_em_tarefa(ttl=TAREFAS_TTL)).
+TAREFAS_TTL = int(os.getenv("TAREFAS_TTL", "60"))
+# Por quanto tempo (s) o resultado de uma tarefa fica disponível pelo id, em /relatorios/tarefas.
+TAREFAS_RETENCAO = int(os.getenv("TAREFAS_RETENCAO", "300"))
+
+PENDENTE = "pendente"
+EXECUTANDO = "executando"
+CONCLUIDA = "concluida"
+FALHOU = "falhou"
+
+PARAMETRO_ASSINCRONO = "assincrono"
+PREFIXO_LINKS = "/relatorios/tarefas"
+
+# Marca, no scope, a subrequisição feita pelo worker (que executa o endpoint de fato).
+_CHAVE_ESCOPO = "tarefa_relatorio"
+# Cabeçalhos da resposta do relatório guardados com o resultado.
+_CABECALHOS_RESULTADO = (b"content-type", b"content-disposition")
+
+
+class ConfigTarefa:
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+
+def executar_em_tarefa(ttl: int = 0) -> Callable:
+    """
+    Marca um endpoint GET de relatório para ser executado pelos workers de tarefas (em routers
+    criados com `route_class=RotaRelatorio`). Requisições iguais simultâneas compartilham a
+    mesma execução. Com `ttl` > 0, um resultado bem-sucedido ainda atende requisições iguais
+    por `ttl` segundos; use só em relatórios que toleram essa defasagem. Respostas de erro
+    nunca são reaproveitadas.
+    """
+    def marcar(endpoint: Callable) -> Callable:
+        endpoint.config_tarefa = ConfigTarefa(ttl)
+        return endpoint
+    return marcar
+
+
+def _pede_assincrono(request: Request) -> bool:
+    if request.query_params.get(PARAMETRO_ASSINCRONO, "").lower() in ("1", "true", "sim"):
+        return True
+    return "respond-async" in request.headers.get("prefer", "").lower()
+
+
+def _como_texto(valor: Any) -> str:
+    if isinstance(valor, bool):
+        return "true" if valor else "false"
+    if isinstance(valor, Enum):
+        return str(valor.value)
+    return str(valor)
+
+
+def _padroes_consulta(dependant: Dependant) -> Dict[str, Optional[str]]:
+    """Parâmetros de consulta aceitos pelo endpoint (inclusive os de dependências) e seus valores padrão."""
+    padroes: Dict[str, Optional[str]] = {}
+    for campo in dependant.query_params:
+        padrao = None if campo.field_info.is_required() else campo.field_info.get_default(call_default_factory=True)
+        padroes[campo.alias] = None if padrao is None else _como_texto(padrao)
+    for dependencia in dependant.dependencies:
+        padroes.update(_padroes_consulta(dependencia))
+    return padroes
+
+
+def _parametros(request: Request, padroes: Dict[str, Optional[str]]) -> List[Tuple[str, str]]:
+    # Só os parâmetros que o endpoint aceita, com os padrões preenchidos e em ordem, para que
+    # a mesma consulta escrita de formas diferentes caia na mesma tarefa.
+    informados = [
+        (nome, valor) for nome, valor in request.query_params.multi_items()
+        if nome in padroes and valor != ""
+    ]
+    presentes = {nome for nome, _ in informados}
+    informados += [
+        (nome, padrao) for nome, padrao in padroes.items()
+        if nome not in presentes and padrao is not None
+    ]
+    return sorted(informados)
+
+
+def _chave(caminho: str, parametros: List[Tuple[str, str]]) -> str:
+    return f"{caminho}?{urlencode(parametros)}"
+
+
+class Tarefa:
+    def __init__(self, request: Request, parametros: List[Tuple[str, str]], ttl: int):
+        self.id = uuid.uuid4().hex
+        self.caminho = request.url.path
+        self.parametros = parametros
+        self.chave = _chave(self.caminho, parametros)
+        self.status = PENDENTE
+        self.criada_em = datetime.now()
+        self.iniciada_em: Optional[datetime] = None
+        self.concluida_em: Optional[datetime] = None
+        self.ttl = ttl
+        self.expira_em: Optional[float] = None
+        self.reaproveitavel_ate: Optional[float] = None
+        self.codigo_http: Optional[int] = None
+        self.cabecalhos: List[Tuple[bytes, bytes]] = []
+        self.corpo = b""
+        self.concluida = asyncio.Event()
+        self.app = request.app
+        self.escopo = self._montar_escopo(request)
+
+    def _montar_escopo(self, request: Request) -> Dict[str, Any]:
+        origem = request.scope
+        cabecalhos = [
+            (nome, valor) for nome, valor in origem["headers"]
+            if nome not in (b"prefer", b"if-none-match", b"cookie", b"authorization")
+        ]
+        return {
+            "type": "http",
+            "asgi": origem.get("asgi", {"version": "3.0"}),
+            "http_version": origem.get("http_version", "1.1"),
+            "method": "GET",
+            "scheme": origem.get("scheme", "http"),
+            "server": origem.get("server"),
+            "client": origem.get("client"),
+            "root_path": origem.get("root_path", ""),
+            "path": origem["path"],
+            "raw_path": origem["path"].encode(),
+            "query_string": urlencode(self.parametros).encode(),
+            "headers": cabecalhos,
+            "state": dict(origem.get("state") or {}),
+            _CHAVE_ESCOPO: self.id,
+        }
+
+    def concluir(self, codigo_http: int, cabecalhos: List[Tuple[bytes, bytes]], corpo: bytes) -> None:
+        self.codigo_http = codigo_http
+        self.cabecalhos = [(nome, valor) for nome, valor in cabecalhos if nome.lower() in _CABECALHOS_RESULTADO]
+        self.corpo = corpo
+        self.status = CONCLUIDA if codigo_http < 400 else FALHOU
+        self.concluida_em = datetime.now()
+        agora = time.monotonic()
+        self.expira_em = agora + TAREFAS_RETENCAO
+        if codigo_http < 400 and self.ttl > 0:
+            self.reaproveitavel_ate = agora + self.ttl
+        self.concluida.set()
+
+    def expirada(self) -> bool:
+        return self.expira_em is not None and time.monotonic() >= self.expira_em
+
+    def reaproveitavel(self) -> bool:
+        """Se uma nova requisição igual pode usar esta tarefa: em andamento ou dentro do TTL."""
+        if not self.concluida.is_set():
+            return True
+        return self.reaproveitavel_ate is not None and time.monotonic() < self.reaproveitavel_ate
+
+    def links(self) -> Dict[str, str]:
+        return {
+            "status": f"{PREFIXO_LINKS}/{self.id}",
+            "resultado": f"{PREFIXO_LINKS}/{self.id}/resultado"
+        }
+
+    def resumo(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "relatorio": self.caminho,
+            "parametros": dict(self.parametros),
+            "status": self.status,
+            "codigo_http": self.codigo_http,
+            "criada_em": self.criada_em.isoformat(),
+            "iniciada_em": self.iniciada_em.isoformat() if self.iniciada_em else None,
+            "concluida_em": self.concluida_em.isoformat() if self.concluida_em else None,
+            "links": self.links()
+        }
+
+    def resposta_resultado(self) -> Response:
+        cabecalhos = {nome.decode("latin-1"): valor.decode("latin-1") for nome, valor in self.cabecalhos}
+        cabecalhos["X-Tarefa"] = self.id
+        return Response(content=self.corpo, status_code=self.codigo_http, headers=cabecalhos)
+
+    def resposta_aceita(self) -> Response:
+        cabecalhos = {"Location": self.links()["status"], "X-Tarefa": self.id}
+        if not self.concluida.is_set():
+            cabecalhos["Retry-After"] = "1"
+        return Response(
+            content=json.dumps(self.resumo(), ensure_ascii=False),
+            status_code=202,
+            media_type="application/json",
+            headers=cabecalhos
+        )
+
+
+async def _executar_subrequisicao(app, escopo: Dict[str, Any]) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    """Executa o endpoint pela aplicação ASGI completa (middlewares, dependências e tratamento de erros)."""
+    corpo_enviado = False
+    inicio: Dict[str, Any] = {}
+    partes: List[bytes] = []
+
+    async def receber():
+        nonlocal corpo_enviado
+        if not corpo_enviado:
+            corpo_enviado = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Sem desconexão: o cliente que pediu a tarefa pode já ter ido embora
+        await asyncio.Future()
+
+    async def enviar(mensagem):
+        if mensagem["type"] == "http.response.start":
+            inicio.update(mensagem)
+        elif mensagem["type"] == "http.response.body":
+            partes.append(mensagem.get("body", b""))
+
+    await app(escopo, receber, enviar)
+    return inicio.get("status", 500), list(inicio.get("headers", [])), b"".join(partes)
+
+
+class GerenciadorTarefas:
+    """
+    Fila de relatórios em memória (por processo) com um número fixo de workers. Tarefas são
+    identificadas pelo caminho e pelos parâmetros normalizados: enquanto uma está na fila ou
+    em execução, requisições iguais aguardam a mesma tarefa. Depois de concluída, ela só
+    atende novas requisições dentro do TTL do endpoint e se tiver sido bem-sucedida; pelo id,
+    o resultado fica disponível por TAREFAS_RETENCAO segundos.
+    """
+
+    def __init__(self, workers: int = TAREFAS_WORKERS, max_fila: int = TAREFAS_MAX_FILA):
+        self.workers = workers
+        self.max_fila = max_fila
+        self._tarefas: Dict[str, Tarefa] = {}
+        self._por_chave: Dict[str, Tarefa] = {}
+        self._fila: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    def obter(self, tarefa_id: str) -> Optional[Tarefa]:
+        self._remover_expiradas()
+        return self._tarefas.get(tarefa_id)
+
+    def enfileirar(self, request: Request, padroes: Dict[str, Optional[str]], ttl: int) -> Tarefa:
+        self._remover_expiradas()
+        parametros = _parametros(request, padroes)
+        existente = self._por_chave.get(_chave(request.url.path, parametros))
+        if existente is not None and existente.reaproveitavel():
+            return existente
+
+        self._iniciar()
+        if self._fila.qsize() >= self.max_fila:
+            raise HTTPException(
+                status_code=503,
+                detail="Fila de relatórios cheia. Tente novamente em instantes.",
+                headers={"Retry-After": "5"}
+            )
+        tarefa = Tarefa(request, parametros, ttl)
+        self._tarefas[tarefa.id] = tarefa
+        self._por_chave[tarefa.chave] = tarefa
+        self._fila.put_nowait(tarefa)
+        return tarefa
+
+    def _iniciar(self) -> None:
+        if self._fila is None:
+            self._fila = asyncio.Queue()
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        while len(self._workers) < self.workers:
+            self._workers.append(asyncio.create_task(self._trabalhar()))
+
+    async def _trabalhar(self) -> None:
+        while True:
+            tarefa = await self._fila.get()
+            try:
+                await self._executar(tarefa)
+            finally:
+                self._fila.task_done()
+
+    async def _executar(self, tarefa: Tarefa) -> None:
+        tarefa.status = EXECUTANDO
+        tarefa.iniciada_em = datetime.now()
+        inicio = time.perf_counter()
+        try:
+            codigo_http, cabecalhos, corpo = await _executar_subrequisicao(tarefa.app, tarefa.escopo)
+        except Exception as erro:
+            logger.error("Falha ao executar a tarefa %s (%s): %s", tarefa.id, tarefa.chave, erro)
+            codigo_http, cabecalhos = 500, [(b"content-type", b"application/json")]
+            corpo = json.dumps({"detail": "Erro ao gerar o relatório."}, ensure_ascii=False).encode()
+        tarefa.concluir(codigo_http, cabecalhos, corpo)
+        if not tarefa.reaproveitavel() and self._por_chave.get(tarefa.chave) is tarefa:
+            del self._por_chave[tarefa.chave]
+        logger.info(
+            "Tarefa %s (%s) concluída com status %s em %.3f s.",
+            tarefa.id, tarefa.chave, codigo_http, time.perf_counter() - inicio
+        )
+
+    def _remover_expiradas(self) -> None:
+        for tarefa in [tarefa for tarefa in self._tarefas.values() if tarefa.expirada()]:
+            del self._tarefas[tarefa.id]
+        for chave in [chave for chave, tarefa in self._por_chave.items() if not tarefa.reaproveitavel()]:
+            del self._por_chave[chave]
+
+    async def encerrar(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+gerenciador_tarefas = GerenciadorTarefas()
+
+
+class RotaRelatorio(RotaComCache):
+    """
+    Rota que executa pelos workers de tarefas os endpoints marcados com `executar_em_tarefa`.
+    Por padrão a requisição aguarda o resultado; com `?assincrono=true` ou `Prefer: respond-async`
+    recebe 202 com o id da tarefa, consultada em /relatorios/tarefas/{id}.
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        config: Optional[ConfigTarefa] = getattr(self.endpoint, "config_tarefa", None)
+        if config is None:
+            return handler
+        padroes = _padroes_consulta(self.dependant)
+
+        async def handler_relatorio(request: Request) -> Response:
+            if request.method != "GET" or _CHAVE_ESCOPO in request.scope:
+                return await handler(request)
+
+            tarefa = gerenciador_tarefas.enfileirar(request, padroes, config.ttl)
+            if _pede_assincrono(request):
+                return tarefa.resposta_aceita()
+            await tarefa.concluida.wait()
+            return tarefa.resposta_resultado()
+
+        return handler_relatorio
@@ -0,0 +1,56 @@
+import asyncio
+import os
+import uuid
+from typing import Awaitable, Callable
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+# Com MONGO_URL_TESTES os testes usam um servidor real (um banco descartável por teste);
+# sem ela, o mongomock-motor, se estiver instalado. Sem nenhum dos dois, os testes são pulados.
+MONGO_URL_TESTES = os.getenv("MONGO_URL_TESTES")
+
+
+def _cliente():
+    if MONGO_URL_TESTES:
+        return AsyncIOMotorClient(MONGO_URL_TESTES)
+    try:
+        import mongomock_motor
+    except ImportError:
+        pytest.skip("Defina MONGO_URL_TESTES ou instale o mongomock-motor para rodar os testes com banco.")
+    _compatibilizar_mongomock()
+    return mongomock_motor.AsyncMongoMockClient()
+
+
+def _compatibilizar_mongomock() -> None:
+    # O pymongo 4.x passa `sort` às operações de bulk_write, que o mongomock não aceita
+    from mongomock.collection import BulkOperationBuilder
+    for nome in ("add_update", "add_replace", "add_delete"):
+        original = getattr(BulkOperationBuilder, nome)
+        if getattr(original, "compatibilizado", False):
+            continue
+
+        def sem_sort(self, *args, _original=original, **kwargs):
+            kwargs.pop("sort", None)
+            return _original(self, *args, **kwargs)
+
+        sem_sort.compatibilizado = True
+        setattr(BulkOperationBuilder, nome, sem_sort)
+
+
+@pytest.fixture
+def com_banco() -> Callable[[Callable[[AsyncIOMotorDatabase], Awaitable]], object]:
+    """
+    Executa uma corrotina de teste recebendo um banco vazio, descartado ao final:
+    `com_banco(lambda db: cenario(db))`.
+    """
+    def executar(cenario: Callable[[AsyncIOMotorDatabase], Awaitable]):
+        async def rodar():
+            cliente = _cliente()
+            nome = f"testes_{uuid.uuid4().hex[:12]}"
+            try:
+                return await cenario(cliente[nome])
+            finally:
+                await cliente.drop_database(nome)
+                cliente.close()
+        return asyncio.run(rodar())
+    return executar
@@ -0,0 +1,61 @@
+import asyncio
+import httpx
+import pytest
+from fastapi import APIRouter, FastAPI
+import cache_http
+from cache_http import CacheMemoria, CacheRedis, RotaComCache, cache_resposta, invalidar_cache
+
+
+def _backend_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+    return CacheRedis(fakeredis.FakeAsyncRedis())
+
+
+@pytest.fixture(params=["memoria", "redis"])
+def app(request, monkeypatch):
+    monkeypatch.setattr(cache_http, "cache", CacheMemoria() if request.param == "memoria" else _backend_redis())
+    estado = {"valor": 1, "leitura_feita": None, "liberar": None}
+    router = APIRouter(route_class=RotaComCache)
+
+    @router.get("/itens")
+    @cache_resposta(tags=["itens"])
+    async def itens():
+        valor = estado["valor"]
+        if estado["liberar"] is not None:
+            # Leitura feita; a escrita concorrente acontece antes de a resposta ficar pronta
+            estado["leitura_feita"].set()
+            await estado["liberar"].wait()
+        return {"valor": valor}
+
+    aplicacao = FastAPI()
+    aplicacao.include_router(router)
+    aplicacao.state.estado = estado
+    return aplicacao
+
+
+def _rodar(app, cenario):
+    async def rodar():
+        transporte = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://teste") as cliente:
+            return await cenario(cliente)
+    return asyncio.run(rodar())
+
+
+def test_escrita_durante_miss_nao_deixa_resposta_antiga_no_cache(app):
+    estado = app.state.estado
+
+    async def cenario(cliente):
+        estado["leitura_feita"], estado["liberar"] = asyncio.Event(), asyncio.Event()
+        lenta = asyncio.create_task(cliente.get("/itens"))
+        await estado["leitura_feita"].wait()
+        estado["valor"] = 2
+        await invalidar_cache("itens")
+        estado["liberar"].set()
+        primeira = await lenta
+        estado["liberar"] = None
+        return primeira, await cliente.get("/itens"), await cliente.get("/itens")
+
+    primeira, segunda, terceira = _rodar(app, cenario)
+    assert primeira.json() == {"valor": 1}
+    assert segunda.headers["x-cache"] == "MISS" and segunda.json() == {"valor": 2}
+    assert terceira.headers["x-cache"] == "HIT" and terceira.json() == {"valor": 2}
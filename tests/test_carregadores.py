@@ -0,0 +1,106 @@
+import asyncio
+from bson import ObjectId
+from models.variacao_produto import VariacaoCreate
+import routes.variacao_produto as rotas_variacoes
+from services.carregadores import ProdutoLoader, VariacaoBySkuLoader
+
+
+class ColecaoContada:
+    """Coleção que registra o filtro de cada find."""
+
+    def __init__(self, colecao, falhar: bool = False):
+        self._colecao = colecao
+        self.falhar = falhar
+        self.consultas = []
+
+    def find(self, filtro):
+        self.consultas.append(filtro)
+        if self.falhar:
+            raise ConnectionError("banco indisponível")
+        return self._colecao.find(filtro)
+
+
+class BancoContado:
+    def __init__(self, colecoes):
+        self._colecoes = colecoes
+
+    def __getitem__(self, nome):
+        return self._colecoes[nome]
+
+
+def _carregador(classe, db, **opcoes):
+    carregador = classe(db)
+    carregador._colecao = ColecaoContada(carregador._colecao, **opcoes)
+    return carregador
+
+
+def test_chaves_do_mesmo_ciclo_viram_uma_consulta(com_banco):
+    async def cenario(db):
+        ids = (await db.produtos.insert_many([{"nome": "A"}, {"nome": "B"}])).inserted_ids
+        carregador = _carregador(ProdutoLoader, db)
+        inexistente = ObjectId()
+        # Chaves repetidas, como string ou ObjectId, e uma sem documento
+        documentos = await asyncio.gather(
+            carregador.carregar(ids[0]), carregador.carregar(str(ids[0])),
+            carregador.carregar(ids[1]), carregador.carregar(inexistente)
+        )
+        return ids, inexistente, documentos, carregador._colecao.consultas
+
+    ids, inexistente, documentos, consultas = com_banco(cenario)
+    assert [documento and documento["nome"] for documento in documentos] == ["A", "A", "B", None]
+    assert len(consultas) == 1
+    assert sorted(consultas[0]["_id"]["$in"]) == sorted([ids[0], ids[1], inexistente])
+
+
+def test_chave_ja_carregada_nao_e_consultada_de_novo(com_banco):
+    async def cenario(db):
+        await db.variacoes_produto.insert_many([{"sku": "A"}, {"sku": "B"}])
+        carregador = _carregador(VariacaoBySkuLoader, db)
+        await carregador.carregar("A")
+        varios = await carregador.carregar_varios(["A", "B", "A"])
+        return varios, carregador._colecao.consultas
+
+    varios, consultas = com_banco(cenario)
+    assert [variacao["sku"] for variacao in varios] == ["A", "B", "A"]
+    assert consultas == [{"sku": {"$in": ["A"]}}, {"sku": {"$in": ["B"]}}]
+
+
+def test_falha_chega_a_todas_as_chamadas_e_nao_fica_guardada(com_banco):
+    async def cenario(db):
+        await db.variacoes_produto.insert_one({"sku": "A"})
+        carregador = _carregador(VariacaoBySkuLoader, db, falhar=True)
+        falhas = await asyncio.gather(carregador.carregar("A"), carregador.carregar("B"), return_exceptions=True)
+        carregador._colecao.falhar = False
+        return falhas, await carregador.carregar("A"), len(carregador._colecao.consultas), carregador._consultas
+
+    falhas, depois, consultas, em_andamento = com_banco(cenario)
+    assert all(isinstance(falha, ConnectionError) for falha in falhas)
+    assert depois["sku"] == "A"
+    assert consultas == 2
+    assert not em_andamento
+
+
+def test_importacao_de_variacoes_consulta_pais_e_skus_uma_vez_por_lote(com_banco, monkeypatch):
+    async def sem_precos(db, produtos_ids):
+        return None
+    monkeypatch.setattr(rotas_variacoes, "atualizar_precos", sem_precos)
+
+    async def cenario(db):
+        pai, outro_pai = (await db.produtos.insert_many([{"nome": "A"}, {"nome": "B"}])).inserted_ids
+        await db.variacoes_produto.insert_one({"sku": "EXISTENTE", "produto_id": outro_pai, "estoque": 1})
+        monkeypatch.setattr(rotas_variacoes, "variacao_collection", db.variacoes_produto)
+        colecoes = {nome: ColecaoContada(db[nome]) for nome in ("produtos", "variacoes_produto")}
+
+        def variacao(produto_id, sku):
+            return VariacaoCreate(produto_id=produto_id, sku=sku, atributos={}, preco_adicional=0.0, estoque=1, urls_imagens=[])
+
+        lote = [(1, variacao(pai, "NOVO")), (2, variacao(pai, "EXISTENTE")), (3, variacao(ObjectId(), "ORFA"))]
+        resultados = await rotas_variacoes._gravar_lote_variacoes(BancoContado(colecoes), lote)
+        consultas = {nome: len(colecao.consultas) for nome, colecao in colecoes.items()}
+        return resultados, consultas, await db.variacoes_produto.find_one({"sku": "EXISTENTE"}), pai
+
+    resultados, consultas, movida, pai = com_banco(cenario)
+    por_linha = {resultado["linha"]: resultado["status"] for resultado in resultados}
+    assert por_linha == {1: "criado", 2: "atualizado", 3: "erro"}
+    assert consultas == {"produtos": 1, "variacoes_produto": 1}
+    assert movida["produto_id"] == pai
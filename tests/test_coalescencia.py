@@ -0,0 +1,124 @@
+import asyncio
+import httpx
+import pytest
+from fastapi import FastAPI
+import cache_http
+import routes.produtos as rotas_produtos
+from coalescencia import COMPARTILHADA, LIDER, MICRO_TTL, GrupoCoalescencia
+from database import get_db
+
+
+def test_chamadas_simultaneas_compartilham_uma_leitura():
+    grupo = GrupoCoalescencia("teste_simultaneas")
+    leituras = []
+
+    async def ler():
+        leituras.append(1)
+        await asyncio.sleep(0.01)
+        return {"_id": 1}
+
+    async def cenario():
+        return await asyncio.gather(*(grupo.executar("p1", ler) for _ in range(50)))
+
+    resultados = asyncio.run(cenario())
+    assert len(leituras) == 1
+    assert all(resultado is resultados[0] for resultado in resultados)
+    assert grupo.chamadas[LIDER] == 1 and grupo.chamadas[COMPARTILHADA] == 49
+
+
+def test_excecao_chega_a_todas_as_chamadas():
+    grupo = GrupoCoalescencia("teste_excecao")
+
+    async def falhar():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("banco indisponível")
+
+    async def cenario():
+        return await asyncio.gather(*(grupo.executar("p1", falhar) for _ in range(5)), return_exceptions=True)
+
+    assert all(isinstance(resultado, RuntimeError) for resultado in asyncio.run(cenario()))
+
+
+def test_cancelar_a_primeira_chamada_nao_afeta_as_demais():
+    grupo = GrupoCoalescencia("teste_cancelamento")
+
+    async def ler():
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    async def cenario():
+        primeira = asyncio.create_task(grupo.executar("p1", ler))
+        await asyncio.sleep(0)
+        segunda = asyncio.create_task(grupo.executar("p1", ler))
+        await asyncio.sleep(0)
+        primeira.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await primeira
+        return await segunda
+
+    assert asyncio.run(cenario()) == "ok"
+
+
+def test_micro_ttl_reaproveita_e_expira():
+    grupo = GrupoCoalescencia("teste_ttl", ttl=0.05)
+    leituras = []
+
+    async def ler():
+        leituras.append(1)
+        return len(leituras)
+
+    async def cenario():
+        primeira = await grupo.executar("p1", ler)
+        repetida = await grupo.executar("p1", ler)
+        await asyncio.sleep(0.06)
+        return primeira, repetida, await grupo.executar("p1", ler)
+
+    assert asyncio.run(cenario()) == (1, 1, 2)
+    assert grupo.chamadas[MICRO_TTL] == 1
+
+
+def test_descartar_durante_a_leitura_nao_guarda_o_resultado():
+    grupo = GrupoCoalescencia("teste_descartar", ttl=60)
+    valor = {"atual": "antes"}
+    lido = asyncio.Event()
+
+    async def ler():
+        atual = valor["atual"]
+        lido.set()
+        await asyncio.sleep(0.01)
+        return atual
+
+    async def cenario():
+        em_andamento = asyncio.create_task(grupo.executar("p1", ler))
+        await lido.wait()
+        valor["atual"] = "depois"
+        grupo.descartar("p1")
+        return await em_andamento, await grupo.executar("p1", ler)
+
+    assert asyncio.run(cenario()) == ("antes", "depois")
+
+
+def test_leitura_depois_da_escrita_nao_vem_do_micro_ttl(com_banco, monkeypatch):
+    monkeypatch.setattr(cache_http, "cache", cache_http.CacheMemoria())
+    monkeypatch.setattr(rotas_produtos, "leituras_produto", GrupoCoalescencia("teste_escrita", ttl=60))
+
+    async def cenario(db):
+        monkeypatch.setattr(rotas_produtos, "produtos_collection", db.produtos)
+        produto = {"nome": "Vaso", "descricao": "", "preco_base": 10.0, "categoria": "Decoração"}
+        produto_id = str((await db.produtos.insert_one(dict(produto))).inserted_id)
+        app = FastAPI()
+        app.include_router(rotas_produtos.router)
+        app.dependency_overrides[get_db] = lambda: db
+        transporte = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://teste") as cliente:
+            antes = await cliente.get(f"/produtos/get_by_id/{produto_id}")
+            atualizacao = await cliente.put(f"/produtos/update/{produto_id}", json={**produto, "nome": "Jarro"})
+            depois = await cliente.get(f"/produtos/get_by_id/{produto_id}")
+            guardada = await cliente.get(f"/produtos/get_by_id/{produto_id}")
+        return antes, atualizacao, depois, guardada
+
+    antes, atualizacao, depois, guardada = com_banco(cenario)
+    assert antes.json()["nome"] == "Vaso"
+    assert atualizacao.status_code == 200
+    assert depois.headers["x-cache"] == "MISS" and depois.json()["nome"] == "Jarro"
+    assert guardada.headers["x-cache"] == "HIT" and guardada.json()["nome"] == "Jarro"
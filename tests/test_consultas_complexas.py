@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pagination import PaginationParams
+from routes.consultasComplexas import (
+    _pipeline_gastos_por_regiao, _pipeline_promocoes_por_categoria, historico_pedidos_usuario, vendas_por_categoria
+)
+from services.carregadores import Carregadores
+from services.rollups import COLECAO_ROLLUPS, inicio_do_dia
+
+
+def test_itens_sem_categoria_somam_na_mesma_linha(com_banco):
+    async def cenario(db):
+        agora = datetime.now()
+        # Dia parcial do início da janela: vem direto dos pedidos
+        await db.pedidos.insert_one({
+            "data_pedido": agora - timedelta(days=30) + timedelta(minutes=1),
+            "status": "Entregue",
+            "itens": [{"id_produto": ObjectId(), "quantidade": 1, "preco_unitario": 10.0}]
+        })
+        # Dias completos: vêm dos rollups
+        await db[COLECAO_ROLLUPS].insert_many([
+            {"dia": inicio_do_dia(agora - timedelta(days=5)), "id_produto": ObjectId(), "categoria": None,
+             "estado": None, "status": "Entregue", "unidades": 2, "receita": 30.0, "itens": 1},
+            {"dia": inicio_do_dia(agora - timedelta(days=5)), "id_produto": ObjectId(), "categoria": "Decoração",
+             "estado": None, "status": "Entregue", "unidades": 1, "receita": 5.0, "itens": 1},
+        ])
+        return await vendas_por_categoria(categoria=None, incluir_pedidos=False, pagination=PaginationParams(), db=db)
+
+    assert com_banco(cenario) == [
+        {"categoria": "Decoração", "quantidade_vendida": 1, "valor_vendido": 5.0},
+        {"categoria": "Indefinido", "quantidade_vendida": 3, "valor_vendido": 40.0},
+    ]
+
+
+def test_gastos_usam_o_nome_do_produto_da_compra_mais_recente(com_banco):
+    async def cenario(db):
+        usuario_id, produto_id = ObjectId(), ObjectId()
+        agora = datetime.now()
+        # Inseridos fora da ordem de data: o nome não pode depender da ordem de leitura
+        await db.pedidos.insert_many([
+            {"id_usuario": usuario_id, "data_pedido": agora - timedelta(days=1), "regiao_entrega": {"cidade": "quixada", "estado": "ce"},
+             "itens": [{"id_produto": produto_id, "nome_produto": "Vaso novo", "quantidade": 1, "preco_unitario": 10.0}]},
+            {"id_usuario": usuario_id, "data_pedido": agora - timedelta(days=9), "regiao_entrega": {"cidade": "quixada", "estado": "ce"},
+             "itens": [{"id_produto": produto_id, "nome_produto": "Vaso antigo", "quantidade": 2, "preco_unitario": 10.0}]},
+        ])
+        # Até a soma por (usuário, produto): o mongomock não tem o $topN da etapa seguinte
+        pipeline = _pipeline_gastos_por_regiao("Quixadá", None, 30, 10)[:4]
+        return await db.pedidos.aggregate(pipeline).to_list(length=None)
+
+    [linha] = com_banco(cenario)
+    assert linha["nome"] == "Vaso novo"
+    assert linha["quantidade_comprada"] == 3
+
+
+def test_promocoes_contam_a_promocao_gravada_no_item(com_banco):
+    async def cenario(db):
+        promocao_id, produto_id = ObjectId(), ObjectId()
+        agora = datetime.utcnow()
+        await db.pedidos.insert_many([
+            # Promoção aplicada na compra, mesmo que o produto tenha saído dos produtos_aplicaveis depois
+            {"id_usuario": ObjectId(), "data_pedido": agora - timedelta(days=2), "valor_total": 20.0,
+             "itens": [{"id_produto": produto_id, "nome_produto": "Vaso", "id_promocao": promocao_id,
+                        "quantidade": 2, "preco_unitario": 10.0}]},
+            # Mesmo produto comprado sem a promoção: fora do relatório
+            {"id_usuario": ObjectId(), "data_pedido": agora - timedelta(days=1), "valor_total": 15.0,
+             "itens": [{"id_produto": produto_id, "nome_produto": "Vaso", "quantidade": 1, "preco_unitario": 15.0}]},
+        ])
+        # Até a escolha da promoção e da categoria de cada item: o mongomock não avalia os grupos seguintes
+        pipeline = _pipeline_promocoes_por_categoria([promocao_id], agora - timedelta(days=30), 50)[:4]
+        return await db.pedidos.aggregate(pipeline).to_list(length=None)
+
+    [item] = com_banco(cenario)
+    assert item["valor_total"] == 20.0
+    assert item["categoria"] == "Indefinido"
+
+
+def test_historico_completo_sem_pagina_e_marca_ausente_como_na(com_banco):
+    async def cenario(db):
+        usuario_id = (await db.usuarios.insert_one({"nome": "Ana", "email": "ana@x.com"})).inserted_id
+        agora = datetime.utcnow()
+        await db.pedidos.insert_many([
+            {"id_usuario": usuario_id, "data_pedido": agora - timedelta(days=dias), "status": "Entregue",
+             "itens": [{"id_produto": ObjectId(), "nome_produto": f"Vaso {dias}", "quantidade": 1, "preco_unitario": 10.0}]}
+            for dias in range(12)
+        ])
+        completo = await historico_pedidos_usuario(str(usuario_id), page=None, per_page=None, db=db, carregadores=Carregadores(db))
+        pagina = await historico_pedidos_usuario(str(usuario_id), page=2, per_page=None, db=db, carregadores=Carregadores(db))
+        return completo, pagina
+
+    completo, pagina = com_banco(cenario)
+    assert set(completo) == {"usuario", "total_pedidos", "historico"}
+    assert completo["total_pedidos"] == len(completo["historico"]) == 12
+    assert completo["historico"][0]["itens"][0]["nome_produto"] == "Vaso 0"
+    assert completo["historico"][0]["itens"][0]["marca"] == "N/A"
+    assert (pagina["page"], pagina["per_page"], pagina["total_pedidos"]) == (2, 10, 12)
+    assert [pedido["itens"][0]["nome_produto"] for pedido in pagina["historico"]] == ["Vaso 10", "Vaso 11"]
@@ -0,0 +1,136 @@
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from models.pedido_model import PedidoCreate
+import routes.pedidos as rotas_pedidos
+from services.carregadores import Carregadores
+from services.estoque import EstoqueInsuficiente, cancelar_reserva, confirmar_reserva, reservar_estoque
+
+
+@pytest.fixture
+def com_loja(com_banco, monkeypatch):
+    """Banco com um usuário e um produto com duas variações (A e B); criar_pedido grava nele."""
+    def executar(cenario):
+        async def com_colecoes(db):
+            monkeypatch.setattr(rotas_pedidos, "pedidos_collection", db.pedidos)
+            monkeypatch.setattr(rotas_pedidos, "variacao_collection", db.variacoes_produto)
+            usuario_id = (await db.usuarios.insert_one({"nome": "Ana", "endereco_de_entrega": {"cidade": "Quixadá", "estado": "CE"}})).inserted_id
+            produto_id = (await db.produtos.insert_one({"nome": "Vaso", "categoria": "Decoração", "preco_base": 10.0})).inserted_id
+            await db.variacoes_produto.insert_many([
+                {"produto_id": produto_id, "sku": "A", "atributos": {}, "preco_adicional": 0.0, "estoque": 2},
+                {"produto_id": produto_id, "sku": "B", "atributos": {}, "preco_adicional": 0.0, "estoque": 10},
+            ])
+            return await cenario(db, str(usuario_id))
+        return com_banco(com_colecoes)
+    return executar
+
+
+def _pedido(usuario_id: str, **quantidades: int) -> PedidoCreate:
+    return PedidoCreate(
+        id_usuario=usuario_id, forma_pagamento="Pix",
+        itens=[{"sku_selecionado": sku, "quantidade": quantidade} for sku, quantidade in quantidades.items()]
+    )
+
+
+async def _criar(db, pedido: PedidoCreate):
+    try:
+        return await rotas_pedidos.criar_pedido(pedido, db=db, carregadores=Carregadores(db))
+    except HTTPException as erro:
+        return erro
+
+
+async def _variacoes(db):
+    return {doc["sku"]: doc async for doc in db.variacoes_produto.find({}, {"_id": 0, "sku": 1, "estoque": 1, "reservas": 1})}
+
+
+class EscritasContadas:
+    """Coleção que conta as idas ao banco feitas pelas funções de estoque."""
+
+    def __init__(self, colecao):
+        self._colecao = colecao
+        self.escritas = 0
+
+    def __getattr__(self, nome):
+        return getattr(self._colecao, nome)
+
+    async def bulk_write(self, *args, **kwargs):
+        self.escritas += 1
+        return await self._colecao.bulk_write(*args, **kwargs)
+
+    async def update_many(self, *args, **kwargs):
+        self.escritas += 1
+        return await self._colecao.update_many(*args, **kwargs)
+
+
+def test_pedido_abate_o_estoque_sem_deixar_marcas_de_reserva(com_loja, monkeypatch):
+    async def cenario(db, usuario_id):
+        variacoes = EscritasContadas(db.variacoes_produto)
+        monkeypatch.setattr(rotas_pedidos, "variacao_collection", variacoes)
+        pedido = await _criar(db, _pedido(usuario_id, A=2, B=1))
+        return pedido, variacoes.escritas, await _variacoes(db)
+
+    pedido, escritas, variacoes = com_loja(cenario)
+    assert [item.sku_selecionado for item in pedido.itens] == ["A", "B"]
+    # Reserva e confirmação: uma ida ao banco cada
+    assert escritas == 2
+    assert variacoes == {"A": {"sku": "A", "estoque": 0}, "B": {"sku": "B", "estoque": 9}}
+
+
+def test_compra_concorrente_entre_a_leitura_e_a_reserva_nao_vende_a_mais(com_loja, monkeypatch):
+    # Outro checkout leva uma unidade de A depois que este leu o estoque (2) e antes de reservar
+    reservar = rotas_pedidos.reservar_estoque
+
+    async def reservar_depois_de_outra_compra(colecao, reserva_id, quantidades):
+        await colecao.update_one({"sku": "A"}, {"$inc": {"estoque": -1}})
+        await reservar(colecao, reserva_id, quantidades)
+    monkeypatch.setattr(rotas_pedidos, "reservar_estoque", reservar_depois_de_outra_compra)
+
+    async def cenario(db, usuario_id):
+        erro = await _criar(db, _pedido(usuario_id, B=3, A=2))
+        return erro, await _variacoes(db), await db.pedidos.count_documents({})
+
+    erro, variacoes, pedidos = com_loja(cenario)
+    assert erro.status_code == 400 and "'A'" in erro.detail
+    # A reserva de B, feita no mesmo bulk_write, foi devolvida
+    assert variacoes == {"A": {"sku": "A", "estoque": 1}, "B": {"sku": "B", "estoque": 10}}
+    assert pedidos == 0
+
+
+def test_falha_ao_gravar_o_pedido_devolve_o_estoque(com_loja, monkeypatch):
+    async def cenario(db, usuario_id):
+        async def falhar(documento):
+            raise ConnectionError("banco indisponível")
+        monkeypatch.setattr(rotas_pedidos.pedidos_collection, "insert_one", falhar)
+        with pytest.raises(ConnectionError):
+            await rotas_pedidos.criar_pedido(_pedido(usuario_id, A=1, B=2), db=db, carregadores=Carregadores(db))
+        return await _variacoes(db)
+
+    assert com_loja(cenario) == {"A": {"sku": "A", "estoque": 2}, "B": {"sku": "B", "estoque": 10}}
+
+
+def test_reserva_sem_itens_nao_faz_nada(com_banco):
+    async def cenario(db):
+        colecao = db.variacoes_produto
+        await colecao.insert_one({"sku": "A", "estoque": 1})
+        reserva_id = ObjectId()
+        await reservar_estoque(colecao, reserva_id, {})
+        await confirmar_reserva(colecao, reserva_id, {})
+        await cancelar_reserva(colecao, reserva_id, {})
+        return await colecao.find_one({"sku": "A"})
+
+    assert com_banco(cenario)["estoque"] == 1
+
+
+def test_falha_parcial_devolve_as_reservas_feitas(com_banco):
+    async def cenario(db):
+        colecao = db.variacoes_produto
+        await colecao.insert_many([{"sku": "A", "estoque": 5}, {"sku": "B", "estoque": 1}])
+        try:
+            await reservar_estoque(colecao, ObjectId(), {"A": 2, "B": 3})
+        except EstoqueInsuficiente as erro:
+            faltantes = erro.skus
+        return faltantes, [doc async for doc in colecao.find({}, {"_id": 0}).sort("sku", 1)]
+
+    faltantes, docs = com_banco(cenario)
+    assert faltantes == ["B"]
+    assert docs == [{"sku": "A", "estoque": 5}, {"sku": "B", "estoque": 1}]
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+import cache_http
+from cache_http import CacheMemoria, invalidar_cache
+from services.indice_promocoes import IndicePromocoes
+
+
+def _promocao(nome: str, agora: datetime, **janela) -> dict:
+    return {
+        "nome": nome,
+        "produtos_aplicaveis": [],
+        "data_inicio": janela.get("inicio", agora - timedelta(days=1)),
+        "data_fim": janela.get("fim", agora + timedelta(days=1)),
+    }
+
+
+def test_escrita_invalidada_recarrega_o_indice(com_banco, monkeypatch):
+    monkeypatch.setattr(cache_http, "cache", CacheMemoria())
+
+    async def cenario(db):
+        agora = datetime.utcnow()
+        indice = IndicePromocoes(db.promocoes, ttl=3600)
+        await db.promocoes.insert_one(_promocao("Vigente", agora))
+        primeira = await indice.promocoes_ativas(agora)
+        await db.promocoes.insert_one(_promocao("Nova", agora))
+        sem_invalidar = await indice.promocoes_ativas(agora)
+        # Mesmo caminho das rotas de promoções: grava e invalida a tag
+        await invalidar_cache("promocoes")
+        return primeira, sem_invalidar, await indice.promocoes_ativas(agora)
+
+    primeira, sem_invalidar, depois = com_banco(cenario)
+    assert [promocao["nome"] for promocao in primeira] == ["Vigente"]
+    assert [promocao["nome"] for promocao in sem_invalidar] == ["Vigente"]
+    assert [promocao["nome"] for promocao in depois] == ["Vigente", "Nova"]
+
+
+def test_vigencia_segue_o_relogio_de_quem_consulta(com_banco, monkeypatch):
+    monkeypatch.setattr(cache_http, "cache", CacheMemoria())
+
+    async def cenario(db):
+        agora = datetime.utcnow()
+        indice = IndicePromocoes(db.promocoes, ttl=3600)
+        await db.promocoes.insert_many([
+            _promocao("Encerra", agora, fim=agora + timedelta(hours=1)),
+            _promocao("Agendada", agora, inicio=agora + timedelta(hours=2)),
+        ])
+        return [
+            [promocao["nome"] for promocao in await indice.promocoes_ativas(momento)]
+            for momento in (agora, agora + timedelta(hours=3))
+        ]
+
+    assert com_banco(cenario) == [["Encerra"], ["Agendada"]]
+
+
+def test_sem_o_cache_vale_o_ttl(com_banco, monkeypatch):
+    class CacheIndisponivel(CacheMemoria):
+        async def geracoes(self, tags):
+            raise ConnectionError("cache indisponível")
+
+    monkeypatch.setattr(cache_http, "cache", CacheIndisponivel())
+
+    async def cenario(db):
+        agora = datetime.utcnow()
+        indice = IndicePromocoes(db.promocoes, ttl=0)
+        await db.promocoes.insert_one(_promocao("Vigente", agora))
+        primeira = await indice.promocoes_ativas(agora)
+        await db.promocoes.insert_one(_promocao("Nova", agora))
+        return len(primeira), len(await indice.promocoes_ativas(agora))
+
+    assert com_banco(cenario) == (1, 2)
@@ -0,0 +1,43 @@
+import contextvars
+from types import SimpleNamespace
+from bson import ObjectId
+from instrumentacao import forma_consulta, iniciar_requisicao, monitor_comandos
+
+
+def _executar(comando_nome: str, comando: dict, request_id: int, duracao_us: int = 1000) -> None:
+    # Eventos no formato dos que o driver entrega ao CommandListener
+    monitor_comandos.started(SimpleNamespace(command_name=comando_nome, command=comando, request_id=request_id))
+    monitor_comandos.succeeded(SimpleNamespace(command_name=comando_nome, request_id=request_id, duration_micros=duracao_us))
+
+
+def test_forma_ignora_valores_do_filtro():
+    primeira = forma_consulta("find", {"find": "produtos", "filter": {"_id": ObjectId(), "estoque": {"$gt": 1}}})
+    segunda = forma_consulta("find", {"find": "produtos", "filter": {"estoque": {"$gt": 7}, "_id": ObjectId()}})
+    outra = forma_consulta("find", {"find": "produtos", "filter": {"sku": "A"}})
+    assert primeira == segunda != outra
+
+
+def test_consulta_repetida_por_item_e_marcada_como_n_mais_um():
+    def requisicao():
+        estatisticas = iniciar_requisicao()
+        for numero in range(12):
+            _executar("find", {"find": "produtos", "filter": {"_id": ObjectId()}}, request_id=numero)
+        _executar("find", {"find": "pedidos", "filter": {"id_usuario": ObjectId()}}, request_id=100)
+        _executar("getMore", {"getMore": 1, "collection": "pedidos"}, request_id=101)
+        return estatisticas
+
+    estatisticas = contextvars.copy_context().run(requisicao)
+    forma_produtos = forma_consulta("find", {"find": "produtos", "filter": {"_id": "?"}})
+    assert estatisticas.suspeitas_n_mais_um(limite=10) == {forma_produtos: 12}
+    # getMore conta como ida ao banco, mas não como uma nova consulta
+    assert estatisticas.comandos == 14
+    assert sum(forma.execucoes for forma in estatisticas.formas.values()) == 13
+    assert estatisticas.resumo()["duracao_ms"] == 14.0
+
+
+def test_comandos_fora_de_requisicao_sao_ignorados():
+    def sem_requisicao():
+        _executar("find", {"find": "produtos", "filter": {}}, request_id=1)
+        return iniciar_requisicao()
+
+    assert contextvars.copy_context().run(sem_requisicao).comandos == 0
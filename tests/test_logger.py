@@ -0,0 +1,51 @@
+import time
+import logger as modulo_logger
+from logger import get_logger
+
+
+def _aguardar(condicao, limite: float = 5.0) -> bool:
+    fim = time.monotonic() + limite
+    while time.monotonic() < fim:
+        if condicao():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class _Contador:
+    def __init__(self):
+        self.formatacoes = 0
+
+    def __str__(self):
+        self.formatacoes += 1
+        return "produto"
+
+
+def test_registros_chegam_ao_arquivo_formatados_fora_da_chamada(tmp_path, monkeypatch):
+    caminho = tmp_path / "teste.log"
+    logger = get_logger("teste_logger_arquivo", str(caminho))
+    # Os handlers de captura do pytest no logger raiz formatariam o registro na chamada
+    monkeypatch.setattr(logger, "propagate", False)
+    argumento = _Contador()
+
+    logger.info("Pedido %s criado para %s.", 42, argumento)
+    logger.debug("Ignorado: %s", argumento)
+    # A chamada só enfileira: nada foi formatado na thread de quem registrou
+    formatacoes_na_chamada = argumento.formatacoes
+
+    assert _aguardar(lambda: caminho.exists() and "Pedido 42 criado para produto." in caminho.read_text(encoding="utf-8"))
+    assert formatacoes_na_chamada == 0
+    assert argumento.formatacoes == 1
+    assert "Ignorado" not in caminho.read_text(encoding="utf-8")
+
+
+def test_arquivo_rotaciona_por_tamanho(tmp_path, monkeypatch):
+    monkeypatch.setattr(modulo_logger, "LOG_MAX_BYTES", 200)
+    caminho = tmp_path / "rotativo.log"
+    logger = get_logger("teste_logger_rotacao", str(caminho))
+
+    for numero in range(20):
+        logger.info("Linha %s com algum texto para encher o arquivo.", numero)
+
+    assert _aguardar(lambda: (tmp_path / "rotativo.log.1").exists())
+    assert _aguardar(lambda: "Linha 19 " in caminho.read_text(encoding="utf-8"))
@@ -0,0 +1,20 @@
+from pagination import PaginationParams, count_total
+
+
+def test_total_exato_por_padrao_e_estimado_so_quando_pedido(com_banco):
+    async def cenario(db):
+        filtro = {"status": "Entregue"}
+        await db.pedidos.insert_one({"status": "Entregue"})
+        exato_antes = await count_total(db.pedidos, filtro)
+        estimado_antes = await count_total(db.pedidos, filtro, "estimated")
+        await db.pedidos.insert_one({"status": "Entregue"})
+        return (
+            exato_antes,
+            estimado_antes,
+            await count_total(db.pedidos, filtro),
+            # Servido do cache do filtro, ainda sem o segundo pedido
+            await count_total(db.pedidos, filtro, "estimated"),
+        )
+
+    assert PaginationParams().count == "exact"
+    assert com_banco(cenario) == (1, 1, 2, 1)
@@ -0,0 +1,69 @@
+from datetime import datetime
+import pytest
+from bson import ObjectId
+from pagination import PaginationParams
+import routes.pedidos as rotas_pedidos
+from services.busca import termos_nome
+
+
+@pytest.fixture
+def com_pedidos(com_banco, monkeypatch):
+    def executar(cenario):
+        async def com_colecao(db):
+            monkeypatch.setattr(rotas_pedidos, "pedidos_collection", db.pedidos)
+            return await cenario(db)
+        return com_banco(com_colecao)
+    return executar
+
+
+async def _pedido_com(db, *nomes: str) -> ObjectId:
+    # Itens como criar_pedido os grava, com os termos do nome no momento da compra
+    resultado = await db.pedidos.insert_one({
+        "id_usuario": ObjectId(),
+        "data_pedido": datetime.now(),
+        "status": "Pendente",
+        "forma_pagamento": "Pix",
+        "valor_total": 10.0,
+        "itens": [{
+            "id_produto": ObjectId(), "nome_produto": nome, "termos_nome": termos_nome({"nome": nome}),
+            "sku_selecionado": "SKU", "atributos_selecionados": {}, "quantidade": 1, "preco_unitario": 10.0
+        } for nome in nomes]
+    })
+    return resultado.inserted_id
+
+
+async def _ids_por_nome(nome_produto: str):
+    pagina = await rotas_pedidos.pesquisar_pedidos(pagination=PaginationParams(count="exact"), nome_produto=nome_produto)
+    return pagina.total, sorted(pedido.id for pedido in pagina.items)
+
+
+def test_filtro_de_pedidos_usa_o_nome_gravado_na_compra(com_pedidos):
+    async def cenario(db):
+        com_vaso = await _pedido_com(db, "Vaso de Cerâmica")
+        await _pedido_com(db, "Quadro")
+        # O produto pode ter sido renomeado ou removido: o nome do item no pedido não muda
+        await db.produtos.insert_one({"nome": "Jarro", "termos_nome": ["jarro"]})
+        return com_vaso, await _ids_por_nome("ceramica"), await _ids_por_nome("jarro")
+
+    com_vaso, por_ceramica, por_nome_atual = com_pedidos(cenario)
+    assert por_ceramica == (1, [com_vaso])
+    assert por_nome_atual == (0, [])
+
+
+def test_todas_as_palavras_precisam_estar_no_mesmo_item(com_pedidos):
+    async def cenario(db):
+        mesmo_item = await _pedido_com(db, "Vaso Azul")
+        await _pedido_com(db, "Vaso Verde", "Caneca Azul")
+        return mesmo_item, await _ids_por_nome("vaso azul")
+
+    mesmo_item, encontrados = com_pedidos(cenario)
+    assert encontrados == (1, [mesmo_item])
+
+
+def test_nome_sem_palavras_nao_filtra(com_pedidos):
+    async def cenario(db):
+        ids = [await _pedido_com(db, "Vaso"), await _pedido_com(db, "Quadro")]
+        return sorted(ids), await _ids_por_nome(" - ")
+
+    ids, encontrados = com_pedidos(cenario)
+    assert encontrados == (2, ids)
@@ -0,0 +1,65 @@
+from datetime import timedelta
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+import services.precos_efetivos as precos_efetivos
+from services.precos_efetivos import (
+    COLECAO_PRECOS, PRECOS_VALIDADE_MAXIMA, atualizar_precos, calcular_precos, gravar_precos
+)
+
+
+async def _catalogo(db, preco_base=100.0):
+    produto_id = ObjectId()
+    await db.produtos.insert_one({"_id": produto_id, "nome": "Camiseta", "categoria": "Roupas", "marca": "M", "preco_base": preco_base})
+    await db.variacoes_produto.insert_one({"_id": ObjectId(), "produto_id": produto_id, "sku": "CAM-P", "preco_adicional": 0})
+    await db[COLECAO_PRECOS].create_index("sku", unique=True)
+    return produto_id
+
+
+def test_toda_entrada_tem_validade_finita_e_ve_promocoes_recem_criadas(com_banco):
+    async def cenario(db):
+        produto_id = await _catalogo(db)
+        agora = precos_efetivos._agora()
+        await atualizar_precos(db, [produto_id])
+        sem_promocao = await db[COLECAO_PRECOS].find_one({"sku": "CAM-P"})
+        await db.promocoes.insert_one({
+            "_id": ObjectId(), "nome": "Queima", "produtos_aplicaveis": [produto_id],
+            "data_inicio": agora - timedelta(days=1), "data_fim": agora + timedelta(days=1),
+            "tipo_desconto": "porcentagem", "valor_desconto": 10
+        })
+        await atualizar_precos(db, [produto_id])
+        return agora, sem_promocao, await db[COLECAO_PRECOS].find_one({"sku": "CAM-P"})
+
+    agora, sem_promocao, com_promocao = com_banco(cenario)
+    assert sem_promocao["valido_ate"] is not None
+    assert sem_promocao["valido_ate"] <= agora + PRECOS_VALIDADE_MAXIMA + timedelta(seconds=5)
+    # Lida do banco, a promoção criada vale já no recálculo seguinte, em qualquer processo
+    assert com_promocao["em_promocao"] and com_promocao["preco_final"] == 90.0
+
+
+def test_calculo_antigo_nao_sobrescreve_o_mais_novo(com_banco):
+    async def cenario(db):
+        produto_id = await _catalogo(db)
+        antigo = await calcular_precos(db, [produto_id])
+        await db.produtos.update_one({"_id": produto_id}, {"$set": {"preco_base": 120.0}})
+        novo = await calcular_precos(db, [produto_id])
+        novo["CAM-P"]["atualizado_em"] = antigo["CAM-P"]["atualizado_em"] + timedelta(seconds=1)
+        await gravar_precos(db, [produto_id], novo)
+        await gravar_precos(db, [produto_id], antigo)
+        return await db[COLECAO_PRECOS].find_one({"sku": "CAM-P"})
+
+    assert com_banco(cenario)["preco_final"] == 120.0
+
+
+def test_falha_no_recalculo_remove_as_entradas(com_banco, monkeypatch):
+    async def falhar(db, ids):
+        raise PyMongoError("banco indisponível")
+
+    async def cenario(db):
+        produto_id = await _catalogo(db)
+        await atualizar_precos(db, [produto_id])
+        monkeypatch.setattr(precos_efetivos, "calcular_precos", falhar)
+        await atualizar_precos(db, [produto_id])
+        return await db[COLECAO_PRECOS].count_documents({})
+
+    # Sem entrada, o checkout calcula o preço na hora em vez de usar o preço antigo
+    assert com_banco(cenario) == 0
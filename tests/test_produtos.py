@@ -0,0 +1,61 @@
+import pytest
+from bson import ObjectId
+from models.produto_model import ProdutoCreate, ProdutoImportacao
+from pagination import PaginationParams
+import routes.produtos as rotas_produtos
+
+
+@pytest.fixture
+def com_produtos(com_banco, monkeypatch):
+    def executar(cenario):
+        async def com_colecao(db):
+            monkeypatch.setattr(rotas_produtos, "produtos_collection", db.produtos)
+            return await cenario(db)
+        return com_banco(com_colecao)
+    return executar
+
+
+def _produto(**campos) -> ProdutoCreate:
+    return ProdutoCreate(**{"descricao": "", "preco_base": 10.0, "categoria": "Decoração", **campos})
+
+
+def test_filtro_por_nome_ignora_descricao_e_marca(com_produtos):
+    async def cenario(db):
+        await rotas_produtos.criar_produto(_produto(nome="Vaso de Decoração"))
+        await rotas_produtos.criar_produto(_produto(nome="Vaso simples", descricao="Ótimo para decoração"))
+        await rotas_produtos.criar_produto(_produto(nome="Quadro", marca="Decor & Cia"))
+        pagina = await rotas_produtos.pesquisar_produtos(nome="decor", pagination=PaginationParams(count="none"))
+        return pagina.items
+
+    itens = com_produtos(cenario)
+    assert [item.nome for item in itens] == ["Vaso de Decoração"]
+
+
+def test_atualizacao_grava_termos_com_a_marca_guardada(com_produtos):
+    async def cenario(db):
+        criado = await rotas_produtos.criar_produto(_produto(nome="Luminária", marca="Lumos"))
+        dados = ProdutoCreate.model_validate({"nome": "Abajur", "descricao": "Mesa", "preco_base": 20.0, "categoria": "Decoração"})
+        await rotas_produtos.atualizar_produto(str(criado.id), dados, db)
+        return await db.produtos.find_one({"_id": criado.id})
+
+    produto = com_produtos(cenario)
+    assert produto["termos_nome"] == ["abajur"]
+    assert produto["termos_busca"] == ["abajur", "lumos", "mesa"]
+
+
+def test_importacao_rejeita_id_repetido_no_lote(com_produtos):
+    produto_id = ObjectId()
+    lote = [
+        (1, ProdutoImportacao(_id=produto_id, nome="Primeiro", descricao="", preco_base=1.0, categoria="Decoração")),
+        (2, ProdutoImportacao(_id=produto_id, nome="Segundo", descricao="", preco_base=2.0, categoria="Decoração")),
+    ]
+
+    async def cenario(db):
+        resultados = await rotas_produtos._gravar_lote_produtos(db, lote)
+        return resultados, await db.produtos.find_one({"_id": produto_id})
+
+    resultados, produto = com_produtos(cenario)
+    por_linha = {resultado["linha"]: resultado for resultado in resultados}
+    assert por_linha[1]["status"] == "criado"
+    assert por_linha[2] == {"linha": 2, "status": "erro", "erro": f"_id '{produto_id}' repetido no lote."}
+    assert produto["nome"] == "Primeiro"
@@ -0,0 +1,38 @@
+from datetime import datetime
+import services.rollups as rollups
+from services.rollups import COLECAO_ROLLUPS, verificar_rollups
+
+
+def _contar_reconstrucoes(monkeypatch):
+    chamadas = []
+
+    async def reconstruir(db):
+        chamadas.append(db)
+
+    monkeypatch.setattr(rollups, "reconstruir_rollups", reconstruir)
+    return chamadas
+
+
+def test_rollups_vazios_com_pedidos_sao_apontados_sem_reconstruir(com_banco, monkeypatch):
+    chamadas = _contar_reconstrucoes(monkeypatch)
+
+    async def cenario(db):
+        sem_pedidos = await verificar_rollups(db)
+        await db.pedidos.insert_one({"data_pedido": datetime(2024, 1, 1), "status": "Entregue", "itens": []})
+        return sem_pedidos, await verificar_rollups(db)
+
+    assert com_banco(cenario) == (True, False)
+    # A reconstrução fica para a linha de comando, fora da subida da aplicação
+    assert chamadas == []
+
+
+def test_rollups_existentes_sao_aceitos(com_banco, monkeypatch):
+    chamadas = _contar_reconstrucoes(monkeypatch)
+
+    async def cenario(db):
+        await db.pedidos.insert_one({"data_pedido": datetime(2024, 1, 1), "status": "Entregue", "itens": []})
+        await db[COLECAO_ROLLUPS].insert_one({"dia": datetime(2024, 1, 1), "unidades": 1})
+        return await verificar_rollups(db)
+
+    assert com_banco(cenario) is True
+    assert chamadas == []
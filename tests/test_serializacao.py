@@ -0,0 +1,50 @@
+import asyncio
+from datetime import datetime
+import httpx
+import pytest
+from bson import ObjectId
+from fastapi import Depends, FastAPI
+from models.pedido_model import PedidoOut
+from models.produto_model import ProdutoOut
+from models.promocao_model import PromocaoOut
+from models.usuario_model import UserOut
+from models.variacao_produto import VariacaoOut
+from pagination import PaginatedResponse, PaginationParams
+import serializacao
+
+AGORA = datetime(2024, 5, 17, 10, 30, 15, 123000)
+
+DOCUMENTOS = {
+    PedidoOut: {
+        "_id": ObjectId(), "id_usuario": ObjectId(), "data_pedido": AGORA, "valor_total": 99.9, "status": "Pendente",
+        "forma_pagamento": "Pix", "estado_entrega": "SP",
+        "itens": [{"id_produto": ObjectId(), "nome_produto": "Vaso", "sku_selecionado": "V-1",
+                   "atributos_selecionados": {"cor": "azul"}, "quantidade": 1, "preco_unitario": 99.9}]
+    },
+    ProdutoOut: {"_id": ObjectId(), "nome": "Vaso", "descricao": "", "preco_base": 10.0, "categoria": "Decoração",
+                 "data_de_cadastro": AGORA, "termos_busca": ["vaso"]},
+    PromocaoOut: {"_id": ObjectId(), "nome": "Queima", "data_inicio": AGORA, "data_fim": AGORA, "tipo_desconto": "porcentagem",
+                  "valor_desconto": 10.0, "produtos_aplicaveis": [ObjectId()]},
+    UserOut: {"_id": ObjectId(), "nome": "Ana", "email": "ana@exemplo.com", "data_de_cadastro": AGORA, "telefone": "1",
+              "endereco_de_entrega": {"rua": "A", "numero": "1", "bairro": "B", "cidade": "C", "estado": "D", "cep": "0"}},
+    VariacaoOut: {"_id": ObjectId(), "produto_id": ObjectId(), "sku": "V-1", "atributos": {"cor": "azul"},
+                  "preco_adicional": 0.0, "estoque": 3, "urls_imagens": []},
+}
+
+
+@pytest.mark.parametrize("modelo", list(DOCUMENTOS), ids=lambda modelo: modelo.__name__)
+def test_caminho_rapido_gera_o_mesmo_json(modelo, monkeypatch):
+    app = FastAPI()
+
+    @app.get("/lista", response_model=PaginatedResponse[modelo])
+    async def listar(pagination: PaginationParams = Depends()):
+        return serializacao.resposta_paginada(modelo, [DOCUMENTOS[modelo]] * 3, 3, pagination, "cursor")
+
+    async def obter():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://teste") as cliente:
+            return (await cliente.get("/lista")).json()
+
+    monkeypatch.setattr(serializacao, "SERIALIZACAO_RAPIDA", False)
+    padrao = asyncio.run(obter())
+    monkeypatch.setattr(serializacao, "SERIALIZACAO_RAPIDA", True)
+    assert asyncio.run(obter()) == padrao
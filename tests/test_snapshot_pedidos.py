@@ -0,0 +1,43 @@
+from datetime import datetime
+from bson import ObjectId
+from routes.consultasComplexas import _filtro_regiao
+from services.snapshot_pedidos import preencher_snapshot_pedidos
+
+
+def test_migracao_preenche_regiao_de_entrega_normalizada(com_banco):
+    async def cenario(db):
+        usuario_id = ObjectId()
+        await db.usuarios.insert_one({"_id": usuario_id, "endereco_de_entrega": {"cidade": "Quixadá", "estado": "Ceará"}})
+        await db.pedidos.insert_many([
+            # Sem retrato: tudo vem do usuário
+            {"_id": 1, "id_usuario": usuario_id, "data_pedido": datetime(2024, 1, 1), "itens": []},
+            # Retrato anterior à região normalizada: a cidade gravada na compra prevalece
+            {"_id": 2, "id_usuario": usuario_id, "data_pedido": datetime(2024, 1, 1), "itens": [],
+             "cidade_entrega": "São Paulo", "estado_entrega": "SP"},
+        ])
+        atualizados = await preencher_snapshot_pedidos(db)
+        na_regiao = [pedido["_id"] async for pedido in db.pedidos.find(_filtro_regiao(" quixada ", "CEARÁ"))]
+        return atualizados, na_regiao, await db.pedidos.find_one({"_id": 2})
+
+    atualizados, na_regiao, antigo = com_banco(cenario)
+    assert atualizados == 2
+    assert na_regiao == [1]
+    assert antigo["estado_entrega"] == "SP"
+    assert antigo["regiao_entrega"] == {"cidade": "sao paulo", "estado": "sp"}
+
+
+def test_migracao_grava_termos_do_nome_nos_itens(com_banco):
+    async def cenario(db):
+        await db.pedidos.insert_many([
+            {"_id": 1, "id_usuario": ObjectId(), "data_pedido": datetime(2024, 1, 1),
+             "itens": [{"id_produto": ObjectId(), "nome_produto": "Vaso de Cerâmica"}]},
+            {"_id": 2, "id_usuario": ObjectId(), "data_pedido": datetime(2024, 1, 1),
+             "cidade_entrega": None, "estado_entrega": None, "regiao_entrega": {"cidade": "", "estado": ""},
+             "itens": [{"id_produto": ObjectId(), "nome_produto": "Quadro"}]},
+        ])
+        atualizados = await preencher_snapshot_pedidos(db)
+        return atualizados, {pedido["_id"]: pedido["itens"][0]["termos_nome"] async for pedido in db.pedidos.find()}
+
+    atualizados, termos = com_banco(cenario)
+    assert atualizados == 2
+    assert termos == {1: ["ceramica", "de", "vaso"], 2: ["quadro"]}
@@ -0,0 +1,92 @@
+import asyncio
+import httpx
+import pytest
+from fastapi import APIRouter, FastAPI, HTTPException
+import tarefas_relatorios
+from tarefas_relatorios import GerenciadorTarefas, RotaRelatorio, executar_em_tarefa
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(tarefas_relatorios, "gerenciador_tarefas", GerenciadorTarefas(workers=2))
+    estado = {"execucoes": 0, "existe": False, "pedidos": 0}
+    router = APIRouter(route_class=RotaRelatorio)
+
+    @router.get("/relatorios/historico/{usuario}")
+    @executar_em_tarefa()
+    async def historico(usuario: str):
+        estado["execucoes"] += 1
+        if not estado["existe"]:
+            raise HTTPException(status_code=404, detail="Usuário não encontrado.")
+        return {"total_pedidos": estado["pedidos"]}
+
+    @router.get("/relatorios/ranking")
+    @executar_em_tarefa(ttl=60)
+    async def ranking(ordem: str = "receita"):
+        estado["execucoes"] += 1
+        await asyncio.sleep(0.05)
+        return {"ordem": ordem, "pedidos": estado["pedidos"]}
+
+    aplicacao = FastAPI()
+    aplicacao.include_router(router)
+    aplicacao.state.estado = estado
+    return aplicacao
+
+
+def _rodar(app, cenario):
+    async def rodar():
+        transporte = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://teste") as cliente:
+            try:
+                return await cenario(cliente)
+            finally:
+                await tarefas_relatorios.gerenciador_tarefas.encerrar()
+    return asyncio.run(rodar())
+
+
+def test_erro_nao_e_reaproveitado_e_historico_reflete_escritas(app):
+    estado = app.state.estado
+
+    async def cenario(cliente):
+        respostas = [await cliente.get("/relatorios/historico/u1")]
+        estado["existe"] = True
+        respostas.append(await cliente.get("/relatorios/historico/u1"))
+        estado["pedidos"] = 1
+        respostas.append(await cliente.get("/relatorios/historico/u1"))
+        return respostas
+
+    nao_encontrado, vazio, com_pedido = _rodar(app, cenario)
+    assert nao_encontrado.status_code == 404
+    assert vazio.status_code == 200 and vazio.json() == {"total_pedidos": 0}
+    assert com_pedido.json() == {"total_pedidos": 1}
+    assert estado["execucoes"] == 3
+
+
+def test_requisicoes_iguais_compartilham_a_execucao(app):
+    estado = app.state.estado
+
+    async def cenario(cliente):
+        simultaneas = await asyncio.gather(*[
+            cliente.get("/relatorios/ranking" + ("?ordem=receita" if i % 2 else "")) for i in range(10)
+        ])
+        estado["pedidos"] = 5
+        repetida = await cliente.get("/relatorios/ranking")
+        return simultaneas, repetida
+
+    simultaneas, repetida = _rodar(app, cenario)
+    assert {resposta.headers["x-tarefa"] for resposta in simultaneas} == {repetida.headers["x-tarefa"]}
+    # Dentro do TTL do endpoint a repetição usa o resultado guardado
+    assert repetida.json() == {"ordem": "receita", "pedidos": 0}
+    assert estado["execucoes"] == 1
+
+
+def test_modo_assincrono_devolve_id_e_resultado(app):
+    async def cenario(cliente):
+        aceita = await cliente.get("/relatorios/ranking?assincrono=true")
+        tarefa = tarefas_relatorios.gerenciador_tarefas.obter(aceita.json()["id"])
+        await tarefa.concluida.wait()
+        return aceita, tarefa.resposta_resultado()
+
+    aceita, resultado = _rodar(app, cenario)
+    assert aceita.status_code == 202
+    assert resultado.status_code == 200